@@ -3,19 +3,42 @@
 ##  A comprehensive backend system with PIM, IAM, OMS, RFQ, Auctions, and AI recommendations
 
 
-from fastapi import FastAPI, HTTPException, Depends, Query, BackgroundTasks, WebSocket
+from fastapi import FastAPI, HTTPException, Depends, Query, BackgroundTasks, WebSocket, WebSocketDisconnect, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, ValidationError
+from typing import Optional, List, Dict, Any, Callable, Iterator
+from types import MappingProxyType
 from datetime import datetime, timedelta
 from enum import Enum
 import jwt
+import numpy as np
 import hashlib
+import hmac
 import random
 import asyncio
-from collections import defaultdict
+import base64
+import concurrent.futures
+import json
+from array import array
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+import bisect
+import heapq
+import io
+import itertools
+import logging
 import math
+import os
+import pickle
+import queue
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
 
 # ============================================================================
 # CONFIGURATION & INITIALIZATION
@@ -33,7 +56,8 @@ app.add_middleware(
 
 SECRET_KEY = "indabacart-secret-key-change-in-production"
 ALGORITHM = "HS256"
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+logger = logging.getLogger("indabacart")
 
 # ============================================================================
 # ENUMS & CONSTANTS
@@ -69,12 +93,92 @@ class DisputeStatus(str, Enum):
     RESOLVED = "resolved"
     CLOSED = "closed"
 
-# Exchange rates (in production, fetch from live API)
+# Default exchange rates, served when no rate provider is configured
 EXCHANGE_RATES = {
     "ZAR": 1.0,
     "USD": 18.50,
     "ZIG": 0.05
 }
+EXCHANGE_RATES_FILE = os.environ.get("INDABACART_RATES_FILE")  # JSON {"ZAR": 1.0, ...}
+RATE_REFRESH_SECONDS = 3600
+
+# ============================================================================
+# EXCHANGE RATE TABLE
+# ============================================================================
+
+def round_money(amounts):
+    """Round a converted amount (or array of them) to cents; single and batch conversion share it"""
+    return np.round(amounts, 2)
+
+class RateTable:
+    """Immutable, versioned snapshot of exchange rates with a precomputed cross-rate matrix"""
+    
+    def __init__(self, rates: Dict[str, float], version: int):
+        self.rates = MappingProxyType(dict(rates))
+        self.version = version
+        self.fetched_at = datetime.now()
+        self.currencies = list(rates)
+        self.positions = {currency: i for i, currency in enumerate(self.currencies)}
+        vector = np.array([rates[c] for c in self.currencies], dtype=np.float64)
+        # cross[i, j]: multiply an amount in currency i by this to get currency j
+        self.cross = vector[None, :] / vector[:, None]
+    
+    def rate(self, from_currency: str, to_currency: str) -> float:
+        return float(self.cross[self.positions[from_currency], self.positions[to_currency]])
+    
+    def convert(self, amount: float, from_currency: str, to_currency: str) -> float:
+        if from_currency == to_currency:
+            return amount
+        return float(round_money(amount * self.cross[self.positions[from_currency], self.positions[to_currency]]))
+    
+    def convert_many(self, amounts: np.ndarray, from_currency: str, to_currency: str) -> np.ndarray:
+        if from_currency == to_currency:
+            return amounts
+        return round_money(amounts * self.cross[self.positions[from_currency], self.positions[to_currency]])
+
+class StaticRateProvider:
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = dict(rates)
+    
+    def fetch(self) -> Dict[str, float]:
+        return dict(self.rates)
+
+class FileRateProvider:
+    """Reads rates from a local JSON file (stand-in for a live FX feed)"""
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def fetch(self) -> Dict[str, float]:
+        with open(self.path) as f:
+            return {currency: float(rate) for currency, rate in json.load(f).items()}
+
+class ExchangeRateService:
+    """Holds the current RateTable; refreshes build a new table and swap it in atomically"""
+    
+    def __init__(self, provider):
+        self.provider = provider
+        self.current = RateTable(self._validated(provider.fetch()), version=1)
+    
+    @staticmethod
+    def _validated(rates: Dict[str, float]) -> Dict[str, float]:
+        missing = [c.value for c in Currency if c.value not in rates]
+        if missing:
+            raise ValueError(f"Rate provider is missing {', '.join(missing)}")
+        if not all(math.isfinite(rate) and rate > 0 for rate in rates.values()):
+            raise ValueError("Exchange rates must be positive and finite")
+        return rates
+    
+    def refresh(self, rates: Dict[str, float]) -> RateTable:
+        """Swap in freshly fetched rates; the version only moves when a rate changed"""
+        rates = self._validated(rates)
+        if rates != dict(self.current.rates):
+            self.current = RateTable(rates, self.current.version + 1)
+        return self.current
+
+exchange_rates = ExchangeRateService(
+    FileRateProvider(EXCHANGE_RATES_FILE) if EXCHANGE_RATES_FILE else StaticRateProvider(EXCHANGE_RATES)
+)
 
 # ============================================================================
 # PYDANTIC MODELS
@@ -142,6 +246,18 @@ class Order(BaseModel):
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
+class OrderLine(BaseModel):
+    model_config = ConfigDict(extra="allow")  # Extra line fields are kept on the order
+    
+    product_id: int
+    quantity: int = Field(gt=0)
+    sku: Optional[str] = None
+
+class BulkOrderEntry(BaseModel):
+    items: List[OrderLine] = Field(min_length=1)
+    shipping_address: Dict[str, str]
+    reservation_id: Optional[int] = None
+
 class RFQ(BaseModel):
     id: int
     buyer_id: int
@@ -246,17 +362,1244 @@ orders_db: Dict[int, Dict] = {}
 reviews_db: Dict[int, Dict] = {}
 rfqs_db: Dict[int, Dict] = {}
 auctions_db: Dict[int, Dict] = {}
-bids_db: Dict[int, Dict] = {}
+bids_db: Dict[int, Dict] = {}  # Legacy per-bid records; new bids go to bid_ledgers_db
+bid_ledgers_db: Dict[int, Any] = {}  # Auction ID -> BidLedger
 disputes_db: Dict[int, Dict] = {}
 inventory_db: Dict[str, int] = {}  # SKU -> Stock count
 escrow_db: Dict[int, float] = {}  # Order ID -> Amount held
+reservations_db: Dict[int, Dict] = {}  # Reservation ID -> Stock hold
 user_activity_db: Dict[int, List[Dict]] = defaultdict(list)  # User ID -> Activities
-price_history_db: Dict[int, List[Dict]] = defaultdict(list)  # Product ID -> Price changes
+price_history_db: Dict[int, Any] = defaultdict(list)  # Product ID -> PriceHistory
+sequences_db: Dict[str, int] = {}  # Entity -> last id leased to any worker
+
+# ============================================================================
+# PERSISTENCE (Write-ahead log + snapshots)
+# ============================================================================
+
+STORAGE_BACKEND = os.environ.get("INDABACART_STORAGE", "memory")  # "memory", "wal" or "sqlite"
+STORAGE_DIR = os.environ.get("INDABACART_DATA_DIR", "data")
+SQLITE_POOL_SIZE = 4
+SNAPSHOT_INTERVAL_SECONDS = 300
+SNAPSHOT_WAL_BYTES = 64 * 1024 * 1024  # Snapshot early once this much WAL accumulates
+
+# Every store that must survive a restart, by the name used in log records
+TABLES: Dict[str, Dict] = {
+    "users": users_db,
+    "products": products_db,
+    "orders": orders_db,
+    "reviews": reviews_db,
+    "rfqs": rfqs_db,
+    "auctions": auctions_db,
+    "bids": bids_db,
+    "bid_ledgers": bid_ledgers_db,
+    "disputes": disputes_db,
+    "inventory": inventory_db,
+    "escrow": escrow_db,
+    "reservations": reservations_db,
+    "user_activity": user_activity_db,
+    "price_history": price_history_db,
+    "sequences": sequences_db,
+}
+LIST_TABLES = {"user_activity", "price_history", "bid_ledgers"}  # Key -> append-only list of entries
+SNAPSHOT_CHUNK_ROWS = 10000  # Rows per pickle in a snapshot file
+
+class _StoragePickler(pickle.Pickler):
+    # Store enum members as their plain values so records don't depend on the
+    # module name the app was started under
+    def reducer_override(self, obj):
+        if isinstance(obj, Enum):
+            return type(obj.value), (obj.value,)
+        # Bid ledgers and price histories are stored as their plain entry lists
+        if isinstance(obj, (BidLedger, PriceHistory)):
+            return list, (list(obj),)
+        return NotImplemented
+
+def _dumps(obj) -> bytes:
+    buffer = io.BytesIO()
+    _StoragePickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return buffer.getvalue()
+
+def refill_table(table: Dict, rows: Dict):
+    # Refill in place: the module-level dicts are referenced everywhere. Keys
+    # go back in order because listings and indexes rely on id order.
+    table.clear()
+    table.update(sorted(rows.items(), key=lambda row: row[0]))
+
+def apply_mutation(tables: Dict[str, Dict], record: tuple):
+    """Apply one logged mutation to the in-memory tables"""
+    op, table, key = record[0], record[1], record[2]
+    if op == "put":
+        tables[table][key] = record[3]
+    elif op == "set":
+        tables[table][key][record[3]] = record[4]
+    elif op == "append":
+        tables[table][key].append(record[3])
+    elif op == "put_many":
+        tables[table].update(record[3])
+    elif op == "set_many":
+        rows = tables[table]
+        for key, value in record[4].items():
+            rows[key][record[3]] = value
+    elif op == "append_many":
+        for key, value in record[3]:
+            tables[table][key].append(value)
+    elif op == "del":
+        tables[table].pop(key, None)
+
+def drain_failed_writer(work: "queue.Queue", waiting: List[concurrent.futures.Future], error: BaseException,
+                        discard: Optional[Callable[[Any], None]] = None):
+    """Answer everything still queued to a writer thread that has died.
+    
+    Keeps draining until close() sends None, so sync() callers racing the
+    failure get the error instead of hanging; other queued items are handed
+    to discard so anything waiting on them can be released.
+    """
+    while True:
+        for synced in waiting:
+            synced.set_exception(error)
+        waiting.clear()
+        item = work.get()
+        if item is None:
+            return
+        if isinstance(item, concurrent.futures.Future):
+            waiting.append(item)
+        elif discard is not None:
+            discard(item)
+
+class StorageBackend:
+    """In-memory only: mutations are applied to the *_db dicts and nothing else"""
+    
+    tables: Dict[str, Dict] = TABLES
+    error: Optional[BaseException] = None  # Set once a background writer has failed
+    
+    def recover(self):
+        pass
+    
+    def put(self, table: str, key, field: Optional[str] = None):
+        """Persist the current value of tables[table][key] (or just one field of it)"""
+        pass
+    
+    def put_many(self, table: str, keys, field: Optional[str] = None):
+        """Persist several rows of one table (or one field of each) as a single write"""
+        for key in keys:
+            self.put(table, key, field)
+    
+    def append(self, table: str, key, value):
+        """Persist an item appended to the list at tables[table][key]"""
+        pass
+    
+    def append_many(self, table: str, entries: List[tuple]):
+        """Persist (key, value) appends to several lists of one table as a single write"""
+        for key, value in entries:
+            self.append(table, key, value)
+    
+    def delete(self, table: str, key):
+        pass
+    
+    async def sync(self):
+        """Return once every mutation persisted so far is durable"""
+        pass
+    
+    def status(self) -> Dict:
+        return {"backend": "memory"}
+    
+    def lease_ids(self, entity: str, size: int, floor: int) -> range:
+        """Reserve size ids above floor and above every id leased before"""
+        leased = self.tables["sequences"]
+        start = max(leased.get(entity, 0), floor) + 1
+        leased[entity] = start + size - 1
+        self.put("sequences", entity)
+        return range(start, start + size)
+    
+    async def get_user_by_email(self, email: str) -> Optional[Dict]:
+        user_ids = users_by_email.ids(email.lower())
+        return users_db[user_ids[0]] if user_ids else None
+    
+    async def run_snapshots(self):
+        pass
+    
+    def close(self):
+        pass
+
+class WALStorage(StorageBackend):
+    """Durable storage for the in-memory tables.
+    
+    Mutations are serialized on the calling thread and appended to a log
+    segment by a writer thread that group-commits whatever has queued up and
+    fsyncs once per batch. put() and friends return as soon as the record is
+    queued, so a crash can lose the last few milliseconds of acknowledged
+    writes; callers that must not acknowledge before the fsync await sync().
+    durable_lsn is the last sequence number known to be on disk.
+    
+    Snapshots rotate the log, then fold the closed segments into the last
+    snapshot on a worker thread, so the live tables are never copied;
+    recovery loads the newest snapshot and replays the log tail up to the
+    first torn record.
+    """
+    
+    _HEADER = struct.Struct("<II")  # Payload length, CRC32
+    
+    def __init__(self, directory: str, tables: Dict[str, Dict]):
+        self.directory = directory
+        self.tables = tables
+        self.lsn = 0  # Sequence number of the last logged mutation
+        self.durable_lsn = 0  # Sequence number of the last fsynced mutation
+        self.wal_bytes = 0  # Logged since the last snapshot; only the writer thread touches it
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lsn_lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self._file = None
+    
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, "snapshot.pkl")
+    
+    def _segment_path(self, first_lsn: int) -> str:
+        return os.path.join(self.directory, f"wal-{first_lsn:020d}.log")
+    
+    def _segments(self) -> List[str]:
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("wal-") and n.endswith(".log"))
+        return [os.path.join(self.directory, n) for n in names]
+    
+    # Recovery
+    
+    def recover(self):
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot_lsn, snapshot = self._read_snapshot()
+        for name, rows in snapshot.items():
+            if name in self.tables:
+                refill_table(self.tables[name], rows)
+        
+        self.lsn = snapshot_lsn
+        segments = self._segments()
+        for position, path in enumerate(segments):
+            records, torn = self._read_segment(path)
+            for lsn, record in records:
+                if lsn <= snapshot_lsn:
+                    continue
+                if lsn != self.lsn + 1:
+                    torn = True  # A gap: nothing after it can be trusted
+                    break
+                apply_mutation(self.tables, record)
+                self.lsn = lsn
+            if torn:
+                # Later segments continue past the damage; set them aside so
+                # their sequence numbers can't be replayed onto the new log
+                for later in segments[position + 1:]:
+                    os.replace(later, later + ".torn")
+                logger.warning("WAL %s is torn; recovered up to LSN %d", path, self.lsn)
+                break
+        
+        self.durable_lsn = self.lsn
+        self._open_segment(self.lsn + 1)
+        self._writer = threading.Thread(target=self._write_loop, name="wal-writer", daemon=True)
+        self._writer.start()
+    
+    def _read_snapshot(self) -> tuple:
+        """(lsn, {table: rows}) of the snapshot on disk, or (0, {}) without one"""
+        tables: Dict[str, Dict] = {}
+        if not os.path.exists(self.snapshot_path):
+            return 0, tables
+        with open(self.snapshot_path, "rb") as f:
+            snapshot_lsn = pickle.load(f)["lsn"]
+            # Rows follow in (table, chunk) pickles, terminated by None
+            while (chunk := pickle.load(f)) is not None:
+                name, rows = chunk
+                tables.setdefault(name, {}).update(rows)
+        return snapshot_lsn, tables
+    
+    def _read_segment(self, path: str, repair: bool = True) -> tuple:
+        """(lsn, record) pairs up to the first damaged record, and whether one was found"""
+        records = []
+        with open(path, "r+b" if repair else "rb") as f:
+            good_offset = 0
+            while True:
+                header = f.read(self._HEADER.size)
+                if len(header) < self._HEADER.size:
+                    break
+                length, checksum = self._HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+                good_offset = f.tell()
+                records.append(pickle.loads(payload))
+            torn = f.seek(0, os.SEEK_END) != good_offset
+            if repair:
+                # Drop a torn tail left by a crash mid-write
+                f.truncate(good_offset)
+        return records, torn
+    
+    # Logging
+    
+    def _log(self, record: tuple):
+        if self.error is not None:
+            raise RuntimeError("WAL writer has stopped") from self.error
+        with self._lsn_lock:
+            self.lsn += 1
+            payload = _dumps((self.lsn, record))
+            self._queue.put((self.lsn, self._HEADER.pack(len(payload), zlib.crc32(payload)) + payload))
+    
+    def put(self, table: str, key, field: Optional[str] = None):
+        if field is None:
+            self._log(("put", table, key, self.tables[table][key]))
+        else:
+            self._log(("set", table, key, field, self.tables[table][key][field]))
+    
+    def put_many(self, table: str, keys, field: Optional[str] = None):
+        rows = self.tables[table]
+        if field is None:
+            self._log(("put_many", table, None, {key: rows[key] for key in keys}))
+        else:
+            self._log(("set_many", table, None, field, {key: rows[key][field] for key in keys}))
+    
+    def append(self, table: str, key, value):
+        self._log(("append", table, key, value))
+    
+    def append_many(self, table: str, entries: List[tuple]):
+        self._log(("append_many", table, None, entries))
+    
+    def delete(self, table: str, key):
+        self._log(("del", table, key))
+    
+    async def sync(self):
+        if self.error is not None:
+            raise RuntimeError("WAL writer has stopped") from self.error
+        if self._writer is None or self.durable_lsn >= self.lsn:
+            return
+        synced = concurrent.futures.Future()
+        self._queue.put(synced)
+        try:
+            await asyncio.wrap_future(synced)
+        except Exception as e:
+            raise RuntimeError("WAL writer has stopped") from e
+    
+    def status(self) -> Dict:
+        # Mutations past durable_lsn are acknowledged but not yet fsynced
+        return {"backend": "wal", "lsn": self.lsn, "durable_lsn": self.durable_lsn, "wal_bytes": self.wal_bytes}
+    
+    def _open_segment(self, first_lsn: int):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._file = open(self._segment_path(first_lsn), "ab")
+    
+    def _write_loop(self):
+        waiting: List[concurrent.futures.Future] = []
+        try:
+            while True:
+                batch = [self._queue.get()]
+                # Group commit: take everything that queued up during the last fsync
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                
+                # Sync requests are answered once this whole batch is on disk
+                waiting.extend(item for item in batch if isinstance(item, concurrent.futures.Future))
+                
+                # Control messages are handled in order with the records around them
+                lsn = self.durable_lsn
+                for item in batch:
+                    if item is None:
+                        self._file.flush()
+                        os.fsync(self._file.fileno())
+                        self._file.close()
+                        self.durable_lsn = lsn
+                        for synced in waiting:
+                            synced.set_result(None)
+                        return
+                    if isinstance(item, concurrent.futures.Future):
+                        continue
+                    if item[0] == "rotate":
+                        _, first_lsn, rotated = item
+                        self._open_segment(first_lsn)
+                        self.wal_bytes = 0
+                        rotated.set()
+                    else:
+                        lsn, data = item
+                        self._file.write(data)
+                        self.wal_bytes += len(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self.durable_lsn = lsn
+                for synced in waiting:
+                    synced.set_result(None)
+                waiting.clear()
+        except BaseException as e:
+            self.error = e
+            logger.exception("WAL writer stopped; new writes will be rejected")
+            drain_failed_writer(self._queue, waiting, e, self._discard)
+    
+    @staticmethod
+    def _discard(item):
+        if item[0] == "rotate":
+            item[2].set()  # Nothing more reaches the log; let the snapshot proceed
+    
+    # Snapshots
+    
+    def _begin_snapshot(self) -> tuple:
+        # The cut is just a sequence number: the writer closes the segment
+        # holding it, and nothing is read from the live tables
+        rotated = threading.Event()
+        with self._lsn_lock:
+            snapshot_lsn = self.lsn
+            self._queue.put(("rotate", snapshot_lsn + 1, rotated))
+        return snapshot_lsn, rotated
+    
+    def _compact(self, snapshot_lsn: int) -> Dict[str, Dict]:
+        """The tables as of snapshot_lsn: the last snapshot plus the closed segments"""
+        lsn, rows = self._read_snapshot()
+        tables = {name: defaultdict(list) if name in LIST_TABLES else {} for name in self.tables}
+        for name, table_rows in rows.items():
+            if name in tables:
+                tables[name].update(table_rows)
+        
+        current = self._segment_path(snapshot_lsn + 1)
+        for path in self._segments():
+            if path >= current:
+                break
+            records, torn = self._read_segment(path, repair=False)
+            for record_lsn, record in records:
+                if record_lsn <= lsn:
+                    continue
+                if record_lsn != lsn + 1:
+                    raise RuntimeError(f"WAL gap after LSN {lsn} in {path}")
+                apply_mutation(tables, record)
+                lsn = record_lsn
+            if torn:
+                raise RuntimeError(f"WAL segment {path} is damaged")
+        if lsn != snapshot_lsn:
+            raise RuntimeError(f"WAL ends at LSN {lsn}, short of the snapshot at {snapshot_lsn}")
+        return tables
+    
+    def _write_snapshot(self, snapshot_lsn: int, rotated: threading.Event):
+        rotated.wait()
+        tables = self._compact(snapshot_lsn)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_dumps({"lsn": snapshot_lsn}))
+            # Written in chunks so no single pickle holds a whole table
+            for name, table in tables.items():
+                rows = list(table.items())
+                for start in range(0, len(rows), SNAPSHOT_CHUNK_ROWS):
+                    f.write(_dumps((name, dict(rows[start:start + SNAPSHOT_CHUNK_ROWS]))))
+            f.write(_dumps(None))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        
+        # Segments before the rotation point are fully covered by the snapshot
+        current = self._segment_path(snapshot_lsn + 1)
+        for path in self._segments():
+            if path < current:
+                os.remove(path)
+    
+    def snapshot(self):
+        """Rotate the log, write a snapshot of every table and drop covered segments"""
+        self._write_snapshot(*self._begin_snapshot())
+    
+    async def run_snapshots(self):
+        loop = asyncio.get_running_loop()
+        last_snapshot = time.monotonic()
+        while True:
+            await asyncio.sleep(1)
+            due = time.monotonic() - last_snapshot >= SNAPSHOT_INTERVAL_SECONDS
+            if due or self.wal_bytes >= SNAPSHOT_WAL_BYTES:
+                try:
+                    await loop.run_in_executor(None, self._write_snapshot, *self._begin_snapshot())
+                except Exception:
+                    logger.exception("WAL snapshot failed")
+                last_snapshot = time.monotonic()
+    
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+class SQLitePool:
+    """Fixed-size pool of SQLite connections in WAL mode, shareable across threads"""
+    
+    def __init__(self, path: str, size: int = SQLITE_POOL_SIZE):
+        self._connections: "queue.Queue" = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._connections.put(conn)
+        self.size = size
+    
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+    
+    def close(self):
+        for _ in range(self.size):
+            self._connections.get().close()
+
+class SQLiteStorage(StorageBackend):
+    """SQLite-backed storage for the in-memory tables.
+    
+    Users, products, orders and bids get their own tables with indexed lookup
+    columns; every other store is kept as key/value rows. Reads on the request
+    path stay on the in-memory dicts, writes are queued to a single writer
+    thread that commits them in batched transactions, and lookups that must go
+    to disk run on a pooled connection in the executor so the event loop never
+    blocks on SQLite.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, email TEXT NOT NULL, data BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS users_email ON users (email);
+        CREATE TABLE IF NOT EXISTS products (id INTEGER PRIMARY KEY, seller_id INTEGER, data BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS products_seller ON products (seller_id);
+        CREATE TABLE IF NOT EXISTS orders (id INTEGER PRIMARY KEY, user_id INTEGER, status TEXT, data BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id);
+        CREATE TABLE IF NOT EXISTS bids (id INTEGER PRIMARY KEY, auction_id INTEGER, user_id INTEGER, data BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS bids_auction ON bids (auction_id);
+        CREATE TABLE IF NOT EXISTS records (tbl TEXT NOT NULL, key BLOB NOT NULL, data BLOB NOT NULL, PRIMARY KEY (tbl, key));
+        CREATE TABLE IF NOT EXISTS list_items (seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, key BLOB NOT NULL, data BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS sequences (entity TEXT PRIMARY KEY, high_water INTEGER NOT NULL);
+    """
+    
+    # Table -> (indexed columns besides id, their values for a row)
+    ENTITY_TABLES = {
+        "users": (("email",), lambda r: (r["email"].lower(),)),
+        "products": (("seller_id",), lambda r: (r.get("seller_id"),)),
+        "orders": (("user_id", "status"), lambda r: (r["user_id"], str(getattr(r["status"], "value", r["status"])))),
+        "bids": (("auction_id", "user_id"), lambda r: (r["auction_id"], r["user_id"])),
+    }
+    # New rows are plain INSERTs, so a row another worker already wrote under
+    # the same id is never overwritten; rows known to exist are UPDATEd
+    INSERTS = {
+        name: f"INSERT INTO {name} (id, {', '.join(columns)}, data) VALUES ({', '.join('?' * (len(columns) + 2))})"
+        for name, (columns, _) in ENTITY_TABLES.items()
+    }
+    UPDATES = {
+        name: f"UPDATE {name} SET {', '.join(f'{column} = ?' for column in columns)}, data = ? WHERE id = ?"
+        for name, (columns, _) in ENTITY_TABLES.items()
+    }
+    SELECT_USER_BY_EMAIL = "SELECT data FROM users WHERE email = ? ORDER BY id LIMIT 1"
+    
+    def __init__(self, path: str, tables: Dict[str, Dict]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.tables = tables
+        self.pool = SQLitePool(path)
+        with self.pool.connection() as conn:
+            conn.executescript(self.SCHEMA)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._stored: Dict[str, set] = {name: set() for name in self.ENTITY_TABLES}  # Ids with a row on disk
+    
+    def _is_empty(self, conn) -> bool:
+        return not any(
+            conn.execute(f"SELECT 1 FROM {name} LIMIT 1").fetchone()
+            for name in (*self.ENTITY_TABLES, "records", "list_items")
+        )
+    
+    def _seed(self):
+        """Write the built-in tables into a fresh database"""
+        for name, table in self.tables.items():
+            for key, value in table.items():
+                if name in LIST_TABLES:
+                    for entry in value:
+                        self.append(name, key, entry)
+                else:
+                    self.put(name, key)
+    
+    def recover(self):
+        with self.pool.connection() as conn:
+            empty = self._is_empty(conn)
+        if empty:
+            self._seed()
+        else:
+            self._load()
+        
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-writer", daemon=True)
+        self._writer.start()
+    
+    def _load(self):
+        with self.pool.connection() as conn:
+            for name in self.ENTITY_TABLES:
+                rows = {}
+                for (data,) in conn.execute(f"SELECT data FROM {name} ORDER BY id"):
+                    row = pickle.loads(data)
+                    rows[row["id"]] = row
+                refill_table(self.tables[name], rows)
+                self._stored[name] = set(rows)
+            
+            rows_by_table = defaultdict(dict)
+            for tbl, key, data in conn.execute("SELECT tbl, key, data FROM records"):
+                rows_by_table[tbl][pickle.loads(key)] = pickle.loads(data)
+            for tbl, key, data in conn.execute("SELECT tbl, key, data FROM list_items ORDER BY seq"):
+                rows_by_table[tbl].setdefault(pickle.loads(key), []).append(pickle.loads(data))
+            for name, table in self.tables.items():
+                if name not in self.ENTITY_TABLES:
+                    refill_table(table, rows_by_table[name])
+    
+    def put(self, table: str, key, field: Optional[str] = None):
+        row = self.tables[table][key]
+        if table in self.ENTITY_TABLES:
+            columns = self.ENTITY_TABLES[table][1](row)
+            if key in self._stored[table]:
+                self._queue.put((self.UPDATES[table], (*columns, _dumps(row), key)))
+            else:
+                self._stored[table].add(key)
+                self._queue.put((self.INSERTS[table], (key, *columns, _dumps(row))))
+        elif table in LIST_TABLES:
+            # Replace the whole list
+            self._queue.put(("DELETE FROM list_items WHERE tbl = ? AND key = ?", (table, _dumps(key))))
+            for entry in row:
+                self.append(table, key, entry)
+        else:
+            self._queue.put((
+                "INSERT OR REPLACE INTO records (tbl, key, data) VALUES (?, ?, ?)",
+                (table, _dumps(key), _dumps(row))
+            ))
+    
+    def append(self, table: str, key, value):
+        self._queue.put((
+            "INSERT INTO list_items (tbl, key, data) VALUES (?, ?, ?)",
+            (table, _dumps(key), _dumps(value))
+        ))
+    
+    def delete(self, table: str, key):
+        if table in self.ENTITY_TABLES:
+            self._stored[table].discard(key)
+            self._queue.put((f"DELETE FROM {table} WHERE id = ?", (key,)))
+        else:
+            self._queue.put(("DELETE FROM records WHERE tbl = ? AND key = ?", (table, _dumps(key))))
+    
+    async def sync(self):
+        if self.error is not None:
+            raise RuntimeError("SQLite writer has stopped") from self.error
+        if self._writer is None:
+            return
+        committed = concurrent.futures.Future()
+        self._queue.put(committed)
+        try:
+            await asyncio.wrap_future(committed)
+        except Exception as e:
+            raise RuntimeError("SQLite writer has stopped") from e
+    
+    def status(self) -> Dict:
+        return {"backend": "sqlite", "queued_writes": self._queue.qsize()}
+    
+    def _write_loop(self):
+        waiting: List[concurrent.futures.Future] = []
+        try:
+            with self.pool.connection() as conn:
+                while True:
+                    batch = [self._queue.get()]
+                    while True:
+                        try:
+                            batch.append(self._queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    
+                    # One transaction per batch of queued writes; sync requests
+                    # are answered once it commits
+                    waiting.extend(item for item in batch if isinstance(item, concurrent.futures.Future))
+                    conn.execute("BEGIN")
+                    for item in batch:
+                        if item is not None and not isinstance(item, concurrent.futures.Future):
+                            try:
+                                conn.execute(*item)
+                            except sqlite3.IntegrityError:
+                                # Only this statement is undone; the row on disk wins
+                                logger.error("SQLite write rejected, id already taken: %s %r", item[0], item[1][:1])
+                    conn.execute("COMMIT")
+                    for committed in waiting:
+                        committed.set_result(None)
+                    waiting.clear()
+                    if batch[-1] is None:
+                        return
+        except BaseException as e:
+            self.error = e
+            logger.exception("SQLite writer stopped")
+            drain_failed_writer(self._queue, waiting, e)
+    
+    def lease_ids(self, entity: str, size: int, floor: int) -> range:
+        # The high-water mark lives in the database so every worker on it
+        # leases disjoint blocks; BEGIN IMMEDIATE serializes the bump
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT high_water FROM sequences WHERE entity = ?", (entity,)).fetchone()
+                start = max(row[0] if row else 0, floor) + 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO sequences (entity, high_water) VALUES (?, ?)",
+                    (entity, start + size - 1)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return range(start, start + size)
+    
+    def _fetch_user_by_email(self, email: str) -> Optional[Dict]:
+        with self.pool.connection() as conn:
+            row = conn.execute(self.SELECT_USER_BY_EMAIL, (email,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+    
+    async def get_user_by_email(self, email: str) -> Optional[Dict]:
+        user = await super().get_user_by_email(email)
+        if user is not None:
+            return user
+        
+        # Fall back to disk for users registered through another worker
+        loop = asyncio.get_running_loop()
+        user = await loop.run_in_executor(None, self._fetch_user_by_email, email.lower())
+        if user is not None:
+            self.tables["users"].setdefault(user["id"], user)
+            self._stored["users"].add(user["id"])
+            user = self.tables["users"][user["id"]]
+            users_by_email.index(user)
+        return user
+    
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        self.pool.close()
+
+def create_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "wal":
+        return WALStorage(STORAGE_DIR, TABLES)
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(os.path.join(STORAGE_DIR, "indabacart.db"), TABLES)
+    return StorageBackend()
+
+storage = create_storage()
+storage.recover()
+
+# ============================================================================
+# ID SEQUENCES
+# ============================================================================
+
+class SequenceService:
+    """Per-entity id allocator handing out ids from leased blocks.
+    
+    Each worker leases a block of ids from the storage backend's shared
+    high-water mark and draws from it locally, so only every block_size-th
+    insert touches shared state. Within a worker, single ids and batch ranges
+    come off the current lease in order, so ids only ever increase; workers
+    interleave by block.
+    """
+    
+    def __init__(self, lease: Callable[[str, int, int], range], block_size: int = 100):
+        self.block_size = block_size
+        self._lease = lease  # (entity, size, floor) -> fresh range of ids above floor
+        self._lock = threading.Lock()
+        self._floor: Dict[str, int] = defaultdict(int)  # Highest id present in the local stores
+        self._blocks: Dict[str, List[int]] = {}  # Entity -> [next id, end of lease]
+    
+    def seed(self, entity: str, last_id: int):
+        """Never hand out ids at or below last_id"""
+        with self._lock:
+            self._floor[entity] = max(self._floor[entity], last_id)
+    
+    def _take(self, entity: str, count: int) -> int:
+        block = self._blocks.get(entity)
+        if block is None or block[1] - block[0] < count:
+            # The rest of a too-short lease is dropped so ids keep increasing
+            leased = self._lease(entity, max(count, self.block_size), self._floor[entity])
+            block = self._blocks[entity] = [leased.start, leased.stop]
+        block[0] += count
+        return block[0] - count
+    
+    def next_id(self, entity: str) -> int:
+        with self._lock:
+            return self._take(entity, 1)
+    
+    def next_ids(self, entity: str, count: int) -> range:
+        """Contiguous ids for a batch insert, reserved in one step"""
+        with self._lock:
+            start = self._take(entity, count)
+        return range(start, start + count)
+
+sequences = SequenceService(storage.lease_ids)
+for entity, store in [
+    ("users", users_db), ("products", products_db), ("orders", orders_db),
+    ("reviews", reviews_db), ("rfqs", rfqs_db), ("auctions", auctions_db),
+    ("bids", bids_db), ("disputes", disputes_db), ("reservations", reservations_db)
+]:
+    sequences.seed(entity, max(store, default=0))
+
+# ============================================================================
+# SECONDARY INDEXES
+# ============================================================================
+
+class SecondaryIndex:
+    """Maintained mapping of field value -> ids of records carrying it, in id order.
+    
+    Indexes are updated in the same synchronous block as the store write they
+    mirror (no await in between), so readers never observe one without the other.
+    Buckets are insertion-ordered dicts; a record joining a bucket behind a
+    higher id (e.g. an older order changing status) marks the bucket for a
+    re-sort on its next read, so listings can bisect them by id.
+    """
+    
+    def __init__(self, key_fn):
+        self.key_fn = key_fn
+        self._ids: Dict[Any, Dict[int, None]] = defaultdict(dict)
+        self._keys: Dict[int, tuple] = {}
+        self._unsorted: set = set()  # Keys whose bucket is out of id order
+    
+    def index(self, record: Dict):
+        """Insert a record or move it to the keys it carries now"""
+        record_id = record["id"]
+        keys = tuple(dict.fromkeys(self.key_fn(record)))
+        old_keys = self._keys.get(record_id, ())
+        if keys == old_keys:
+            return
+        
+        for key in old_keys:
+            if key not in keys:
+                self._discard(key, record_id)
+        for key in keys:
+            bucket = self._ids[key]
+            if record_id not in bucket:
+                if bucket and record_id < next(reversed(bucket)):
+                    self._unsorted.add(key)
+                bucket[record_id] = None
+        self._keys[record_id] = keys
+    
+    def remove(self, record_id: int):
+        for key in self._keys.pop(record_id, ()):
+            self._discard(key, record_id)
+    
+    def _discard(self, key, record_id: int):
+        bucket = self._ids.get(key)
+        if bucket is not None:
+            bucket.pop(record_id, None)
+            if not bucket:
+                del self._ids[key]
+                self._unsorted.discard(key)
+    
+    def ids(self, key) -> List[int]:
+        if key in self._unsorted:
+            self._unsorted.discard(key)
+            self._ids[key] = dict.fromkeys(sorted(self._ids[key]))
+        return list(self._ids.get(key, ()))
+    
+    def count(self, key) -> int:
+        return len(self._ids.get(key, ()))
+    
+    def rebuild(self, store: Dict[int, Dict]):
+        self._ids.clear()
+        self._keys.clear()
+        self._unsorted.clear()
+        for record in store.values():
+            self.index(record)
+
+def by_field(field: str) -> SecondaryIndex:
+    return SecondaryIndex(lambda record: (record[field],))
+
+def order_sellers(order: Dict) -> List[int]:
+    return [
+        products_db[item["product_id"]]["seller_id"]
+        for item in order["items"]
+        if item["product_id"] in products_db
+    ]
+
+users_by_email = SecondaryIndex(lambda user: (user["email"].lower(),))
+orders_by_user = by_field("user_id")
+orders_by_seller = SecondaryIndex(order_sellers)
+orders_by_status = by_field("status")
+# (user ID, product ID) -> delivered orders containing it, for verified-purchase checks
+delivered_purchases = SecondaryIndex(lambda order: [
+    (order["user_id"], item["product_id"]) for item in order["items"]
+] if order["status"] == OrderStatus.DELIVERED else [])
+rfqs_by_buyer = by_field("buyer_id")
+rfqs_by_seller = by_field("seller_id")
+rfqs_by_status = by_field("status")
+disputes_by_buyer = by_field("buyer_id")
+disputes_by_seller = by_field("seller_id")
+disputes_by_status = by_field("status")
+auctions_by_status = by_field("status")
+products_by_seller = by_field("seller_id")
+
+ORDER_INDEXES = [orders_by_user, orders_by_seller, orders_by_status, delivered_purchases]
+RFQ_INDEXES = [rfqs_by_buyer, rfqs_by_seller, rfqs_by_status]
+DISPUTE_INDEXES = [disputes_by_buyer, disputes_by_seller, disputes_by_status]
+AUCTION_INDEXES = [auctions_by_status]
+
+def index_order(order: Dict):
+    for index in ORDER_INDEXES:
+        index.index(order)
+
+def index_rfq(rfq: Dict):
+    for index in RFQ_INDEXES:
+        index.index(rfq)
+
+def index_dispute(dispute: Dict):
+    for index in DISPUTE_INDEXES:
+        index.index(dispute)
+
+def index_auction(auction: Dict):
+    for index in AUCTION_INDEXES:
+        index.index(auction)
+
+users_by_email.rebuild(users_db)
+for index in ORDER_INDEXES:
+    index.rebuild(orders_db)
+for index in RFQ_INDEXES:
+    index.rebuild(rfqs_db)
+for index in DISPUTE_INDEXES:
+    index.rebuild(disputes_db)
+for index in AUCTION_INDEXES:
+    index.rebuild(auctions_db)
+products_by_seller.rebuild(products_db)
+
+# ============================================================================
+# ORDERED INDEXES & PAGINATION
+# ============================================================================
+
+class SortedKeyList:
+    """Sorted sequence of comparable keys kept in bounded buckets.
+    
+    Lookups bisect the bucket maxima and then one bucket; inserts and removals
+    only shift elements within a single bucket.
+    """
+    
+    def __init__(self, bucket_size: int = 512):
+        self.bucket_size = bucket_size
+        self._buckets: List[list] = []
+        self._maxes: list = []
+        self._len = 0
+    
+    def __len__(self) -> int:
+        return self._len
+    
+    def add(self, key):
+        self._len += 1
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        
+        i = min(bisect.bisect_left(self._maxes, key), len(self._buckets) - 1)
+        bucket = self._buckets[i]
+        bisect.insort(bucket, key)
+        self._maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.bucket_size:
+            self._buckets[i:i + 1] = [bucket[:self.bucket_size], bucket[self.bucket_size:]]
+            self._maxes[i:i + 1] = [bucket[self.bucket_size - 1], bucket[-1]]
+    
+    def remove(self, key):
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._buckets):
+            raise KeyError(key)
+        bucket = self._buckets[i]
+        j = bisect.bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            raise KeyError(key)
+        del bucket[j]
+        self._len -= 1
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+    
+    def irange(self, minimum=None, inclusive: bool = True):
+        """Keys from minimum upwards, in order"""
+        if minimum is None:
+            i, j = 0, 0
+        else:
+            find = bisect.bisect_left if inclusive else bisect.bisect_right
+            i = find(self._maxes, minimum)
+            j = find(self._buckets[i], minimum) if i < len(self._buckets) else 0
+        for bucket in self._buckets[i:]:
+            yield from bucket[j:]
+            j = 0
+
+    def irange_reverse(self, maximum=None, inclusive: bool = True):
+        """Keys from maximum downwards, in reverse order"""
+        if maximum is None:
+            i, j = len(self._buckets) - 1, None
+        else:
+            i = bisect.bisect_left(self._maxes, maximum)
+            if i == len(self._buckets):
+                i, j = i - 1, None
+            else:
+                find = bisect.bisect_right if inclusive else bisect.bisect_left
+                j = find(self._buckets[i], maximum)
+        for index in range(i, -1, -1):
+            bucket = self._buckets[index]
+            yield from reversed(bucket if j is None else bucket[:j])
+            j = None
+
+def encode_cursor(*values) -> str:
+    """Opaque keyset cursor carrying the sort key of the last item returned"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def _cursor_value_ok(value, expected: type) -> bool:
+    if isinstance(value, bool):
+        return False
+    if expected is float:
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, expected)
+
+def decode_cursor(cursor: str, shape: tuple) -> tuple:
+    """Decode a cursor whose values must match the endpoint's sort key types (float admits any number)"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        values = None
+    if (not isinstance(values, list) or len(values) != len(shape)
+            or not all(map(_cursor_value_ok, values, shape))):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(values)
+
+def set_next_cursor(response: Response, cursor: Optional[str]):
+    """Listing endpoints return the page as the body and the next cursor in a header"""
+    if cursor is not None:
+        response.headers["X-Next-Cursor"] = cursor
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+def ndjson_lines(items: Iterator, load: Callable) -> Iterator[str]:
+    for item in items:
+        yield json.dumps(load(item), default=_json_default) + "\n"
+
+def paginate(
+    response: Response,
+    items: list,
+    key: Callable,
+    cursor: Optional[str],
+    limit: int,
+    stream: bool = False,
+    load: Callable = lambda item: item,
+    shape: tuple = (int,)
+):
+    """Keyset-paginate items, which must already be sorted by key.
+    
+    shape gives the types of the key's values, for validating cursors.
+    Returns one page and sets X-Next-Cursor, or with stream=True emits every
+    record after the cursor as NDJSON, serializing one record at a time.
+    """
+    start = bisect.bisect_right(items, decode_cursor(cursor, shape), key=key) if cursor else 0
+    
+    if stream:
+        return StreamingResponse(
+            ndjson_lines(itertools.islice(items, start, None), load),
+            media_type="application/x-ndjson"
+        )
+    
+    page = items[start:start + limit]
+    if start + limit < len(items):
+        set_next_cursor(response, encode_cursor(*key(page[-1])))
+    return [load(item) for item in page]
+
+def paginate_ordered(
+    response: Response,
+    walk: Callable,
+    shape: tuple,
+    cursor: Optional[str],
+    limit: int,
+    stream: bool = False
+):
+    """Keyset-paginate straight off an ordered index.
+    
+    walk(after) must yield (key, record) pairs in order, starting after the
+    given key (or from the beginning when it is None); shape gives the types
+    of the key's values.
+    """
+    entries = walk(decode_cursor(cursor, shape) if cursor else None)
+    
+    if stream:
+        return StreamingResponse(
+            ndjson_lines((record for _, record in entries), lambda record: record),
+            media_type="application/x-ndjson"
+        )
+    
+    page = list(itertools.islice(entries, limit + 1))
+    if len(page) > limit:
+        set_next_cursor(response, encode_cursor(*page[limit - 1][0]))
+    return [record for _, record in page[:limit]]
+
+def by_id(record_id: int) -> tuple:
+    return (record_id,)
+
+# ============================================================================
+# PUB/SUB BROKER
+# ============================================================================
+
+BROADCAST_INTERVAL = 0.05      # seconds of bursts folded into one fan-out
+SUBSCRIBER_QUEUE_SIZE = 64     # pending messages before a client counts as stalled
+MAX_TOPIC_SUBSCRIBERS = 10000
+MAX_SUBSCRIBERS = 50000
+SEND_TIMEOUT = 5.0
+
+class Subscriber:
+    """One connection's mailbox; coalesced topics keep only their latest message"""
+    
+    def __init__(self, limit: int = SUBSCRIBER_QUEUE_SIZE):
+        self.limit = limit
+        self.pending: Dict[Any, str] = {}
+        self.ready = asyncio.Event()
+        self.overflowed = False
+        self.topics: set = set()
+    
+    def deliver(self, key: Any, text: str):
+        if key not in self.pending and len(self.pending) >= self.limit:
+            self.overflowed = True
+        else:
+            self.pending[key] = text
+        self.ready.set()
+    
+    async def next_batch(self) -> List[str]:
+        await self.ready.wait()
+        self.ready.clear()
+        batch = list(self.pending.values())
+        self.pending.clear()
+        return batch
+
+class Broker:
+    """In-process topic fan-out driven by a single broadcaster task.
+    
+    Coalesced publishes overwrite each other until the next flush, so a burst
+    of stock changes reaches every subscriber as one message with the final
+    state. Uncoalesced publishes (events) are delivered one by one.
+    """
+    
+    def __init__(self):
+        self.topics: Dict[str, set] = defaultdict(set)
+        self.subscriber_count = 0
+        self.dirty: Dict[str, Any] = {}
+        self.events: List[tuple] = []
+        self.event_ids = itertools.count()
+        self.wakeup: Optional[asyncio.Event] = None
+    
+    def subscribe(self, topic: str, subscriber: Subscriber) -> bool:
+        subscribers = self.topics.get(topic, ())
+        if self.subscriber_count >= MAX_SUBSCRIBERS or len(subscribers) >= MAX_TOPIC_SUBSCRIBERS:
+            return False
+        self.topics[topic].add(subscriber)
+        subscriber.topics.add(topic)
+        self.subscriber_count += 1
+        return True
+    
+    def unsubscribe(self, subscriber: Subscriber):
+        for topic in subscriber.topics:
+            subscribers = self.topics.get(topic)
+            if subscribers is None or subscriber not in subscribers:
+                continue
+            subscribers.discard(subscriber)
+            self.subscriber_count -= 1
+            if not subscribers:
+                del self.topics[topic]
+        subscriber.topics.clear()
+    
+    def publish(self, topic: str, message: Dict, coalesce: bool = True):
+        if topic not in self.topics:
+            return
+        if coalesce:
+            self.dirty[topic] = message
+        else:
+            self.events.append((topic, message))
+        if self.wakeup is not None:
+            self.wakeup.set()
+    
+    def flush(self):
+        events, self.events = self.events, []
+        dirty, self.dirty = self.dirty, {}
+        # Encode once per message, not once per subscriber
+        for topic, message in events:
+            text = json.dumps(message, default=_json_default)
+            key = next(self.event_ids)
+            for subscriber in self.topics.get(topic, ()):
+                subscriber.deliver(key, text)
+        for topic, message in dirty.items():
+            text = json.dumps(message, default=_json_default)
+            for subscriber in self.topics.get(topic, ()):
+                subscriber.deliver(topic, text)
+    
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(BROADCAST_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+
+broker = Broker()
+
+# Raised by sends and receives once the client has gone (Starlette raises
+# RuntimeError for a send after the close handshake)
+WEBSOCKET_GONE = (WebSocketDisconnect, RuntimeError, asyncio.TimeoutError, OSError)
+
+async def _pump_subscriber(websocket: WebSocket, subscriber: Subscriber):
+    try:
+        while True:
+            batch = await subscriber.next_batch()
+            if subscriber.overflowed:
+                # Stalled client: drop it rather than buffer without bound
+                await websocket.close(code=1013)
+                return
+            for text in batch:
+                await asyncio.wait_for(websocket.send_text(text), SEND_TIMEOUT)
+    except WEBSOCKET_GONE:
+        return
+    finally:
+        broker.unsubscribe(subscriber)
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    except WEBSOCKET_GONE:
+        return
+
+async def serve_subscription(websocket: WebSocket, topic: str, snapshot: Optional[Dict] = None):
+    """Stream a broker topic to a websocket until either side goes away"""
+    await websocket.accept()
+    subscriber = Subscriber()
+    if not broker.subscribe(topic, subscriber):
+        await websocket.close(code=1013)
+        return
+    
+    tasks = set()
+    try:
+        if snapshot is not None:
+            await websocket.send_text(json.dumps(snapshot, default=_json_default))
+        tasks = {
+            asyncio.create_task(_pump_subscriber(websocket, subscriber)),
+            asyncio.create_task(_wait_for_disconnect(websocket)),
+        }
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    except WEBSOCKET_GONE:
+        pass
+    finally:
+        broker.unsubscribe(subscriber)
+        for task in tasks:
+            task.cancel()
 
 # ============================================================================
 # 1. IDENTITY & ACCESS MANAGEMENT (IAM)
 # ============================================================================
 
+def hash_password(password: str) -> str:
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def verify_password(password: str, password_hash: str) -> bool:
+    return hmac.compare_digest(hash_password(password), password_hash)
+
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=24)):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
@@ -289,8 +1632,8 @@ def require_role(allowed_roles: List[UserRole]):
 
 @app.post("/auth/register")
 async def register(email: EmailStr, username: str, password: str, role: UserRole = UserRole.BUYER):
-    user_id = max(users_db.keys()) + 1 if users_db else 1
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
+    user_id = sequences.next_id("users")
+    password_hash = hash_password(password)
     
     users_db[user_id] = {
         "id": user_id,
@@ -301,19 +1644,20 @@ async def register(email: EmailStr, username: str, password: str, role: UserRole
         "is_verified": False,
         "created_at": datetime.now()
     }
+    storage.put("users", user_id)
+    users_by_email.index(users_db[user_id])
     
     token = create_access_token({"sub": str(user_id), "role": role})
     return {"access_token": token, "token_type": "bearer", "user_id": user_id}
 
 @app.post("/auth/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await storage.get_user_by_email(form_data.username)
     
-    # Use the auth verify function instead of !=
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    if not user or not verify_password(form_data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    token = auth.create_token(data={"sub": user.email, "role": user.role})
+    token = create_access_token({"sub": str(user["id"]), "role": user["role"]})
     return {"access_token": token, "token_type": "bearer"}
 
 @app.get("/auth/me")
@@ -324,63 +1668,195 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 # 2. PRODUCT INFORMATION MANAGEMENT (PIM)
 # ============================================================================
 
+# One set per rebuild in flight, collecting the ids of products re-indexed meanwhile
+product_change_trackers: List[set] = []
+
+def note_product_changes(product_ids):
+    for changed in product_change_trackers:
+        changed.update(product_ids)
+
+async def rebuild_product_index(index, replay: Callable, max_replay: Optional[int] = None):
+    """Rebuild a derived product index in a worker thread and return it.
+    
+    The rebuild reads a copy of the catalog while the live index keeps
+    serving; products re-indexed in the meantime are then applied to the new
+    index with replay(index, product), on the event loop, before the caller
+    swaps it in. Returns None instead if more than max_replay products changed.
+    """
+    changed = set()
+    product_change_trackers.append(changed)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, index.rebuild, dict(products_db))
+        if max_replay is not None and len(changed) > max_replay:
+            return None
+        for product_id in changed:
+            if product_id in products_db:
+                replay(index, products_db[product_id])
+    finally:
+        product_change_trackers.remove(changed)
+    return index
+
+class PriceIndex:
+    """Products ordered by base price normalised to ZAR"""
+    
+    def __init__(self):
+        self.keys = SortedKeyList()
+        self.zar_prices: Dict[int, float] = {}
+        self.rates_version = exchange_rates.current.version
+    
+    @staticmethod
+    def to_zar(amount: float, currency: str) -> float:
+        return amount / exchange_rates.current.rates[currency]
+    
+    def update(self, product: Dict):
+        product_id = product["id"]
+        zar_price = self.to_zar(product["base_price"], product.get("currency", Currency.ZAR))
+        old_price = self.zar_prices.get(product_id)
+        if old_price == zar_price:
+            return
+        if old_price is not None:
+            self.keys.remove((old_price, product_id))
+        self.keys.add((zar_price, product_id))
+        self.zar_prices[product_id] = zar_price
+    
+    def rebuild(self, products: Dict[int, Dict]):
+        self.keys = SortedKeyList()
+        self.zar_prices.clear()
+        self.rates_version = exchange_rates.current.version
+        for product in products.values():
+            self.update(product)
+    
+    def walk(self, low: Optional[float], high: Optional[float], descending: bool = False, after: Optional[tuple] = None):
+        """(ZAR price, product ID) keys within [low, high], resuming after a previous key"""
+        if descending:
+            # Highest price first, equal prices in id order like every other listing
+            if after:
+                price = after[0]
+                for key in self.keys.irange(after, inclusive=False):
+                    if key[0] != price:
+                        break
+                    yield key
+                start, inclusive = (price,), False
+            else:
+                start, inclusive = ((high, math.inf) if high is not None else None), True
+            run: List[tuple] = []
+            for key in self.keys.irange_reverse(start, inclusive):
+                if low is not None and key[0] < low:
+                    break
+                if run and key[0] != run[-1][0]:
+                    yield from reversed(run)
+                    run = []
+                run.append(key)
+            yield from reversed(run)
+        else:
+            start = after if after else ((low,) if low is not None else None)
+            for key in self.keys.irange(start, inclusive=not after):
+                if high is not None and key[0] > high:
+                    return
+                yield key
+
+price_index = PriceIndex()
+price_index.rebuild(products_db)
+
+# (Product ID, currency) -> (rate version, base price, converted price)
+display_price_cache: Dict[tuple, tuple] = {}
+
+def with_display_price(product: Dict, currency: Currency) -> Dict:
+    """Copy of a product priced in the requested currency (stored records stay untouched)"""
+    rates = exchange_rates.current
+    cache_key = (product["id"], currency)
+    cached = display_price_cache.get(cache_key)
+    if cached is not None and cached[0] == rates.version and cached[1] == product["base_price"]:
+        display_price = cached[2]
+    else:
+        display_price = rates.convert(product["base_price"], product["currency"], currency)
+        display_price_cache[cache_key] = (rates.version, product["base_price"], display_price)
+    
+    product = product.copy()
+    product["display_price"] = display_price
+    product["display_currency"] = currency
+    return product
+
 @app.get("/api/products")
 async def get_products(
+    response: Response,
     q: Optional[str] = None,
     category: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     sort_by: str = "relevance",
-    currency: Currency = Currency.ZAR
+    currency: Currency = Currency.ZAR,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False
 ):
-    products = list(products_db.values())
+    # Convert the price bounds (not every product) to ZAR, widened by half a
+    # cent so rounding can't drop boundary products; exact checks follow
+    low = PriceIndex.to_zar(min_price - 0.005, currency) if min_price else None
+    high = PriceIndex.to_zar(max_price + 0.005, currency) if max_price else None
     
-    # Filter by search query
-    if q:
-        q_lower = q.lower()
-        products = [p for p in products if 
-                   q_lower in p["title"].lower() or 
-                   q_lower in p["description"].lower() or
-                   any(q_lower in tag for tag in p.get("tags", []))]
-    
-    # Filter by category
-    if category:
-        products = [p for p in products if p["category"] == category]
-    
-    # Convert prices to requested currency
-    for p in products:
-        p["display_price"] = convert_currency(p["base_price"], p["currency"], currency)
-        p["display_currency"] = currency
-    
-    # Filter by price range
-    if min_price:
-        products = [p for p in products if p["display_price"] >= min_price]
-    if max_price:
-        products = [p for p in products if p["display_price"] <= max_price]
-    
-    # Sort products
+    def matches(product: Dict) -> bool:
+        if category and product["category"] != category:
+            return False
+        if min_price and product["display_price"] < min_price:
+            return False
+        if max_price and product["display_price"] > max_price:
+            return False
+        return True
+    
+    # Price-sorted browsing streams straight off the price index
+    if not q and sort_by in ("price_low", "price_high"):
+        def walk(after):
+            for key in price_index.walk(low, high, sort_by == "price_high", after):
+                product = with_display_price(products_db[key[1]], currency)
+                if matches(product):
+                    yield key, product
+        return paginate_ordered(response, walk, (float, int), cursor, limit, stream)
+    
+    # Candidates from the inverted index, the price range, or the whole catalog
+    if q:
+        product_ids = [pid for pid in catalog_index.search(q) if CatalogIndex.contains(products_db[pid], q)]
+        if low is not None or high is not None:
+            product_ids = [
+                pid for pid in product_ids
+                if (low is None or price_index.zar_prices[pid] >= low)
+                and (high is None or price_index.zar_prices[pid] <= high)
+            ]
+    elif low is not None or high is not None:
+        product_ids = [pid for _, pid in price_index.walk(low, high)]
+    else:
+        product_ids = list(products_db)
+    
+    products = [with_display_price(products_db[pid], currency) for pid in product_ids]
+    products = [p for p in products if matches(p)]
+    
+    # Sort products (ties broken by id so the order is a stable keyset)
+    shape = (float, int)
     if sort_by == "price_low":
-        products.sort(key=lambda x: x["display_price"])
+        sort_key = lambda x: (price_index.zar_prices[x["id"]], x["id"])
     elif sort_by == "price_high":
-        products.sort(key=lambda x: x["display_price"], reverse=True)
+        sort_key = lambda x: (-price_index.zar_prices[x["id"]], x["id"])
     elif sort_by == "rating":
-        products.sort(key=lambda x: x.get("rating", 0), reverse=True)
+        sort_key = lambda x: (-x.get("rating", 0), x["id"])
     elif sort_by == "popular":
-        products.sort(key=lambda x: x.get("purchase_count", 0), reverse=True)
+        sort_key = lambda x: (-x.get("purchase_count", 0), x["id"])
+    else:
+        sort_key, shape = (lambda x: (x["id"],)), (int,)
+    products.sort(key=sort_key)
     
-    return products
+    return paginate(response, products, sort_key, cursor, limit, stream, shape=shape)
 
 @app.get("/api/products/{product_id}")
 async def get_product(product_id: int, currency: Currency = Currency.ZAR):
     if product_id not in products_db:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    product = products_db[product_id].copy()
-    product["display_price"] = convert_currency(product["base_price"], product["currency"], currency)
-    product["display_currency"] = currency
+    product = with_display_price(products_db[product_id], currency)
     
     # Increment view count
     products_db[product_id]["view_count"] += 1
+    storage.put("products", product_id, "view_count")
+    seller_analytics.record_view(products_db[product_id], datetime.now())
     
     return product
 
@@ -389,7 +1865,7 @@ async def create_product(
     product: Dict[str, Any],
     current_user: dict = Depends(require_role([UserRole.SELLER, UserRole.ADMIN]))
 ):
-    product_id = max(products_db.keys()) + 1 if products_db else 1
+    product_id = sequences.next_id("products")
     product["id"] = product_id
     product["seller_id"] = current_user["id"]
     product["created_at"] = datetime.now()
@@ -399,10 +1875,12 @@ async def create_product(
     product["purchase_count"] = 0
     
     products_db[product_id] = product
+    storage.put("products", product_id)
+    index_product(product)
     
     # Initialize inventory for variants
     for variant in product.get("variants", []):
-        inventory_db[variant["sku"]] = variant["stock"]
+        set_stock(variant["sku"], variant["stock"])
     
     return product
 
@@ -423,19 +1901,153 @@ async def update_product(
     
     # Track price changes for dynamic pricing
     if "base_price" in updates and updates["base_price"] != product["base_price"]:
-        price_history_db[product_id].append({
-            "old_price": product["base_price"],
-            "new_price": updates["base_price"],
-            "timestamp": datetime.now()
-        })
+        record_price_change(product_id, product["base_price"], updates["base_price"])
     
     products_db[product_id].update(updates)
+    storage.put("products", product_id)
+    index_product(products_db[product_id])
     return products_db[product_id]
 
 # ============================================================================
 # 3. INVENTORY & STOCK ENGINE (Real-time)
 # ============================================================================
 
+def inventory_topic(sku: str) -> str:
+    return f"inventory:{sku}"
+
+def set_stock(sku: str, stock: int):
+    """Single write path for stock levels so every change reaches watchers"""
+    inventory_db[sku] = stock
+    storage.put("inventory", sku)
+    broker.publish(inventory_topic(sku), {"sku": sku, "stock": stock})
+
+# Products created before stock was tracked separately (e.g. the seed catalogue)
+for product in products_db.values():
+    for variant in product.get("variants", []):
+        inventory_db.setdefault(variant["sku"], variant["stock"])
+
+RESERVATION_TTL_SECONDS = 900
+MAX_RESERVATION_TTL_SECONDS = 3600
+RESERVATION_SWEEP_SECONDS = 1.0
+INVENTORY_LOCK_STRIPES = 64
+
+def cart_demand(items: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Total quantity per SKU across cart or order lines"""
+    demand: Dict[str, int] = defaultdict(int)
+    for item in items:
+        if item.get("quantity", 0) <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        if item.get("sku"):
+            demand[item["sku"]] += item["quantity"]
+    return dict(demand)
+
+class ReservationEngine:
+    """Time-limited stock holds.
+    
+    Held units leave inventory_db straight away, so the stock figure is always
+    what is still available to sell. A hold then either becomes part of an
+    order (commit) or hands its units back (release, or the expiry sweep).
+    SKUs are guarded by a fixed set of striped locks, always taken in stripe
+    order, so concurrent multi-SKU carts cannot deadlock each other.
+    """
+    
+    def __init__(self, stripes: int = INVENTORY_LOCK_STRIPES):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._expiry_lock = threading.Lock()
+        self._expiry: List[tuple] = []  # (expires_at, hold id); stale entries skipped on pop
+        for hold in reservations_db.values():
+            self._schedule(hold)
+    
+    @contextmanager
+    def _locked(self, skus):
+        stripes = sorted({hash(sku) % len(self._locks) for sku in skus})
+        for stripe in stripes:
+            self._locks[stripe].acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self._locks[stripe].release()
+    
+    def _schedule(self, hold: Dict):
+        with self._expiry_lock:
+            heapq.heappush(self._expiry, (hold["expires_at"], hold["id"]))
+    
+    @staticmethod
+    def _adjust(items: Dict[str, int], sign: int):
+        # Caller holds the stripes for every SKU in items
+        if sign < 0:
+            for sku, quantity in items.items():
+                if sku not in inventory_db:
+                    raise HTTPException(status_code=404, detail=f"SKU {sku} not found")
+                if inventory_db[sku] < quantity:
+                    raise HTTPException(status_code=400, detail=f"Insufficient stock for {sku}")
+        for sku, quantity in items.items():
+            if sku in inventory_db:
+                set_stock(sku, inventory_db[sku] + sign * quantity)
+    
+    def take(self, items: Dict[str, int]):
+        """Decrement stock for every SKU, or for none of them"""
+        with self._locked(items):
+            self._adjust(items, -1)
+    
+    def restock(self, items: Dict[str, int]):
+        with self._locked(items):
+            self._adjust(items, 1)
+    
+    def reserve(self, user_id: int, items: Dict[str, int], ttl_seconds: int) -> Dict:
+        """Hold every SKU in items for ttl_seconds, all-or-nothing"""
+        with self._locked(items):
+            self._adjust(items, -1)
+            now = datetime.now()
+            hold = {
+                "id": sequences.next_id("reservations"),
+                "user_id": user_id,
+                "items": dict(items),
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=ttl_seconds)
+            }
+            reservations_db[hold["id"]] = hold
+            storage.put("reservations", hold["id"])
+        self._schedule(hold)
+        return hold
+    
+    def _finish(self, hold_id: int, restore: bool) -> Optional[Dict]:
+        hold = reservations_db.get(hold_id)
+        if hold is None:
+            return None
+        with self._locked(hold["items"]):
+            # Lost a race with another commit/release of the same hold
+            if reservations_db.pop(hold_id, None) is None:
+                return None
+            storage.delete("reservations", hold_id)
+            if restore:
+                self._adjust(hold["items"], 1)
+        return hold
+    
+    def commit(self, hold_id: int) -> Optional[Dict]:
+        """Turn a hold into sold stock; None if it is already gone"""
+        return self._finish(hold_id, restore=False)
+    
+    def release(self, hold_id: int) -> Optional[Dict]:
+        return self._finish(hold_id, restore=True)
+    
+    def sweep(self, now: Optional[datetime] = None) -> int:
+        """Release every hold that has expired; returns how many were released"""
+        now = now or datetime.now()
+        expired = []
+        with self._expiry_lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expired.append(heapq.heappop(self._expiry)[1])
+        return sum(1 for hold_id in expired if self.release(hold_id))
+
+reservations = ReservationEngine()
+
+async def sweep_expired_reservations():
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+        reservations.sweep()
+
 @app.get("/api/inventory/{sku}")
 async def check_inventory(sku: str):
     if sku not in inventory_db:
@@ -443,69 +2055,284 @@ async def check_inventory(sku: str):
     return {"sku": sku, "stock": inventory_db[sku], "available": inventory_db[sku] > 0}
 
 @app.post("/api/inventory/reserve")
-async def reserve_inventory(sku: str, quantity: int, current_user: dict = Depends(get_current_user)):
+async def reserve_inventory(
+    sku: str,
+    quantity: int = Query(..., gt=0),
+    ttl_seconds: int = Query(RESERVATION_TTL_SECONDS, ge=1, le=MAX_RESERVATION_TTL_SECONDS),
+    current_user: dict = Depends(get_current_user)
+):
     if sku not in inventory_db:
         raise HTTPException(status_code=404, detail="SKU not found")
     
-    if inventory_db[sku] < quantity:
-        raise HTTPException(status_code=400, detail="Insufficient stock")
+    hold = reservations.reserve(current_user["id"], {sku: quantity}, ttl_seconds)
+    return {
+        "message": "Inventory reserved",
+        "reservation_id": hold["id"],
+        "expires_at": hold["expires_at"],
+        "remaining_stock": inventory_db[sku]
+    }
+
+@app.post("/api/inventory/reservations")
+async def reserve_cart(
+    items: List[Dict[str, Any]],
+    ttl_seconds: int = Query(RESERVATION_TTL_SECONDS, ge=1, le=MAX_RESERVATION_TTL_SECONDS),
+    current_user: dict = Depends(get_current_user)
+):
+    """Reserve a whole cart: either every line is held or none is"""
+    demand = cart_demand(items)
+    if not demand:
+        raise HTTPException(status_code=400, detail="No SKUs to reserve")
     
-    inventory_db[sku] -= quantity
-    return {"message": "Inventory reserved", "remaining_stock": inventory_db[sku]}
+    hold = reservations.reserve(current_user["id"], demand, ttl_seconds)
+    return {**hold, "remaining_stock": {sku: inventory_db[sku] for sku in demand}}
+
+def get_own_reservation(reservation_id: int, current_user: dict) -> Dict:
+    hold = reservations_db.get(reservation_id)
+    if hold is None or (hold["user_id"] != current_user["id"] and current_user["role"] != "admin"):
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return hold
+
+@app.get("/api/inventory/reservations/{reservation_id}")
+async def get_reservation(reservation_id: int, current_user: dict = Depends(get_current_user)):
+    return get_own_reservation(reservation_id, current_user)
+
+@app.delete("/api/inventory/reservations/{reservation_id}")
+async def release_reservation(reservation_id: int, current_user: dict = Depends(get_current_user)):
+    get_own_reservation(reservation_id, current_user)
+    if reservations.release(reservation_id) is None:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return {"message": "Reservation released"}
 
 @app.websocket("/ws/inventory/{sku}")
 async def inventory_websocket(websocket: WebSocket, sku: str):
-    await websocket.accept()
-    try:
-        while True:
-            if sku in inventory_db:
-                await websocket.send_json({"sku": sku, "stock": inventory_db[sku]})
-            await asyncio.sleep(2)
-    except:
-        pass
+    snapshot = {"sku": sku, "stock": inventory_db[sku]} if sku in inventory_db else None
+    await serve_subscription(websocket, inventory_topic(sku), snapshot)
 
 # ============================================================================
 # 4. ORDER MANAGEMENT SYSTEM (OMS)
 # ============================================================================
 
-@app.post("/api/orders")
-async def create_order(
-    items: List[Dict[str, Any]],
-    shipping_address: Dict[str, str],
-    current_user: dict = Depends(get_current_user)
-):
-    order_id = max(orders_db.keys()) + 1 if orders_db else 1
-    
-    total_amount = 0
+def variant_adjustment(product: Dict, sku: Optional[str]) -> float:
+    for variant in product.get("variants", []):
+        if variant["sku"] == sku:
+            return variant.get("price_adjustment", 0)
+    return 0
+
+def validate_order_items(items: List[Dict[str, Any]]):
     for item in items:
-        product = products_db.get(item["product_id"])
+        product = products_db.get(item.get("product_id"))
         if not product:
-            raise HTTPException(status_code=404, detail=f"Product {item['product_id']} not found")
-        total_amount += product["base_price"] * item["quantity"]
-    
-    order = {
+            raise HTTPException(status_code=404, detail=f"Product {item.get('product_id')} not found")
+        if item.get("sku") and item["sku"] not in {v["sku"] for v in product.get("variants", [])}:
+            raise HTTPException(status_code=400, detail=f"SKU {item['sku']} is not a variant of product {product['id']}")
+
+def price_order_lines(items: List[Dict[str, Any]]) -> np.ndarray:
+    """Line totals for validated items: (base price + variant price_adjustment) x quantity"""
+    unit_prices = np.fromiter(
+        (products_db[item["product_id"]]["base_price"]
+         + variant_adjustment(products_db[item["product_id"]], item.get("sku")) for item in items),
+        dtype=float, count=len(items)
+    )
+    quantities = np.fromiter((item["quantity"] for item in items), dtype=float, count=len(items))
+    return unit_prices * quantities
+
+def record_unit_prices(items: List[Dict[str, Any]], line_totals: np.ndarray):
+    """Keep the price each line was charged at on the line itself"""
+    for item, line_total in zip(items, line_totals.tolist()):
+        item["unit_price"] = round(line_total / item["quantity"], 2)
+
+def charged_unit_price(item: Dict[str, Any]) -> float:
+    """The unit price a line was charged at"""
+    # Orders placed before unit prices were recorded fall back to the catalog
+    if "unit_price" in item:
+        return item["unit_price"]
+    product = products_db.get(item["product_id"])
+    return product["base_price"] + variant_adjustment(product, item.get("sku")) if product else 0.0
+
+def claim_order_stock(items: List[Dict[str, Any]], reservation_id: Optional[int], current_user: dict):
+    # Stock leaves inventory here: either an earlier hold is converted, or the
+    # order's SKUs are taken all-or-nothing on the spot
+    demand = cart_demand(items)
+    if reservation_id is not None:
+        hold = get_own_reservation(reservation_id, current_user)
+        if hold["items"] != demand:
+            raise HTTPException(status_code=400, detail="Reservation does not match order items")
+        if hold["expires_at"] <= datetime.now() or reservations.commit(reservation_id) is None:
+            raise HTTPException(status_code=410, detail="Reservation expired")
+    elif demand:
+        reservations.take(demand)
+
+def new_order(order_id: int, user_id: int, items: List[Dict[str, Any]], shipping_address: Dict[str, str], total_amount: float) -> Dict:
+    now = datetime.now()
+    return {
         "id": order_id,
-        "user_id": current_user["id"],
+        "user_id": user_id,
         "items": items,
         "total_amount": total_amount,
         "currency": "ZAR",
         "status": "pending",
         "shipping_address": shipping_address,
-        "created_at": datetime.now(),
-        "updated_at": datetime.now()
+        "created_at": now,
+        "updated_at": now
     }
+
+def record_new_order(order: Dict):
+    index_order(order)
+    co_purchase_index.add_order(order)
+    personalized_scorer.record_purchase(order["user_id"], order)
+    
+    for item in order["items"]:
+        product = products_db[item["product_id"]]
+        product["purchase_count"] = product.get("purchase_count", 0) + item["quantity"]
+        storage.put("products", product["id"], "purchase_count")
+        personalized_scorer.update_boost(product)
+        dashboard_rollups.record_sale(product)
+    
+    lines = priced_lines(order)
+    dashboard_rollups.add_order(order, lines)
+    seller_analytics.add_order(order, lines)
+
+def record_cancelled_order(order: Dict):
+    """Take a cancelled order back out of the sales figures record_new_order added it to"""
+    for item in order["items"]:
+        product = products_db.get(item["product_id"])
+        if not product:
+            continue
+        product["purchase_count"] = max(product.get("purchase_count", 0) - item["quantity"], 0)
+        storage.put("products", product["id"], "purchase_count")
+        personalized_scorer.update_boost(product)
+        dashboard_rollups.withdraw_sale(product)
     
-    orders_db[order_id] = order
+    lines = priced_lines(order)
+    dashboard_rollups.add_order(order, lines, sign=-1)
+    seller_analytics.add_order(order, lines, sign=-1)
+
+@app.post("/api/orders")
+async def create_order(
+    items: List[Dict[str, Any]],
+    shipping_address: Dict[str, str],
+    reservation_id: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    validate_order_items(items)
+    claim_order_stock(items, reservation_id, current_user)
+    order_id = sequences.next_id("orders")
+    try:
+        line_totals = price_order_lines(items)
+        record_unit_prices(items, line_totals)
+        total_amount = round(float(line_totals.sum()), 2)
+        order = new_order(order_id, current_user["id"], items, shipping_address, total_amount)
+        
+        orders_db[order_id] = order
+        storage.put("orders", order_id)
+    except Exception:
+        # The order was not stored: hand the claimed units back
+        orders_db.pop(order_id, None)
+        reservations.restock(cart_demand(items))
+        raise
+    record_new_order(order)
     
     # Hold funds in escrow
     escrow_db[order_id] = total_amount
+    storage.put("escrow", order_id)
     
+    await storage.sync()
     return order
 
+MAX_BULK_ORDERS = 5000
+# Orders in these states still hold their units; shipping hands them over
+STOCK_HOLDING_STATUSES = (OrderStatus.PENDING, OrderStatus.PAID, OrderStatus.PROCESSING)
+
+@app.post("/api/orders/bulk")
+async def create_orders_bulk(
+    orders: List[Any],
+    current_user: dict = Depends(get_current_user)
+):
+    """Create many orders in one call; each order succeeds or fails on its own.
+    
+    Each entry is {"items": [...], "shipping_address": {...}} with an optional
+    "reservation_id". Results come back in request order; an order that fails
+    keeps no stock.
+    """
+    if len(orders) > MAX_BULK_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ORDERS} orders per request")
+    
+    results: List[Optional[Dict]] = [None] * len(orders)
+    accepted = []
+    for position, payload in enumerate(orders):
+        try:
+            entry = BulkOrderEntry.model_validate(payload)
+            items = [line.model_dump(exclude_none=True) for line in entry.items]
+            validate_order_items(items)
+            claim_order_stock(items, entry.reservation_id, current_user)
+        except ValidationError as e:
+            detail = e.errors(include_url=False, include_context=False, include_input=False)
+            results[position] = {"index": position, "status": "failed", "status_code": 422, "detail": detail}
+            continue
+        except HTTPException as e:
+            results[position] = {"index": position, "status": "failed", "status_code": e.status_code, "detail": e.detail}
+            continue
+        except Exception:
+            # Stock is claimed last and all-or-nothing, so this order holds none
+            logger.exception("Bulk order entry %d failed", position)
+            results[position] = {"index": position, "status": "failed", "status_code": 500, "detail": "Order could not be created"}
+            continue
+        accepted.append((position, items, entry.shipping_address))
+    
+    if accepted:
+        order_ids = sequences.next_ids("orders", len(accepted))
+        try:
+            # Price every line of the batch at once, then total per order
+            lines = [item for _, items, _ in accepted for item in items]
+            line_totals = price_order_lines(lines)
+            record_unit_prices(lines, line_totals)
+            starts = np.cumsum([0] + [len(items) for _, items, _ in accepted[:-1]])
+            totals = np.round(np.add.reduceat(line_totals, starts), 2)
+            
+            created = [
+                new_order(order_id, current_user["id"], items, shipping_address, float(total))
+                for order_id, (_, items, shipping_address), total in zip(order_ids, accepted, totals)
+            ]
+            orders_db.update((order["id"], order) for order in created)
+            storage.put_many("orders", order_ids)
+        except Exception:
+            # Nothing was created: hand every claimed unit back
+            logger.exception("Bulk order batch could not be stored")
+            for order_id in order_ids:
+                orders_db.pop(order_id, None)
+            for position, items, _ in accepted:
+                reservations.restock(cart_demand(items))
+                results[position] = {"index": position, "status": "failed", "status_code": 500, "detail": "Order could not be stored"}
+            accepted = []
+        else:
+            for order in created:
+                record_new_order(order)
+            
+            # Hold funds in escrow
+            escrow_db.update((order["id"], order["total_amount"]) for order in created)
+            storage.put_many("escrow", order_ids)
+            
+            for (position, _, _), order in zip(accepted, created):
+                results[position] = {"index": position, "status": "created", "order_id": order["id"], "total_amount": order["total_amount"]}
+            
+            await storage.sync()
+    
+    return {
+        "created": len(accepted),
+        "failed": len(orders) - len(accepted),
+        "results": results
+    }
+
 @app.get("/api/orders")
-async def get_orders(current_user: dict = Depends(get_current_user)):
-    user_orders = [o for o in orders_db.values() if o["user_id"] == current_user["id"]]
-    return user_orders
+async def get_orders(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    order_ids = orders_by_user.ids(current_user["id"])
+    return paginate(response, order_ids, by_id, cursor, limit, stream, orders_db.__getitem__)
 
 @app.get("/api/orders/{order_id}")
 async def get_order(order_id: int, current_user: dict = Depends(get_current_user)):
@@ -527,12 +2354,25 @@ async def update_order_status(
     if order_id not in orders_db:
         raise HTTPException(status_code=404, detail="Order not found")
     
+    order = orders_db[order_id]
+    if order["status"] == OrderStatus.CANCELLED and status != OrderStatus.CANCELLED:
+        raise HTTPException(status_code=409, detail="Cancelled orders cannot be reopened")
+    
+    if status == OrderStatus.CANCELLED and order["status"] != OrderStatus.CANCELLED:
+        # Orders cancelled before shipping hand their stock back
+        if order["status"] in STOCK_HOLDING_STATUSES:
+            reservations.restock(cart_demand(order["items"]))
+        record_cancelled_order(order)
+    
     orders_db[order_id]["status"] = status
     orders_db[order_id]["updated_at"] = datetime.now()
+    storage.put("orders", order_id)
+    index_order(orders_db[order_id])
     
     # Release escrow when delivered
     if status == OrderStatus.DELIVERED and order_id in escrow_db:
         amount = escrow_db.pop(order_id)
+        storage.delete("escrow", order_id)
         # In production: Transfer to seller's account
         
     return orders_db[order_id]
@@ -541,21 +2381,51 @@ async def update_order_status(
 # 5. REVIEW & RATING SYSTEM
 # ============================================================================
 
+class RatingAggregate:
+    """Running rating totals for one product, updated in O(1) per review"""
+    __slots__ = ("total", "count", "histogram", "verified_total", "verified_count")
+    
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.histogram = [0] * 5  # Reviews per star, 1-5
+        self.verified_total = 0
+        self.verified_count = 0
+    
+    def add(self, rating: int, verified: bool):
+        self.total += rating
+        self.count += 1
+        self.histogram[rating - 1] += 1
+        if verified:
+            self.verified_total += rating
+            self.verified_count += 1
+    
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+    
+    @property
+    def verified_average(self) -> float:
+        return self.verified_total / self.verified_count if self.verified_count else 0.0
+
+rating_aggregates: Dict[int, RatingAggregate] = defaultdict(RatingAggregate)
+for review in reviews_db.values():
+    rating_aggregates[review["product_id"]].add(review["rating"], review["is_verified_purchase"])
+
 @app.post("/api/reviews")
 async def create_review(
     product_id: int,
-    rating: int,
-    comment: str,
+    rating: int = Query(..., ge=1, le=5),
+    comment: str = Query(...),
     current_user: dict = Depends(get_current_user)
 ):
+    if product_id not in products_db:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
     # Check if user has purchased this product
-    user_orders = [o for o in orders_db.values() if o["user_id"] == current_user["id"] and o["status"] == "delivered"]
-    has_purchased = any(
-        any(item["product_id"] == product_id for item in order["items"])
-        for order in user_orders
-    )
+    has_purchased = delivered_purchases.count((current_user["id"], product_id)) > 0
     
-    review_id = max(reviews_db.keys()) + 1 if reviews_db else 1
+    review_id = sequences.next_id("reviews")
     review = {
         "id": review_id,
         "product_id": product_id,
@@ -568,28 +2438,103 @@ async def create_review(
     }
     
     reviews_db[review_id] = review
+    storage.put("reviews", review_id)
+    review_index.add(review)
     
     # Update product rating
-    product_reviews = [r for r in reviews_db.values() if r["product_id"] == product_id]
-    avg_rating = sum(r["rating"] for r in product_reviews) / len(product_reviews)
-    products_db[product_id]["rating"] = round(avg_rating, 1)
-    products_db[product_id]["reviews_count"] = len(product_reviews)
+    aggregate = rating_aggregates[product_id]
+    aggregate.add(rating, has_purchased)
+    products_db[product_id]["rating"] = round(aggregate.average, 1)
+    products_db[product_id]["reviews_count"] = aggregate.count
+    storage.put("products", product_id)
+    personalized_scorer.update_boost(products_db[product_id])
     
     return review
 
+@app.get("/api/products/{product_id}/rating-summary")
+async def get_rating_summary(product_id: int):
+    if product_id not in products_db:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    aggregate = rating_aggregates.get(product_id, RatingAggregate())
+    return {
+        "product_id": product_id,
+        "average_rating": round(aggregate.average, 2),
+        "reviews_count": aggregate.count,
+        "histogram": {star: aggregate.histogram[star - 1] for star in range(1, 6)},
+        "verified_average_rating": round(aggregate.verified_average, 2),
+        "verified_reviews_count": aggregate.verified_count
+    }
+
+class ReviewIndex:
+    """Per-product reviews ordered by helpfulness (most helpful first, then oldest)"""
+    
+    def __init__(self):
+        self.all: Dict[int, SortedKeyList] = defaultdict(SortedKeyList)
+        self.verified: Dict[int, SortedKeyList] = defaultdict(SortedKeyList)
+    
+    @staticmethod
+    def key(review: Dict, helpful_count: Optional[int] = None) -> tuple:
+        if helpful_count is None:
+            helpful_count = review["helpful_count"]
+        return (-helpful_count, review["id"])
+    
+    def _lists(self, review: Dict) -> List[SortedKeyList]:
+        lists = [self.all[review["product_id"]]]
+        if review["is_verified_purchase"]:
+            lists.append(self.verified[review["product_id"]])
+        return lists
+    
+    def add(self, review: Dict):
+        for keys in self._lists(review):
+            keys.add(self.key(review))
+    
+    def update_helpful(self, review: Dict, old_helpful_count: int):
+        for keys in self._lists(review):
+            keys.remove(self.key(review, old_helpful_count))
+            keys.add(self.key(review))
+    
+    def page(self, product_id: int, verified_only: bool, after: Optional[tuple], limit: int) -> List[int]:
+        keys = (self.verified if verified_only else self.all).get(product_id)
+        if keys is None:
+            return []
+        review_ids = []
+        for _, review_id in keys.irange(after, inclusive=False):
+            review_ids.append(review_id)
+            if len(review_ids) == limit:
+                break
+        return review_ids
+
+review_index = ReviewIndex()
+for review in reviews_db.values():
+    review_index.add(review)
+
 @app.get("/api/products/{product_id}/reviews")
-async def get_reviews(product_id: int, verified_only: bool = False):
-    product_reviews = [r for r in reviews_db.values() if r["product_id"] == product_id]
-    if verified_only:
-        product_reviews = [r for r in product_reviews if r["is_verified_purchase"]]
-    return sorted(product_reviews, key=lambda x: x["helpful_count"], reverse=True)
+async def get_reviews(
+    product_id: int,
+    response: Response,
+    verified_only: bool = False,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500)
+):
+    after = decode_cursor(cursor, (int, int)) if cursor else None
+    review_ids = review_index.page(product_id, verified_only, after, limit + 1)
+    
+    page = [reviews_db[rid] for rid in review_ids[:limit]]
+    if len(review_ids) > limit:
+        last = page[-1]
+        set_next_cursor(response, encode_cursor(*ReviewIndex.key(last)))
+    return page
 
 @app.post("/api/reviews/{review_id}/helpful")
 async def mark_helpful(review_id: int):
     if review_id not in reviews_db:
         raise HTTPException(status_code=404, detail="Review not found")
-    reviews_db[review_id]["helpful_count"] += 1
-    return reviews_db[review_id]
+    review = reviews_db[review_id]
+    review["helpful_count"] += 1
+    storage.put("reviews", review_id, "helpful_count")
+    review_index.update_helpful(review, review["helpful_count"] - 1)
+    return review
 
 # ============================================================================
 # 6. REQUEST FOR QUOTATION (RFQ) SYSTEM
@@ -604,7 +2549,7 @@ async def create_rfq(
     message: str,
     current_user: dict = Depends(get_current_user)
 ):
-    rfq_id = max(rfqs_db.keys()) + 1 if rfqs_db else 1
+    rfq_id = sequences.next_id("rfqs")
     rfq = {
         "id": rfq_id,
         "buyer_id": current_user["id"],
@@ -617,13 +2562,23 @@ async def create_rfq(
         "created_at": datetime.now()
     }
     rfqs_db[rfq_id] = rfq
+    storage.put("rfqs", rfq_id)
+    index_rfq(rfq)
     return rfq
 
 @app.get("/api/rfq")
-async def get_rfqs(current_user: dict = Depends(get_current_user)):
+async def get_rfqs(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
     if current_user["role"] == "seller":
-        return [r for r in rfqs_db.values() if r["seller_id"] == current_user["id"]]
-    return [r for r in rfqs_db.values() if r["buyer_id"] == current_user["id"]]
+        rfq_ids = rfqs_by_seller.ids(current_user["id"])
+    else:
+        rfq_ids = rfqs_by_buyer.ids(current_user["id"])
+    return paginate(response, rfq_ids, by_id, cursor, limit, stream, rfqs_db.__getitem__)
 
 @app.put("/api/rfq/{rfq_id}/respond")
 async def respond_rfq(
@@ -644,6 +2599,8 @@ async def respond_rfq(
         "seller_response": response,
         "final_price": final_price
     })
+    storage.put("rfqs", rfq_id)
+    index_rfq(rfqs_db[rfq_id])
     
     return rfqs_db[rfq_id]
 
@@ -651,6 +2608,170 @@ async def respond_rfq(
 # 7. BIDDING & AUCTION ENGINE
 # ============================================================================
 
+SNIPER_WINDOW_SECONDS = 10
+SNIPER_EXTENSION_SECONDS = 30
+ENDING_SOON_MINUTES = 60
+
+class AuctionScheduler:
+    """Closes auctions at their end_time.
+    
+    Deadlines sit in a min-heap that one task sleeps on. An extension pushes a
+    fresh entry and the superseded one is skipped when it surfaces. Live
+    auctions are also kept in a sorted (end timestamp, auction ID) index that
+    serves the ending-soon listing.
+    """
+    
+    def __init__(self):
+        self._heap: List[tuple] = []  # (end_time, auction ID)
+        self.deadlines = SortedKeyList()
+        self._keys: Dict[int, tuple] = {}
+        self.wakeup: Optional[asyncio.Event] = None
+    
+    def schedule(self, auction: Dict):
+        """(Re)arm the deadline of an active auction after creation or extension"""
+        key = (auction["end_time"].timestamp(), auction["id"])
+        old_key = self._keys.get(auction["id"])
+        if old_key == key:
+            return
+        if old_key is not None:
+            self.deadlines.remove(old_key)
+        self._keys[auction["id"]] = key
+        self.deadlines.add(key)
+        heapq.heappush(self._heap, (auction["end_time"], auction["id"]))
+        if self.wakeup is not None:
+            self.wakeup.set()
+    
+    def rebuild(self, auctions: Dict[int, Dict]):
+        for auction in auctions.values():
+            if auction["status"] == AuctionStatus.ACTIVE:
+                self.schedule(auction)
+    
+    def settle(self, auction: Dict):
+        """End an auction and record whether the reserve was met"""
+        key = self._keys.pop(auction["id"], None)
+        if key is not None:
+            self.deadlines.remove(key)
+        
+        reserve_met = auction["highest_bidder_id"] is not None and auction["current_bid"] >= auction["reserve_price"]
+        auction["status"] = "ended"
+        auction["ended_at"] = datetime.now()
+        auction["reserve_met"] = reserve_met
+        auction["winner_id"] = auction["highest_bidder_id"] if reserve_met else None
+        storage.put("auctions", auction["id"])
+        index_auction(auction)
+        auction_locks.pop(auction["id"], None)
+        broker.publish(auction_topic(auction["id"]), {
+            "type": "ended",
+            "auction_id": auction["id"],
+            "final_bid": auction["current_bid"],
+            "reserve_met": reserve_met,
+            "winner_id": auction["winner_id"]
+        }, coalesce=False)
+    
+    def close_due(self, now: Optional[datetime] = None) -> Optional[float]:
+        """Settle every auction past its deadline; returns seconds until the next one"""
+        now = now or datetime.now()
+        while self._heap and self._heap[0][0] <= now:
+            end_time, auction_id = heapq.heappop(self._heap)
+            auction = auctions_db.get(auction_id)
+            # Stale entry: extended since, or already settled
+            if auction is None or auction["status"] != AuctionStatus.ACTIVE or auction["end_time"] != end_time:
+                continue
+            self.settle(auction)
+        return (self._heap[0][0] - now).total_seconds() if self._heap else None
+    
+    def walk_ending(self, before: float, after: Optional[tuple] = None):
+        """(end timestamp, auction ID) keys of live auctions ending up to before"""
+        for key in self.deadlines.irange(after, inclusive=not after):
+            if key[0] > before:
+                return
+            yield key
+    
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            self.wakeup.clear()
+            delay = self.close_due()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+auction_scheduler = AuctionScheduler()
+auction_scheduler.rebuild(auctions_db)
+
+def active_auction_count() -> int:
+    auction_scheduler.close_due()
+    return auctions_by_status.count(AuctionStatus.ACTIVE)
+
+class BidLedger:
+    """Append-only bids of one auction, held column-wise in typed arrays"""
+    
+    def __init__(self, entries=()):
+        self.bid_ids = array("q")
+        self.user_ids = array("q")
+        self.amounts = array("d")
+        self.timestamps = array("d")  # Unix seconds
+        for entry in entries:
+            self.append(entry)
+    
+    def __len__(self) -> int:
+        return len(self.bid_ids)
+    
+    def __iter__(self) -> Iterator[tuple]:
+        return zip(self.bid_ids, self.user_ids, self.amounts, self.timestamps)
+    
+    def append(self, entry: tuple):
+        """Add a (bid ID, user ID, amount, unix timestamp) entry"""
+        bid_id, user_id, amount, timestamp = entry
+        self.bid_ids.append(bid_id)
+        self.user_ids.append(user_id)
+        self.amounts.append(amount)
+        self.timestamps.append(timestamp)
+    
+    def bid(self, position: int, auction_id: int) -> Dict:
+        return {
+            "id": self.bid_ids[position],
+            "auction_id": auction_id,
+            "user_id": self.user_ids[position],
+            "amount": self.amounts[position],
+            "timestamp": datetime.fromtimestamp(self.timestamps[position])
+        }
+
+def bid_ledger(auction_id: int) -> BidLedger:
+    ledger = bid_ledgers_db.get(auction_id)
+    if ledger is None:
+        ledger = bid_ledgers_db[auction_id] = BidLedger()
+        storage.put("bid_ledgers", auction_id)
+    return ledger
+
+# Storage hands ledgers back as plain entry lists
+for auction_id, entries in list(bid_ledgers_db.items()):
+    if not isinstance(entries, BidLedger):
+        bid_ledgers_db[auction_id] = BidLedger(entries)
+sequences.seed("bids", max((ledger.bid_ids[-1] for ledger in bid_ledgers_db.values() if len(ledger)), default=0))
+
+# One writer per auction: a bid is validated, recorded and published while
+# holding its auction's lock, so concurrent bids are applied one at a time.
+# Only active auctions have a lock; settling one drops it.
+auction_locks: Dict[int, asyncio.Lock] = {
+    auction_id: asyncio.Lock() for auction_id, auction in auctions_db.items() if auction["status"] == AuctionStatus.ACTIVE
+}
+
+def auction_topic(auction_id: int) -> str:
+    return f"auction:{auction_id}"
+
+def auction_state(auction: Dict) -> Dict:
+    return {
+        "type": "state",
+        "auction_id": auction["id"],
+        "status": auction["status"],
+        "current_bid": auction["current_bid"],
+        "highest_bidder_id": auction["highest_bidder_id"],
+        "bid_count": auction["bid_count"],
+        "end_time": auction["end_time"]
+    }
+
 @app.post("/api/auctions")
 async def create_auction(
     product_id: int,
@@ -659,7 +2780,7 @@ async def create_auction(
     duration_hours: int,
     current_user: dict = Depends(require_role([UserRole.SELLER, UserRole.ADMIN]))
 ):
-    auction_id = max(auctions_db.keys()) + 1 if auctions_db else 1
+    auction_id = sequences.next_id("auctions")
     start_time = datetime.now()
     end_time = start_time + timedelta(hours=duration_hours)
     
@@ -679,6 +2800,11 @@ async def create_auction(
     }
     
     auctions_db[auction_id] = auction
+    storage.put("auctions", auction_id)
+    index_auction(auction)
+    bid_ledger(auction_id)
+    auction_locks[auction_id] = asyncio.Lock()
+    auction_scheduler.schedule(auction)
     return auction
 
 @app.post("/api/auctions/{auction_id}/bid")
@@ -689,48 +2815,119 @@ async def place_bid(
 ):
     if auction_id not in auctions_db:
         raise HTTPException(status_code=404, detail="Auction not found")
-    
-    auction = auctions_db[auction_id]
-    
-    if auction["status"] != "active":
+    lock = auction_locks.get(auction_id)
+    if lock is None:
         raise HTTPException(status_code=400, detail="Auction is not active")
     
-    if datetime.now() > auction["end_time"]:
-        auctions_db[auction_id]["status"] = "ended"
-        raise HTTPException(status_code=400, detail="Auction has ended")
-    
-    if amount <= auction["current_bid"]:
-        raise HTTPException(status_code=400, detail="Bid must be higher than current bid")
+    async with lock:
+        auction = auctions_db[auction_id]
+        
+        # Settled while this bid waited for the lock
+        if auction["status"] != "active":
+            raise HTTPException(status_code=400, detail="Auction is not active")
+        
+        now = datetime.now()
+        if now >= auction["end_time"]:
+            auction_scheduler.settle(auction)
+            raise HTTPException(status_code=400, detail="Auction has ended")
+        
+        if amount <= auction["current_bid"]:
+            raise HTTPException(status_code=400, detail="Bid must be higher than current bid")
+        
+        # Sniper protection: Extend auction if bid placed in last 10 seconds
+        time_remaining = (auction["end_time"] - now).total_seconds()
+        extended = auction["sniper_protection"] and time_remaining < SNIPER_WINDOW_SECONDS
+        if extended:
+            auction["end_time"] += timedelta(seconds=SNIPER_EXTENSION_SECONDS)
+            auction_scheduler.schedule(auction)
+        
+        # Record bid
+        bid_id = sequences.next_id("bids")
+        entry = (bid_id, current_user["id"], amount, now.timestamp())
+        bid_ledger(auction_id).append(entry)
+        storage.append("bid_ledgers", auction_id, entry)
+        
+        # Update auction
+        auction["current_bid"] = amount
+        auction["highest_bidder_id"] = current_user["id"]
+        auction["bid_count"] += 1
+        storage.put("auctions", auction_id)
+        
+        topic = auction_topic(auction_id)
+        broker.publish(topic, {
+            "type": "bid",
+            "auction_id": auction_id,
+            "bid_id": bid_id,
+            "user_id": current_user["id"],
+            "amount": amount,
+            "bid_count": auction["bid_count"],
+            "timestamp": now
+        }, coalesce=False)
+        if extended:
+            broker.publish(topic, {"type": "extended", "auction_id": auction_id, "end_time": auction["end_time"]}, coalesce=False)
     
-    # Sniper protection: Extend auction if bid placed in last 10 seconds
-    time_remaining = (auction["end_time"] - datetime.now()).total_seconds()
-    if auction["sniper_protection"] and time_remaining < 10:
-        auction["end_time"] += timedelta(seconds=30)
+    await storage.sync()
+    return {"message": "Bid placed successfully", "auction": auction}
+
+@app.get("/api/auctions/{auction_id}/bids")
+async def get_auction_bids(
+    auction_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False
+):
+    """Bid history of an auction, newest first"""
+    if auction_id not in auctions_db:
+        raise HTTPException(status_code=404, detail="Auction not found")
     
-    # Record bid
-    bid_id = max(bids_db.keys()) + 1 if bids_db else 1
-    bid = {
-        "id": bid_id,
-        "auction_id": auction_id,
-        "user_id": current_user["id"],
-        "amount": amount,
-        "timestamp": datetime.now()
-    }
-    bids_db[bid_id] = bid
+    ledger = bid_ledgers_db.get(auction_id) or BidLedger()
     
-    # Update auction
-    auctions_db[auction_id]["current_bid"] = amount
-    auctions_db[auction_id]["highest_bidder_id"] = current_user["id"]
-    auctions_db[auction_id]["bid_count"] += 1
+    def walk(after):
+        # Ledger positions double as keys: bids are only ever appended
+        start = min(after[0] - 1, len(ledger) - 1) if after else len(ledger) - 1
+        for position in range(start, -1, -1):
+            yield (position,), ledger.bid(position, auction_id)
     
-    return {"message": "Bid placed successfully", "auction": auctions_db[auction_id]}
+    return paginate_ordered(response, walk, (int,), cursor, limit, stream)
+
+@app.websocket("/ws/auctions/{auction_id}")
+async def auction_websocket(websocket: WebSocket, auction_id: int):
+    """Live feed of accepted bids, end-time extensions and the final result"""
+    if auction_id not in auctions_db:
+        await websocket.close(code=1008)
+        return
+    await serve_subscription(websocket, auction_topic(auction_id), auction_state(auctions_db[auction_id]))
 
 @app.get("/api/auctions")
-async def get_auctions(status: Optional[AuctionStatus] = None):
-    auctions = list(auctions_db.values())
-    if status:
-        auctions = [a for a in auctions if a["status"] == status]
-    return auctions
+async def get_auctions(
+    response: Response,
+    status: Optional[AuctionStatus] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False
+):
+    auction_scheduler.close_due()
+    auction_ids = auctions_by_status.ids(status) if status else list(auctions_db)
+    return paginate(response, auction_ids, by_id, cursor, limit, stream, auctions_db.__getitem__)
+
+@app.get("/api/auctions/ending-soon")
+async def get_auctions_ending_soon(
+    response: Response,
+    within_minutes: int = Query(ENDING_SOON_MINUTES, ge=1),
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False
+):
+    """Active auctions by end time, soonest first"""
+    auction_scheduler.close_due()
+    before = (datetime.now() + timedelta(minutes=within_minutes)).timestamp()
+    
+    def walk(after):
+        for key in auction_scheduler.walk_ending(before, after):
+            yield key, auctions_db[key[1]]
+    
+    return paginate_ordered(response, walk, (float, int), cursor, limit, stream)
 
 # ============================================================================
 # 8. DISPUTE RESOLUTION CENTER
@@ -753,7 +2950,7 @@ async def create_dispute(
     # Find seller from order items
     seller_id = products_db[order["items"][0]["product_id"]]["seller_id"]
     
-    dispute_id = max(disputes_db.keys()) + 1 if disputes_db else 1
+    dispute_id = sequences.next_id("disputes")
     dispute = {
         "id": dispute_id,
         "order_id": order_id,
@@ -766,15 +2963,25 @@ async def create_dispute(
     }
     
     disputes_db[dispute_id] = dispute
+    storage.put("disputes", dispute_id)
+    index_dispute(dispute)
     return dispute
 
 @app.get("/api/disputes")
-async def get_disputes(current_user: dict = Depends(get_current_user)):
+async def get_disputes(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
     if current_user["role"] == "admin":
-        return list(disputes_db.values())
+        dispute_ids = list(disputes_db)
     elif current_user["role"] == "seller":
-        return [d for d in disputes_db.values() if d["seller_id"] == current_user["id"]]
-    return [d for d in disputes_db.values() if d["buyer_id"] == current_user["id"]]
+        dispute_ids = disputes_by_seller.ids(current_user["id"])
+    else:
+        dispute_ids = disputes_by_buyer.ids(current_user["id"])
+    return paginate(response, dispute_ids, by_id, cursor, limit, stream, disputes_db.__getitem__)
 
 @app.put("/api/disputes/{dispute_id}/resolve")
 async def resolve_dispute(
@@ -791,11 +2998,15 @@ async def resolve_dispute(
         "resolution": resolution,
         "resolved_at": datetime.now()
     })
+    storage.put("disputes", dispute_id)
+    index_dispute(disputes_db[dispute_id])
     
     # Process refund if applicable
     if refund_amount:
         order_id = disputes_db[dispute_id]["order_id"]
         orders_db[order_id]["status"] = "refunded"
+        storage.put("orders", order_id, "status")
+        index_order(orders_db[order_id])
     
     return disputes_db[dispute_id]
 
@@ -805,26 +3016,69 @@ async def resolve_dispute(
 
 def convert_currency(amount: float, from_currency: str, to_currency: str) -> float:
     """Convert amount between currencies using live rates"""
-    if from_currency == to_currency:
-        return amount
-    
-    # Convert to ZAR first, then to target currency
-    amount_in_zar = amount / EXCHANGE_RATES[from_currency]
-    return round(amount_in_zar * EXCHANGE_RATES[to_currency], 2)
+    return exchange_rates.current.convert(amount, from_currency, to_currency)
+
+async def refresh_exchange_rates() -> RateTable:
+    """Fetch rates from the provider and re-key everything normalised by them"""
+    global price_index
+    loop = asyncio.get_running_loop()
+    rates = await loop.run_in_executor(None, exchange_rates.provider.fetch)
+    table = exchange_rates.refresh(rates)
+    if price_index.rates_version != table.version:
+        price_index = await rebuild_product_index(PriceIndex(), PriceIndex.update)
+    return table
+
+async def refresh_exchange_rates_periodically():
+    while True:
+        await asyncio.sleep(RATE_REFRESH_SECONDS)
+        try:
+            await refresh_exchange_rates()
+        except Exception:
+            # Keep serving the last good table
+            logger.exception("Exchange rate refresh failed")
 
 @app.get("/api/currency/rates")
-async def get_exchange_rates():
-    return EXCHANGE_RATES
+async def get_exchange_rates(response: Response):
+    rates = exchange_rates.current
+    response.headers["X-Rates-Version"] = str(rates.version)
+    return dict(rates.rates)
+
+@app.post("/api/currency/rates/refresh")
+async def refresh_rates(current_user: dict = Depends(require_role([UserRole.ADMIN]))):
+    try:
+        table = await refresh_exchange_rates()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=502, detail=f"Rate provider failed: {e}")
+    return {"version": table.version, "fetched_at": table.fetched_at, "rates": dict(table.rates)}
 
 @app.get("/api/currency/convert")
 async def currency_convert(amount: float, from_curr: Currency, to_curr: Currency):
-    converted = convert_currency(amount, from_curr, to_curr)
+    rates = exchange_rates.current
+    converted = rates.convert(amount, from_curr, to_curr)
     return {
         "original_amount": amount,
         "original_currency": from_curr,
         "converted_amount": converted,
         "target_currency": to_curr,
-        "rate": EXCHANGE_RATES[to_curr] / EXCHANGE_RATES[from_curr]
+        "rate": rates.rate(from_curr, to_curr),
+        "rate_version": rates.version
+    }
+
+MAX_BATCH_CONVERSIONS = 10000
+
+@app.post("/api/currency/convert/batch")
+async def currency_convert_batch(amounts: List[float], from_curr: Currency, to_curr: Currency):
+    """Convert many amounts in one vectorized call against a single rate snapshot"""
+    if len(amounts) > MAX_BATCH_CONVERSIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_CONVERSIONS} amounts per request")
+    rates = exchange_rates.current
+    converted = rates.convert_many(np.asarray(amounts, dtype=np.float64), from_curr, to_curr)
+    return {
+        "original_currency": from_curr,
+        "target_currency": to_curr,
+        "rate": rates.rate(from_curr, to_curr),
+        "rate_version": rates.version,
+        "converted_amounts": converted.tolist()
     }
 
 # ============================================================================
@@ -855,94 +3109,464 @@ def calculate_similarity(product1: Dict, product2: Dict) -> float:
     
     return score
 
+SIMILAR_TOP_K = 20
+
+class SimilarityIndex:
+    """Precomputed top-K neighbours per product under calculate_similarity.
+    
+    Category, price and tag features live in NumPy arrays (tags as per-tag
+    posting arrays, i.e. a sparse incidence matrix), so a product is scored
+    against the whole catalog in a handful of vectorized operations.
+    """
+    
+    def __init__(self, k: int = SIMILAR_TOP_K):
+        self.k = k
+        self.product_ids: List[int] = []
+        self.rows: Dict[int, int] = {}
+        self.categories = np.zeros(0, dtype=np.int32)
+        self.prices = np.zeros(0)
+        self.tag_counts = np.zeros(0, dtype=np.int32)
+        self.kth_scores = np.zeros(0)  # Score of each row's k-th neighbour, -inf until its list is full
+        self.neighbours: Dict[int, List[tuple]] = {}  # Product ID -> [(score, product ID)], best first
+        self._referenced_by: Dict[int, set] = defaultdict(set)  # Product ID -> products listing it
+        self.category_codes: Dict[str, int] = {}
+        self._tag_codes: Dict[str, int] = {}
+        self.row_tags: List[frozenset] = []
+        self._tag_rows: Dict[int, set] = defaultdict(set)
+        self._tag_arrays: Dict[int, np.ndarray] = {}
+    
+    def _features(self, product: Dict) -> tuple:
+        category = self.category_codes.setdefault(product["category"], len(self.category_codes))
+        tags = frozenset(self._tag_codes.setdefault(tag, len(self._tag_codes)) for tag in product.get("tags", []))
+        return category, float(product["base_price"]), tags
+    
+    def _set_row(self, row: int, features: tuple):
+        category, price, tags = features
+        for tag in self.row_tags[row] ^ tags:
+            if tag in tags:
+                self._tag_rows[tag].add(row)
+            else:
+                self._tag_rows[tag].discard(row)
+            self._tag_arrays.pop(tag, None)
+        self.categories[row] = category
+        self.prices[row] = price
+        self.tag_counts[row] = len(tags)
+        self.row_tags[row] = tags
+    
+    def _append_row(self, product_id: int) -> int:
+        row = len(self.product_ids)
+        if row == len(self.prices):
+            capacity = max(16, 2 * row)
+            self.categories = np.resize(self.categories, capacity)
+            self.prices = np.resize(self.prices, capacity)
+            self.tag_counts = np.resize(self.tag_counts, capacity)
+            self.kth_scores = np.resize(self.kth_scores, capacity)
+        self.product_ids.append(product_id)
+        self.rows[product_id] = row
+        self.row_tags.append(frozenset())
+        self.tag_counts[row] = 0
+        self.kth_scores[row] = -np.inf
+        return row
+    
+    def tag_rows(self, tag: int) -> np.ndarray:
+        if tag not in self._tag_arrays:
+            self._tag_arrays[tag] = np.fromiter(self._tag_rows[tag], dtype=np.int64)
+        return self._tag_arrays[tag]
+    
+    def score_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Similarity of each given row against every row (self scored -inf)"""
+        n = len(self.product_ids)
+        prices = self.prices[:n]
+        
+        # Same category
+        scores = (self.categories[rows][:, None] == self.categories[:n][None, :]) * 0.4
+        
+        # Similar price range
+        row_prices = self.prices[rows][:, None]
+        max_price = np.maximum(row_prices, prices[None, :])
+        price_similarity = np.divide(
+            max_price - np.abs(row_prices - prices[None, :]), max_price,
+            out=np.zeros_like(max_price), where=max_price > 0
+        )
+        scores += price_similarity * 0.3
+        
+        # Common tags (Jaccard)
+        intersection = np.zeros((len(rows), n))
+        for i, row in enumerate(rows):
+            for tag in self.row_tags[row]:
+                intersection[i, self.tag_rows(tag)] += 1
+        union = self.tag_counts[rows][:, None] + self.tag_counts[:n][None, :] - intersection
+        scores += np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0) * 0.3
+        
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return scores
+    
+    def _top(self, scores: np.ndarray, k: int) -> List[tuple]:
+        k = min(k, len(scores) - 1)
+        if k <= 0:
+            return []
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(float(scores[row]), self.product_ids[row]) for row in candidates]
+    
+    def _store(self, row: int, top: List[tuple]):
+        product_id = self.product_ids[row]
+        for _, other_id in self.neighbours.get(product_id, []):
+            self._referenced_by[other_id].discard(product_id)
+        self.neighbours[product_id] = top
+        for _, other_id in top:
+            self._referenced_by[other_id].add(product_id)
+        self.kth_scores[row] = top[-1][0] if len(top) >= self.k else -np.inf
+    
+    def rebuild(self, products: Dict[int, Dict], block_size: int = 256):
+        self.__init__(self.k)
+        for product in products.values():
+            self._set_row(self._append_row(product["id"]), self._features(product))
+        
+        n = len(self.product_ids)
+        for start in range(0, n, block_size):
+            rows = np.arange(start, min(start + block_size, n))
+            for row, scores in zip(rows, self.score_rows(rows)):
+                self._store(row, self._top(scores, self.k))
+    
+    def update(self, product: Dict):
+        """Refresh a created product, or one whose category, price or tags changed"""
+        product_id = product["id"]
+        features = self._features(product)
+        row = self.rows.get(product_id)
+        if row is None:
+            row = self._append_row(product_id)
+        elif features == (self.categories[row], self.prices[row], self.row_tags[row]):
+            return
+        self._set_row(row, features)
+        
+        scores = self.score_rows(np.array([row]))[0]
+        self._store(row, self._top(scores, self.k))
+        
+        # Similarity is symmetric, so scores also holds this product's new
+        # score in every other product's list
+        stale = []
+        for other_id in list(self._referenced_by[product_id]):
+            other_row = self.rows[other_id]
+            entries = self.neighbours[other_id]
+            old_score = next(score for score, pid in entries if pid == product_id)
+            if scores[other_row] < old_score:
+                # Something outside the list may now outrank it
+                stale.append(other_row)
+            else:
+                entries = [(score, pid) for score, pid in entries if pid != product_id]
+                entries.append((float(scores[other_row]), product_id))
+                self._store(other_row, self._sorted(entries))
+        
+        n = len(self.product_ids)
+        for other_row in np.nonzero(scores > self.kth_scores[:n])[0]:
+            other_id = self.product_ids[other_row]
+            if product_id in (pid for _, pid in self.neighbours[other_id]):
+                continue
+            entries = self.neighbours[other_id] + [(float(scores[other_row]), product_id)]
+            self._store(other_row, self._sorted(entries)[:self.k])
+        
+        if stale:
+            rows = np.array(stale)
+            for other_row, other_scores in zip(rows, self.score_rows(rows)):
+                self._store(other_row, self._top(other_scores, self.k))
+    
+    def _sorted(self, entries: List[tuple]) -> List[tuple]:
+        return sorted(entries, key=lambda entry: (-entry[0], self.rows[entry[1]]))
+    
+    def similar(self, product_id: int, limit: int) -> List[int]:
+        if limit <= self.k:
+            return [pid for _, pid in self.neighbours.get(product_id, [])[:limit]]
+        # Deeper than the precomputed list: score this one product on demand
+        row = self.rows[product_id]
+        return [pid for _, pid in self._top(self.score_rows(np.array([row]))[0], limit)]
+
+similarity_index = SimilarityIndex()
+similarity_index.rebuild(products_db)
+
 @app.get("/api/recommendations/similar/{product_id}")
 async def get_similar_products(product_id: int, limit: int = 5):
     """Find products similar to the given product"""
     if product_id not in products_db:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    target_product = products_db[product_id]
-    similarities = []
+    return [products_db[pid] for pid in similarity_index.similar(product_id, limit)]
+
+class TopN:
+    """Top-n keys by a score that only ever increases, backed by a bounded min-heap"""
+    
+    def __init__(self, n: int):
+        self.n = n
+        self.scores: Dict[Any, float] = {}
+        self._heap: List[tuple] = []  # (score, key); entries go stale when a key's score moves
+    
+    def _push(self, key, score: float):
+        self.scores[key] = score
+        heapq.heappush(self._heap, (score, key))
+        if len(self._heap) > 4 * self.n:
+            self._heap = [(score, key) for key, score in self.scores.items()]
+            heapq.heapify(self._heap)
+    
+    def _min(self) -> tuple:
+        while self.scores.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0]
+    
+    def offer(self, key, score: float):
+        """Record key's new (higher) score, evicting the smallest entry if it no longer fits"""
+        if key in self.scores or len(self.scores) < self.n:
+            self._push(key, score)
+            return
+        min_score, min_key = self._min()
+        if score > min_score:
+            heapq.heappop(self._heap)
+            del self.scores[min_key]
+            self._push(key, score)
     
-    for pid, product in products_db.items():
-        if pid != product_id:
-            score = calculate_similarity(target_product, product)
-            similarities.append({"product": product, "score": score})
+    def scale(self, factor: float):
+        self.scores = {key: score * factor for key, score in self.scores.items()}
+        self._heap = [(score, key) for key, score in self.scores.items()]
+        heapq.heapify(self._heap)
     
-    similarities.sort(key=lambda x: x["score"], reverse=True)
-    return [s["product"] for s in similarities[:limit]]
+    def top(self, limit: int) -> List[Any]:
+        return [key for key, _ in sorted(self.scores.items(), key=lambda kv: -kv[1])[:limit]]
 
-@app.get("/api/recommendations/frequently-bought-together/{product_id}")
-async def frequently_bought_together(product_id: int, limit: int = 4):
-    """Find products frequently bought with this product"""
-    # Analyze order history
-    product_pairs = defaultdict(int)
+COPURCHASE_TOP_N = 20
+COPURCHASE_HALF_LIFE_DAYS = 90
+
+class CoPurchaseIndex:
+    """Sparse product co-occurrence counts over orders, with time decay.
+    
+    Uses forward decay: an order contributes 2 ** (age since epoch / half-life),
+    so newer orders weigh more without ever touching existing counts. Weights
+    are rescaled before they can overflow.
+    """
+    
+    def __init__(self, top_n: int = COPURCHASE_TOP_N, half_life_days: float = COPURCHASE_HALF_LIFE_DAYS):
+        self.top_n = top_n
+        self.half_life = half_life_days * 86400
+        self.counts: Dict[int, Dict[int, float]] = defaultdict(lambda: defaultdict(float))
+        self.tops: Dict[int, TopN] = {}
+        self._epoch = datetime.now().timestamp()
+    
+    def _weight(self, when: datetime) -> float:
+        exponent = (when.timestamp() - self._epoch) / self.half_life
+        if exponent > 512:
+            self._rescale(exponent)
+            exponent = 0.0
+        return 2.0 ** exponent
+    
+    def _rescale(self, exponent: float):
+        factor = 2.0 ** -exponent
+        for counts in self.counts.values():
+            for other_id in counts:
+                counts[other_id] *= factor
+        for top in self.tops.values():
+            top.scale(factor)
+        self._epoch += exponent * self.half_life
     
-    for order in orders_db.values():
+    def add_order(self, order: Dict):
+        weight = self._weight(order["created_at"])
         item_ids = [item["product_id"] for item in order["items"]]
-        if product_id in item_ids:
+        for product_id in set(item_ids):
+            counts = self.counts[product_id]
+            top = self.tops.get(product_id)
+            if top is None:
+                top = self.tops[product_id] = TopN(self.top_n)
             for other_id in item_ids:
                 if other_id != product_id:
-                    product_pairs[other_id] += 1
+                    counts[other_id] += weight
+                    top.offer(other_id, counts[other_id])
     
-    # Sort by frequency
-    sorted_pairs = sorted(product_pairs.items(), key=lambda x: x[1], reverse=True)
-    recommended_ids = [pid for pid, _ in sorted_pairs[:limit]]
+    def rebuild(self, orders: Dict[int, Dict]):
+        self.counts.clear()
+        self.tops.clear()
+        self._epoch = datetime.now().timestamp()
+        for order in sorted(orders.values(), key=lambda o: o["created_at"]):
+            self.add_order(order)
     
+    def bought_with(self, product_id: int, limit: int) -> List[int]:
+        if limit <= self.top_n:
+            top = self.tops.get(product_id)
+            return top.top(limit) if top else []
+        counts = self.counts.get(product_id, {})
+        return heapq.nlargest(limit, counts, key=counts.get)
+
+co_purchase_index = CoPurchaseIndex()
+co_purchase_index.rebuild(orders_db)
+
+@app.get("/api/recommendations/frequently-bought-together/{product_id}")
+async def frequently_bought_together(product_id: int, limit: int = 4):
+    """Find products frequently bought with this product"""
+    recommended_ids = co_purchase_index.bought_with(product_id, limit)
     return [products_db[pid] for pid in recommended_ids if pid in products_db]
 
-@app.get("/api/recommendations/personalized")
-async def get_personalized_recommendations(
-    current_user: dict = Depends(get_current_user),
-    limit: int = 10
-):
-    """Generate personalized recommendations based on user activity"""
-    user_id = current_user["id"]
+PRICE_BUCKET_RATIO = 1.1  # Adjacent price buckets differ by 10%
+PRICE_BUCKETS = 256
+RECENT_VIEWS = 10
+MAX_CACHED_PROFILES = 50000  # Least recently used profiles are dropped and rebuilt on demand
+
+class UserProfile:
+    """A user's views and purchases collapsed into category, price-bucket and tag weights"""
     
-    # Get user's browsing history
-    viewed_products = [
-        activity["product_id"] 
-        for activity in user_activity_db[user_id] 
-        if activity["type"] == "view"
-    ]
+    def __init__(self):
+        self.categories: Dict[int, float] = defaultdict(float)
+        self.price_buckets = np.zeros(PRICE_BUCKETS + 1)  # Last slot: unpriced products
+        self.tags: Dict[int, float] = defaultdict(float)
+        self.recent_views: deque = deque()  # Features of the last RECENT_VIEWS views
+        self.excluded: set = set()  # Viewed or purchased product ids
+        self._excluded_rows: Optional[np.ndarray] = None
     
-    # Get user's purchase history
-    purchased_products = []
-    for order in orders_db.values():
-        if order["user_id"] == user_id:
-            purchased_products.extend([item["product_id"] for item in order["items"]])
+    def add(self, features: tuple, weight: float):
+        category, bucket, tags = features
+        self.categories[category] += 0.4 * weight
+        self.price_buckets[bucket] += 0.3 * weight
+        for tag in tags:
+            self.tags[tag] += 0.3 * weight / math.sqrt(len(tags))
     
-    # Calculate scores for all products
-    recommendations = {}
+    def remove(self, features: tuple, weight: float):
+        self.add(features, -weight)
+        for key in [key for key, value in self.tags.items() if abs(value) < 1e-9]:
+            del self.tags[key]
     
-    for pid, product in products_db.items():
-        if pid in purchased_products or pid in viewed_products:
-            continue
+    def exclude(self, product_id: int):
+        if product_id not in self.excluded:
+            self.excluded.add(product_id)
+            self._excluded_rows = None
+    
+    def excluded_rows(self, rows: Dict[int, int]) -> np.ndarray:
+        if self._excluded_rows is None:
+            self._excluded_rows = np.fromiter((rows[pid] for pid in self.excluded if pid in rows), dtype=np.int64)
+        return self._excluded_rows
+
+class PersonalizedScorer:
+    """Scores the whole catalog against a user profile in one vectorized pass.
+    
+    Shares its row layout with similarity_index. Category matches are exact;
+    price similarity is evaluated between price buckets and tag overlap uses
+    cosine similarity, so both stay linear in the profile weights.
+    """
+    
+    def __init__(self, index: SimilarityIndex):
+        self.index = index
+        self.boosts = np.zeros(0)  # Popularity + rating boost per row
+        self.profiles: "OrderedDict[int, UserProfile]" = OrderedDict()  # LRU, most recent last
+        distance = np.abs(np.subtract.outer(np.arange(PRICE_BUCKETS), np.arange(PRICE_BUCKETS)))
+        self.price_kernel = np.zeros((PRICE_BUCKETS + 1, PRICE_BUCKETS + 1))
+        self.price_kernel[:PRICE_BUCKETS, :PRICE_BUCKETS] = PRICE_BUCKET_RATIO ** -distance
+    
+    @staticmethod
+    def price_buckets(prices: np.ndarray) -> np.ndarray:
+        buckets = np.floor(np.log(np.maximum(prices, 1.0)) / math.log(PRICE_BUCKET_RATIO)).astype(np.int64)
+        return np.where(prices > 0, np.minimum(buckets, PRICE_BUCKETS - 1), PRICE_BUCKETS)
+    
+    def features(self, product_id: int) -> Optional[tuple]:
+        row = self.index.rows.get(product_id)
+        if row is None:
+            return None
+        bucket = int(self.price_buckets(self.index.prices[row:row + 1])[0])
+        return int(self.index.categories[row]), bucket, tuple(self.index.row_tags[row])
+    
+    def update_boost(self, product: Dict):
+        row = self.index.rows[product["id"]]
+        if row >= len(self.boosts):
+            self.boosts = np.resize(self.boosts, len(self.index.prices))
+        # Boost popular and highly rated products
+        self.boosts[row] = math.log(product.get("purchase_count", 0) + 1) * 0.5 + product.get("rating", 0) * 0.3
+    
+    def rebuild(self, products: Dict[int, Dict]):
+        self.boosts = np.zeros(len(self.index.prices))
+        self.profiles.clear()
+        for product in products.values():
+            self.update_boost(product)
+    
+    # Profiles
+    
+    def profile(self, user_id: int) -> UserProfile:
+        """The user's profile, built from their history the first time it is needed"""
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            self.profiles.move_to_end(user_id)
+            return profile
+        
+        profile = self.profiles[user_id] = UserProfile()
+        if len(self.profiles) > MAX_CACHED_PROFILES:
+            self.profiles.popitem(last=False)
+        for activity in user_activity_db.get(user_id, []):
+            if activity["type"] == "view":
+                self._apply_view(profile, activity["product_id"])
+        for order_id in orders_by_user.ids(user_id):
+            self._apply_purchase(profile, orders_db[order_id])
+        return profile
+    
+    def _apply_view(self, profile: UserProfile, product_id: int):
+        profile.exclude(product_id)
+        features = self.features(product_id)
+        profile.recent_views.append(features)
+        if features is not None:
+            profile.add(features, 2)
+        if len(profile.recent_views) > RECENT_VIEWS:
+            expired = profile.recent_views.popleft()
+            if expired is not None:
+                profile.remove(expired, 2)
+    
+    def _apply_purchase(self, profile: UserProfile, order: Dict):
+        for item in order["items"]:
+            profile.exclude(item["product_id"])
+            features = self.features(item["product_id"])
+            if features is not None:
+                profile.add(features, 3)
+    
+    def record_view(self, user_id: int, product_id: int):
+        # Users without a profile yet get it built from history, view included
+        if user_id in self.profiles:
+            self._apply_view(self.profiles[user_id], product_id)
+    
+    def record_purchase(self, user_id: int, order: Dict):
+        if user_id in self.profiles:
+            self._apply_purchase(self.profiles[user_id], order)
+    
+    # Scoring
+    
+    def recommend(self, user_id: int, limit: int) -> List[int]:
+        profile = self.profile(user_id)
+        index = self.index
+        n = len(index.product_ids)
+        if n == 0:
+            return []
         
-        score = 0.0
+        scores = self.boosts[:n].copy()
         
-        # Score based on viewed products
-        for viewed_id in viewed_products[-10:]:  # Last 10 views
-            if viewed_id in products_db:
-                score += calculate_similarity(products_db[viewed_id], product) * 2
+        category_weights = np.zeros(len(index.category_codes))
+        for category, weight in profile.categories.items():
+            category_weights[category] = weight
+        scores += category_weights[index.categories[:n]]
         
-        # Score based on purchased products
-        for purchased_id in purchased_products:
-            if purchased_id in products_db:
-                score += calculate_similarity(products_db[purchased_id], product) * 3
+        scores += (self.price_kernel @ profile.price_buckets)[self.price_buckets(index.prices[:n])]
         
-        # Boost popular products
-        score += math.log(product.get("purchase_count", 0) + 1) * 0.5
+        for tag, weight in profile.tags.items():
+            rows = index.tag_rows(tag)
+            scores[rows] += weight / np.sqrt(index.tag_counts[rows])
         
-        # Boost highly rated products
-        score += product.get("rating", 0) * 0.3
+        scores[profile.excluded_rows(index.rows)] = -np.inf
         
-        recommendations[pid] = score
-    
-    # Sort and return top recommendations
-    sorted_recs = sorted(recommendations.items(), key=lambda x: x[1], reverse=True)
-    recommended_ids = [pid for pid, _ in sorted_recs[:limit]]
-    
+        k = min(limit, int(np.count_nonzero(scores > -np.inf)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [index.product_ids[row] for row in top]
+
+personalized_scorer = PersonalizedScorer(similarity_index)
+personalized_scorer.rebuild(products_db)
+
+@app.get("/api/recommendations/personalized")
+async def get_personalized_recommendations(
+    current_user: dict = Depends(get_current_user),
+    limit: int = 10
+):
+    """Generate personalized recommendations based on user activity"""
+    recommended_ids = personalized_scorer.recommend(current_user["id"], limit)
     return [products_db[pid] for pid in recommended_ids]
 
 @app.post("/api/activity/track")
@@ -952,64 +3576,388 @@ async def track_activity(
     current_user: dict = Depends(get_current_user)
 ):
     """Track user activity for recommendation engine"""
-    user_activity_db[current_user["id"]].append({
+    activity = {
         "type": activity_type,
         "product_id": product_id,
         "timestamp": datetime.now()
-    })
+    }
+    user_activity_db[current_user["id"]].append(activity)
+    storage.append("user_activity", current_user["id"], activity)
+    if activity_type == "view":
+        personalized_scorer.record_view(current_user["id"], product_id)
     return {"message": "Activity tracked"}
 
 # ============================================================================
 # 11. DYNAMIC PRICING ENGINE
 # ============================================================================
 
-def calculate_dynamic_price(product_id: int) -> float:
-    """Calculate optimal price based on demand, competition, and inventory"""
+PRICE_CHANGE_REASONS = ["manual", "dynamic_pricing"]
+PRICE_HISTORY_BUCKETS = {"minute": 60, "hour": 3600, "day": 86400}
+PRICE_HISTORY_MAX_POINTS = 5000
+PRICE_HISTORY_RETENTION_DAYS = 730
+PRICE_HISTORY_COMPACT_AFTER_DAYS = 30  # Older changes are kept at hourly resolution
+PRICE_HISTORY_COMPACT_SECONDS = 3600
+PRICE_HISTORY_COMPACT_BATCH = 500  # Histories compacted between yields to the event loop
+
+class PriceHistory:
+    """Price changes of one product, held column-wise in typed arrays.
+    
+    Entries are (unix timestamp, old price, new price, reason code) and arrive
+    in time order, so range lookups bisect the timestamp column.
+    """
+    
+    def __init__(self, entries=()):
+        self.timestamps = array("d")
+        self.old_prices = array("d")
+        self.new_prices = array("d")
+        self.reasons = array("b")  # Index into PRICE_CHANGE_REASONS
+        for entry in entries:
+            self.append(entry)
+    
+    def __len__(self) -> int:
+        return len(self.timestamps)
+    
+    def __iter__(self) -> Iterator[tuple]:
+        return zip(self.timestamps, self.old_prices, self.new_prices, self.reasons)
+    
+    def append(self, entry):
+        if isinstance(entry, dict):
+            # Change records written before histories were columnar
+            entry = (
+                entry["timestamp"].timestamp(), entry["old_price"], entry["new_price"],
+                PRICE_CHANGE_REASONS.index(entry.get("reason", "manual"))
+            )
+        timestamp, old_price, new_price, reason = entry
+        self.timestamps.append(timestamp)
+        self.old_prices.append(old_price)
+        self.new_prices.append(new_price)
+        self.reasons.append(reason)
+    
+    def span(self, start: Optional[float], end: Optional[float]) -> tuple:
+        """Positions [low, high) of the changes within [start, end)"""
+        low = bisect.bisect_left(self.timestamps, start) if start is not None else 0
+        high = bisect.bisect_left(self.timestamps, end) if end is not None else len(self)
+        return low, high
+    
+    def column(self, name: str, low: int, high: int) -> np.ndarray:
+        # Slicing copies, so no buffer stays exported and appends keep working
+        return np.array(getattr(self, name)[low:high], dtype=float)
+    
+    def compact(self, retain_after: float, compact_before: float) -> bool:
+        """Drop changes before retain_after and fold those before compact_before
+        into one per hour (first old price, last new price); True if anything changed"""
+        low, cut = self.span(retain_after, compact_before)
+        if cut > low:
+            hours = (self.column("timestamps", low, cut) // 3600).astype(np.int64)
+            starts = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]]) + low
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+        if low == 0 and len(starts) == cut:
+            return False
+        
+        ends = np.r_[starts[1:], cut] - 1
+        entries = [
+            (self.timestamps[end], self.old_prices[start], self.new_prices[end], self.reasons[end])
+            for start, end in zip(starts.tolist(), ends.tolist())
+        ]
+        entries.extend(itertools.islice(iter(self), cut, None))
+        compacted = PriceHistory(entries)
+        self.timestamps, self.old_prices = compacted.timestamps, compacted.old_prices
+        self.new_prices, self.reasons = compacted.new_prices, compacted.reasons
+        return True
+
+def price_history(product_id: int) -> PriceHistory:
+    history = price_history_db.get(product_id)
+    if history is None:
+        history = price_history_db[product_id] = PriceHistory()
+    return history
+
+# Storage hands histories back as plain entry lists
+for product_id, entries in list(price_history_db.items()):
+    if not isinstance(entries, PriceHistory):
+        price_history_db[product_id] = PriceHistory(entries)
+
+def record_price_change(product_id: int, old_price: float, new_price: float, reason: str = "manual"):
+    entry = (datetime.now().timestamp(), old_price, new_price, PRICE_CHANGE_REASONS.index(reason))
+    price_history(product_id).append(entry)
+    storage.append("price_history", product_id, entry)
+
+async def compact_price_histories(now: Optional[datetime] = None) -> int:
+    """Apply retention and hourly compaction to every history; returns how many shrank.
+    
+    Runs on the event loop, since appends must not land mid-compaction, but
+    yields after every PRICE_HISTORY_COMPACT_BATCH histories.
+    """
+    now = (now or datetime.now()).timestamp()
+    retain_after = now - PRICE_HISTORY_RETENTION_DAYS * 86400
+    compact_before = now - PRICE_HISTORY_COMPACT_AFTER_DAYS * 86400
+    compacted = 0
+    for position, product_id in enumerate(list(price_history_db)):
+        if position and position % PRICE_HISTORY_COMPACT_BATCH == 0:
+            await asyncio.sleep(0)
+        history = price_history_db.get(product_id)
+        if history is not None and history.compact(retain_after, compact_before):
+            storage.put("price_history", product_id)
+            compacted += 1
+    return compacted
+
+async def compact_price_histories_periodically():
+    while True:
+        await asyncio.sleep(PRICE_HISTORY_COMPACT_SECONDS)
+        try:
+            await compact_price_histories()
+        except Exception:
+            logger.exception("Price history compaction failed")
+
+@app.get("/api/pricing/history/{product_id}")
+async def get_price_history(
+    product_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Optional[str] = None
+):
+    """Price changes in [start, end); with bucket=minute|hour|day, min/max/last price set per bucket"""
     if product_id not in products_db:
-        return 0.0
+        raise HTTPException(status_code=404, detail="Product not found")
+    if bucket is not None and bucket not in PRICE_HISTORY_BUCKETS:
+        raise HTTPException(status_code=400, detail="Bucket must be 'minute', 'hour' or 'day'")
     
-    product = products_db[product_id]
-    base_price = product["base_price"]
+    history = price_history_db.get(product_id) or PriceHistory()
+    low, high = history.span(start.timestamp() if start else None, end.timestamp() if end else None)
+    
+    if bucket is None:
+        if high - low > PRICE_HISTORY_MAX_POINTS:
+            raise HTTPException(status_code=400, detail=f"More than {PRICE_HISTORY_MAX_POINTS} changes in range; pass a bucket")
+        return {
+            "product_id": product_id,
+            "changes": [
+                {
+                    "timestamp": datetime.fromtimestamp(history.timestamps[i]),
+                    "old_price": history.old_prices[i],
+                    "new_price": history.new_prices[i],
+                    "reason": PRICE_CHANGE_REASONS[history.reasons[i]]
+                }
+                for i in range(low, high)
+            ]
+        }
+    
+    seconds = PRICE_HISTORY_BUCKETS[bucket]
+    buckets = (history.column("timestamps", low, high) // seconds).astype(np.int64)
+    prices = history.column("new_prices", low, high)
+    if len(buckets) == 0:
+        return {"product_id": product_id, "bucket": bucket, "points": []}
+    
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    if len(starts) > PRICE_HISTORY_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"More than {PRICE_HISTORY_MAX_POINTS} buckets in range; use a wider bucket")
+    ends = np.r_[starts[1:], len(prices)]
+    return {
+        "product_id": product_id,
+        "bucket": bucket,
+        "points": [
+            {
+                "timestamp": datetime.fromtimestamp(bucket_number * seconds),
+                "min": low_price,
+                "max": high_price,
+                "last": last_price,
+                "changes": count
+            }
+            for bucket_number, low_price, high_price, last_price, count in zip(
+                buckets[starts].tolist(),
+                np.minimum.reduceat(prices, starts).tolist(),
+                np.maximum.reduceat(prices, starts).tolist(),
+                prices[ends - 1].tolist(),
+                (ends - starts).tolist()
+            )
+        ]
+    }
+
+
+REPRICE_INTERVAL_SECONDS = int(os.environ.get("INDABACART_REPRICE_SECONDS", "0"))  # 0 disables scheduled runs
+REPRICE_REBUILD_FRACTION = 0.05  # Rebuild price-derived indexes instead of patching past this share of the catalog
+
+def product_stock(product: Dict) -> int:
+    """Units available across variants, live from inventory where tracked"""
+    return sum(inventory_db.get(v.get("sku"), v["stock"]) for v in product.get("variants", [{"stock": 0}]))
+
+def dynamic_prices(
+    base_prices: np.ndarray,
+    view_counts: np.ndarray,
+    purchase_counts: np.ndarray,
+    stock: np.ndarray,
+    competitor_prices: np.ndarray,
+    hour: int
+) -> np.ndarray:
+    """Demand, inventory, time and competition factors applied to arrays of products.
     
+    competitor_prices holds the average base price of the other products in
+    each product's category, NaN where it has no competitors.
+    """
     # Factor 1: Demand (based on views and purchases)
-    view_count = product.get("view_count", 0)
-    purchase_count = product.get("purchase_count", 0)
-    demand_ratio = purchase_count / (view_count + 1)  # Conversion rate
+    demand_ratio = purchase_counts / (view_counts + 1)  # Conversion rate
     
     # Factor 2: Inventory levels
-    total_stock = sum(v["stock"] for v in product.get("variants", [{"stock": 0}]))
-    inventory_factor = 1.0
-    if total_stock < 5:
-        inventory_factor = 1.1  # Increase price for low stock
-    elif total_stock > 50:
-        inventory_factor = 0.95  # Decrease price for overstock
+    inventory_factor = np.where(stock < 5, 1.1, np.where(stock > 50, 0.95, 1.0))
     
     # Factor 3: Time-based (seasonal, day of week)
-    hour = datetime.now().hour
-    time_factor = 1.0
-    if 9 <= hour <= 17:  # Peak shopping hours
-        time_factor = 1.05
-    
-    # Factor 4: Competition (check similar products)
-    similar_products = [
-        p for p in products_db.values() 
-        if p["category"] == product["category"] and p["id"] != product_id
-    ]
-    if similar_products:
-        avg_competitor_price = sum(p["base_price"] for p in similar_products) / len(similar_products)
-        if base_price > avg_competitor_price * 1.2:
-            inventory_factor *= 0.95  # Lower price if too high vs competition
+    time_factor = 1.05 if 9 <= hour <= 17 else 1.0  # Peak shopping hours
+    
+    # Factor 4: Competition: lower price if too high vs competition
+    with np.errstate(invalid="ignore"):
+        overpriced = base_prices > competitor_prices * 1.2
+    inventory_factor = np.where(overpriced, inventory_factor * 0.95, inventory_factor)
     
     # Calculate final price
-    dynamic_price = base_price * inventory_factor * time_factor
+    prices = base_prices * inventory_factor * time_factor
     
     # Apply demand adjustment
-    if demand_ratio > 0.1:  # High conversion rate
-        dynamic_price *= 1.05
-    elif demand_ratio < 0.01:  # Low conversion rate
-        dynamic_price *= 0.98
+    prices = np.where(demand_ratio > 0.1, prices * 1.05, np.where(demand_ratio < 0.01, prices * 0.98, prices))
+    return np.round(prices, 2)
+
+def calculate_dynamic_price(product_id: int) -> float:
+    """Calculate optimal price based on demand, competition, and inventory"""
+    if product_id not in products_db:
+        return 0.0
+    
+    product = products_db[product_id]
+    similar_prices = [
+        p["base_price"] for p in products_db.values()
+        if p["category"] == product["category"] and p["id"] != product_id
+    ]
+    competitor_price = sum(similar_prices) / len(similar_prices) if similar_prices else math.nan
+    
+    price = dynamic_prices(
+        np.array([product["base_price"]], dtype=float),
+        np.array([product.get("view_count", 0)], dtype=float),
+        np.array([product.get("purchase_count", 0)], dtype=float),
+        np.array([product_stock(product)]),
+        np.array([competitor_price]),
+        datetime.now().hour
+    )
+    return float(price[0])
+
+def plan_reprice(category: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """New dynamic prices for the catalog (or one category) in a single vectorized pass"""
+    products = list(products_db.values())
+    n = len(products)
+    category_codes: Dict[str, int] = {}
+    codes = np.fromiter((category_codes.setdefault(p["category"], len(category_codes)) for p in products), dtype=np.int64, count=n)
+    base_prices = np.fromiter((p["base_price"] for p in products), dtype=float, count=n)
+    
+    # Per-category aggregates, then each product's competitors are its category minus itself
+    category_sums = np.bincount(codes, weights=base_prices, minlength=len(category_codes))
+    category_counts = np.bincount(codes, minlength=len(category_codes))
+    competitors = category_counts[codes] - 1
+    competitor_prices = np.full(n, math.nan)
+    np.divide(category_sums[codes] - base_prices, competitors, out=competitor_prices, where=competitors > 0)
+    
+    new_prices = dynamic_prices(
+        base_prices,
+        np.fromiter((p.get("view_count", 0) for p in products), dtype=float, count=n),
+        np.fromiter((p.get("purchase_count", 0) for p in products), dtype=float, count=n),
+        np.fromiter((product_stock(p) for p in products), dtype=np.int64, count=n),
+        competitor_prices,
+        datetime.now().hour
+    )
+    
+    selected = new_prices != base_prices
+    if category is not None:
+        selected &= codes == category_codes.get(category, -1)
+    return {
+        "product_ids": np.fromiter((p["id"] for p in products), dtype=np.int64, count=n)[selected],
+        "old_prices": base_prices[selected],
+        "new_prices": new_prices[selected],
+        "catalog_size": n
+    }
+
+similarity_refresh: Optional[asyncio.Task] = None  # Detached similarity rebuild, if one was started
+
+async def refresh_similarity_index():
+    """Rebuild the similarity index off the loop and swap it in, with the scorer laid out on it"""
+    global similarity_index
+    try:
+        index = None
+        while index is None:
+            # Patching in a large reprice that landed meanwhile costs more than building again
+            max_replay = int(REPRICE_REBUILD_FRACTION * len(products_db))
+            index = await rebuild_product_index(SimilarityIndex(), SimilarityIndex.update, max_replay)
+        similarity_index = index
+        # Boosts and cached profiles are laid out by similarity index row
+        personalized_scorer.index = index
+        personalized_scorer.rebuild(products_db)
+    except Exception:
+        logger.exception("Similarity index refresh failed")
+
+def schedule_similarity_refresh():
+    global similarity_refresh
+    # A refresh already running picks up prices that moved since it started
+    if similarity_refresh is not None and not similarity_refresh.done():
+        return
+    if similarity_refresh in background_tasks:
+        background_tasks.remove(similarity_refresh)
+    similarity_refresh = asyncio.create_task(refresh_similarity_index())
+    background_tasks.append(similarity_refresh)
+
+async def reindex_prices(product_ids: List[int]):
+    """Refresh the price-derived indexes after base prices moved"""
+    global price_index
+    note_product_changes(product_ids)
+    if len(product_ids) > REPRICE_REBUILD_FRACTION * len(products_db):
+        price_index = await rebuild_product_index(PriceIndex(), PriceIndex.update)
+        # The all-pairs similarity rebuild is quadratic, so it runs detached;
+        # similar-product lists catch up with the new prices when it lands
+        schedule_similarity_refresh()
+        return
+    for product_id in product_ids:
+        price_index.update(products_db[product_id])
+        similarity_index.update(products_db[product_id])
+
+async def apply_reprice(plan: Dict[str, np.ndarray]):
+    """Write a reprice plan: prices, one batched price-history append, index refresh"""
+    product_ids = plan["product_ids"].tolist()
+    now = datetime.now().timestamp()
+    reason = PRICE_CHANGE_REASONS.index("dynamic_pricing")
+    history = []
+    for product_id, old_price, new_price in zip(product_ids, plan["old_prices"].tolist(), plan["new_prices"].tolist()):
+        entry = (now, old_price, new_price, reason)
+        price_history(product_id).append(entry)
+        history.append((product_id, entry))
+        products_db[product_id]["base_price"] = new_price
     
-    return round(dynamic_price, 2)
+    storage.append_many("price_history", history)
+    storage.put_many("products", product_ids, "base_price")
+    await reindex_prices(product_ids)
+
+def reprice_summary(plan: Dict[str, np.ndarray], limit: int) -> Dict:
+    old_prices, new_prices = plan["old_prices"], plan["new_prices"]
+    change_pct = np.divide(new_prices - old_prices, old_prices, out=np.zeros_like(new_prices), where=old_prices != 0) * 100
+    largest = np.argsort(-np.abs(change_pct), kind="stable")[:limit]
+    return {
+        "catalog_size": plan["catalog_size"],
+        "changed": len(new_prices),
+        "increased": int((new_prices > old_prices).sum()),
+        "decreased": int((new_prices < old_prices).sum()),
+        "average_change_pct": round(float(change_pct.mean()), 2) if len(change_pct) else 0.0,
+        "changes": [
+            {
+                "product_id": int(plan["product_ids"][i]),
+                "old_price": float(old_prices[i]),
+                "new_price": float(new_prices[i]),
+                "change_pct": round(float(change_pct[i]), 2)
+            }
+            for i in largest
+        ]
+    }
+
+async def reprice_catalog_periodically():
+    if REPRICE_INTERVAL_SECONDS <= 0:
+        return
+    while True:
+        await asyncio.sleep(REPRICE_INTERVAL_SECONDS)
+        try:
+            await apply_reprice(plan_reprice())
+        except Exception:
+            logger.exception("Scheduled reprice failed")
 
 @app.get("/api/pricing/dynamic/{product_id}")
 async def get_dynamic_price(product_id: int):
@@ -1028,11 +3976,24 @@ async def get_dynamic_price(product_id: int):
         "adjustment": round((dynamic_price - base_price) / base_price * 100, 2),
         "factors": {
             "demand": product.get("purchase_count", 0) / (product.get("view_count", 0) + 1),
-            "stock_level": sum(v["stock"] for v in product.get("variants", [{"stock": 0}])),
+            "stock_level": product_stock(product),
             "rating": product.get("rating", 0)
         }
     }
 
+@app.post("/api/pricing/reprice")
+async def reprice_catalog(
+    dry_run: bool = True,
+    category: Optional[str] = None,
+    limit: int = Query(100, ge=0, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(require_role([UserRole.ADMIN]))
+):
+    """Reprice the whole catalog (or one category) in one batch; dry runs only report the diff"""
+    plan = plan_reprice(category)
+    if not dry_run:
+        await apply_reprice(plan)
+    return {"dry_run": dry_run, **reprice_summary(plan, limit)}
+
 @app.post("/api/pricing/apply-dynamic/{product_id}")
 async def apply_dynamic_pricing(
     product_id: int,
@@ -1042,48 +4003,235 @@ async def apply_dynamic_pricing(
     dynamic_price = calculate_dynamic_price(product_id)
     
     # Track price history
-    price_history_db[product_id].append({
-        "old_price": products_db[product_id]["base_price"],
-        "new_price": dynamic_price,
-        "timestamp": datetime.now(),
-        "reason": "dynamic_pricing"
-    })
+    record_price_change(product_id, products_db[product_id]["base_price"], dynamic_price, "dynamic_pricing")
     
     products_db[product_id]["base_price"] = dynamic_price
+    storage.put("products", product_id, "base_price")
+    index_product(products_db[product_id])
     return {"message": "Dynamic pricing applied", "new_price": dynamic_price}
 
 # ============================================================================
 # 12. SEARCH & ELASTICSEARCH-LIKE FUNCTIONALITY
 # ============================================================================
 
-def fuzzy_match(search_term: str, text: str, max_distance: int = 2) -> bool:
-    """Simple fuzzy matching for typo tolerance"""
-    search_term = search_term.lower()
-    text = text.lower()
+def levenshtein(a: str, b: str, max_distance: Optional[int] = None) -> int:
+    """Edit distance between a and b; stops early once max_distance is exceeded"""
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
     
-    # Exact match
-    if search_term in text:
-        return True
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,               # Deletion
+                current[j - 1] + 1,            # Insertion
+                previous[j - 1] + (ca != cb)   # Substitution
+            ))
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+def typo_tolerance(term: str) -> int:
+    """Allowed edit distance for a query term, scaled by its length"""
+    if len(term) < 3:
+        return 0
+    if len(term) <= 5:
+        return 1
+    return 2
+
+class BKTree:
+    """Burkhard-Keller tree over a vocabulary for edit-distance lookups"""
     
-    # Check for character-by-character similarity
-    if len(search_term) < 3:
-        return False
+    def __init__(self):
+        self.root = None  # [word, {distance: child}]
+        self.size = 0
     
-    # Simple Levenshtein-like check
-    words = text.split()
-    for word in words:
-        if len(word) < 3:
-            continue
+    def add(self, word: str):
+        if self.root is None:
+            self.root = [word, {}]
+            self.size = 1
+            return
         
-        differences = 0
-        for i in range(min(len(search_term), len(word))):
-            if search_term[i] != word[i]:
-                differences += 1
+        node = self.root
+        while True:
+            distance = levenshtein(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [word, {}]
+                self.size += 1
+                return
+            node = child
+    
+    def search(self, word: str, max_distance: int) -> List[str]:
+        """All words within max_distance of word"""
+        if self.root is None:
+            return []
         
-        if differences <= max_distance:
-            return True
+        results = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = levenshtein(word, node[0])
+            if distance <= max_distance:
+                results.append(node[0])
+            # Triangle inequality: only subtrees in [d - k, d + k] can match
+            for edge, child in node[1].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+CATALOG_GRAM_SIZE = 3  # Longest n-gram indexed per term
+
+class CatalogIndex:
+    """Inverted index (term -> posting set of product ids) over title, description and tags.
+    
+    The vocabulary itself is indexed by its 1- to CATALOG_GRAM_SIZE-grams, so
+    terms containing a query fragment are found from the fragment's rarest
+    n-gram rather than by scanning every term.
+    """
+    
+    def __init__(self):
+        self.postings: Dict[str, set] = defaultdict(set)
+        self.grams: Dict[str, set] = defaultdict(set)  # n-gram -> terms containing it
+        self.fuzzy_tree = BKTree()  # Terms ever indexed; dead terms are filtered on lookup
+        self._product_terms: Dict[int, set] = {}
+    
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return re.findall(r"\w+", text.casefold())
     
-    return False
+    @staticmethod
+    def ngrams(text: str, sizes=range(1, CATALOG_GRAM_SIZE + 1)) -> set:
+        return {text[i:i + n] for n in sizes for i in range(len(text) - n + 1)}
+    
+    def _add_term(self, term: str):
+        for gram in self.ngrams(term):
+            self.grams[gram].add(term)
+        self.fuzzy_tree.add(term)
+    
+    def _remove_term(self, term: str):
+        del self.postings[term]
+        for gram in self.ngrams(term):
+            self.grams[gram].discard(term)
+            if not self.grams[gram]:
+                del self.grams[gram]
+    
+    def _product_text(self, product: Dict) -> str:
+        return f"{product.get('title', '')} {product.get('description', '')} {' '.join(product.get('tags', []))}"
+    
+    def add(self, product: Dict):
+        """Index a product, replacing any terms indexed for it previously"""
+        self._set_terms(product["id"], set(self.tokenize(self._product_text(product))))
+    
+    def remove(self, product_id: int):
+        self._set_terms(product_id, set())
+        del self._product_terms[product_id]
+    
+    def _set_terms(self, product_id: int, terms: set):
+        old_terms = self._product_terms.get(product_id, set())
+        
+        for term in old_terms - terms:
+            self.postings[term].discard(product_id)
+            if not self.postings[term]:
+                self._remove_term(term)
+        
+        for term in terms - old_terms:
+            if term not in self.postings:
+                self._add_term(term)
+            self.postings[term].add(product_id)
+        
+        self._product_terms[product_id] = terms
+        
+        # Rebuild the BK-tree once removed terms dominate it
+        if self.fuzzy_tree.size > 2 * len(self.postings) + 64:
+            self._rebuild_fuzzy_tree()
+    
+    def _rebuild_fuzzy_tree(self):
+        self.fuzzy_tree = BKTree()
+        for term in sorted(self.postings):
+            self.fuzzy_tree.add(term)
+    
+    def rebuild(self, products: Dict[int, Dict]):
+        self.postings.clear()
+        self.grams.clear()
+        self._product_terms.clear()
+        for product in products.values():
+            terms = set(self.tokenize(self._product_text(product)))
+            for term in terms:
+                self.postings[term].add(product["id"])
+            self._product_terms[product["id"]] = terms
+        for term in self.postings:
+            for gram in self.ngrams(term):
+                self.grams[gram].add(term)
+        self._rebuild_fuzzy_tree()
+    
+    def expand_substring(self, fragment: str) -> List[str]:
+        """All indexed terms containing fragment, checked against its rarest n-gram's terms only"""
+        if len(fragment) <= CATALOG_GRAM_SIZE:
+            return list(self.grams.get(fragment, ()))
+        rarest = min(
+            (self.grams.get(gram, set()) for gram in self.ngrams(fragment, (CATALOG_GRAM_SIZE,))),
+            key=len
+        )
+        return [term for term in rarest if fragment in term]
+    
+    def expand_fuzzy(self, term: str) -> List[str]:
+        """Indexed terms containing term (from the n-gram index) or within typo tolerance of it (from the BK-tree)"""
+        terms = set(self.expand_substring(term))
+        max_distance = typo_tolerance(term)
+        if max_distance:
+            terms.update(word for word in self.fuzzy_tree.search(term, max_distance) if word in self.postings)
+        return list(terms)
+    
+    @staticmethod
+    def contains(product: Dict, q: str) -> bool:
+        """The catalog's substring filter: q appears in the title, description or a tag"""
+        q = q.lower()
+        return (
+            q in product.get("title", "").lower()
+            or q in product.get("description", "").lower()
+            or any(q in tag.lower() for tag in product.get("tags", []))
+        )
+    
+    def search(self, q: str, fuzzy: bool = False) -> List[int]:
+        """Product ids matching every query term, in id order.
+        
+        Terms match anywhere inside an indexed word ("book" finds "MacBook"),
+        so the result is a superset of the substring filter's; fuzzy search
+        also admits words within typo tolerance. A query with no searchable
+        characters matches nothing.
+        """
+        query_terms = self.tokenize(q)
+        if not query_terms:
+            return []
+        
+        matches = []
+        for term in query_terms:
+            expanded = self.expand_fuzzy(term) if fuzzy else self.expand_substring(term)
+            ids = set()
+            for word in expanded:
+                ids |= self.postings[word]
+            if not ids:
+                return []
+            matches.append(ids)
+        
+        # Intersect smallest posting sets first
+        matches.sort(key=len)
+        result = matches[0]
+        for ids in matches[1:]:
+            result = result & ids
+            if not result:
+                return []
+        return sorted(result)
+
+catalog_index = CatalogIndex()
+catalog_index.rebuild(products_db)
 
 @app.get("/api/search/advanced")
 async def advanced_search(
@@ -1096,8 +4244,13 @@ async def advanced_search(
     """Advanced search with fuzzy matching and filters"""
     results = []
     
-    for product in products_db.values():
+    for pid in catalog_index.search(q, fuzzy=fuzzy):
+        product = products_db[pid]
+        
         # Apply filters
+        if not fuzzy and not CatalogIndex.contains(product, q):
+            continue
+        
         if category and product["category"] != category:
             continue
         
@@ -1109,15 +4262,7 @@ async def advanced_search(
             if total_stock == 0:
                 continue
         
-        # Search matching
-        search_text = f"{product['title']} {product['description']} {' '.join(product.get('tags', []))}"
-        
-        if fuzzy:
-            if fuzzy_match(q, search_text):
-                results.append(product)
-        else:
-            if q.lower() in search_text.lower():
-                results.append(product)
+        results.append(product)
     
     # Rank results by relevance
     for product in results:
@@ -1136,69 +4281,345 @@ async def advanced_search(
     
     return results
 
-@app.get("/api/search/suggestions")
-async def search_suggestions(q: str, limit: int = 5):
-    """Get search suggestions as user types"""
-    suggestions = set()
+class _TrieNode:
+    __slots__ = ("children", "terminals", "top")
     
-    for product in products_db.values():
-        # Add product titles that match
-        if q.lower() in product["title"].lower():
-            suggestions.add(product["title"])
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.terminals: set = set()  # Suggestions whose key ends here
+        self.top: List[tuple] = []  # Precomputed (-weight, suggestion), best first
+
+class SuggestionIndex:
+    """Prefix trie over product titles and tags with top-k completions stored at each node"""
+    
+    def __init__(self, k: int = 10):
+        self.k = k
+        self.root = _TrieNode()
+        self.weights: Dict[str, float] = defaultdict(float)
+        self._contributors: Dict[str, int] = defaultdict(int)
+        self._product_entries: Dict[int, Dict[str, float]] = {}
+    
+    @staticmethod
+    def popularity(product: Dict) -> float:
+        # Purchases are a much stronger signal than views
+        return 1 + product.get("purchase_count", 0) * 10 + product.get("view_count", 0)
+    
+    @staticmethod
+    def keys_for(suggestion: str) -> List[str]:
+        """Every word-suffix of the suggestion, so completions match mid-title words"""
+        words = suggestion.lower().split()
+        return list(dict.fromkeys(" ".join(words[i:]) for i in range(len(words))))
+    
+    def _entries(self, product: Dict) -> Dict[str, float]:
+        weight = self.popularity(product)
+        entries = {tag: weight for tag in product.get("tags", []) if tag}
+        if product.get("title"):
+            entries[product["title"]] = weight
+        return entries
+    
+    def _rank(self, node: _TrieNode) -> List[tuple]:
+        candidates = {s: self.weights[s] for s in node.terminals}
+        for child in node.children.values():
+            for neg_weight, suggestion in child.top:
+                candidates[suggestion] = -neg_weight
+        return heapq.nsmallest(self.k, ((-w, s) for s, w in candidates.items()))
+    
+    def _refresh_key(self, key: str, suggestion: str, present: bool):
+        """Add/remove suggestion at key, then recompute top-k along the path bottom-up"""
+        path = [self.root]
+        node = self.root
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+            path.append(node)
+        if present:
+            node.terminals.add(suggestion)
+        else:
+            node.terminals.discard(suggestion)
         
-        # Add matching tags
-        for tag in product.get("tags", []):
-            if q.lower() in tag.lower():
-                suggestions.add(tag)
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            if depth and not node.terminals and not node.children:
+                del path[depth - 1].children[key[depth - 1]]
+                continue
+            node.top = self._rank(node)
+    
+    def add(self, product: Dict):
+        """Index a product's title and tags, replacing its previous contribution"""
+        new_entries = self._entries(product)
+        old_entries = self._product_entries.get(product["id"], {})
         
-        if len(suggestions) >= limit:
-            break
+        for suggestion in set(old_entries) | set(new_entries):
+            old_weight = old_entries.get(suggestion)
+            new_weight = new_entries.get(suggestion)
+            if old_weight == new_weight:
+                continue
+            self.weights[suggestion] += (new_weight or 0) - (old_weight or 0)
+            self._contributors[suggestion] += (new_weight is not None) - (old_weight is not None)
+            present = self._contributors[suggestion] > 0
+            if not present:
+                del self.weights[suggestion]
+                del self._contributors[suggestion]
+            for key in self.keys_for(suggestion):
+                self._refresh_key(key, suggestion, present)
+        
+        self._product_entries[product["id"]] = new_entries
+    
+    def rebuild(self, products: Dict[int, Dict]):
+        """Bulk-load all products, computing every node's top-k in one post-order pass"""
+        self.root = _TrieNode()
+        self.weights.clear()
+        self._contributors.clear()
+        self._product_entries.clear()
+        
+        for product in products.values():
+            entries = self._entries(product)
+            self._product_entries[product["id"]] = entries
+            for suggestion, weight in entries.items():
+                self.weights[suggestion] += weight
+                self._contributors[suggestion] += 1
+        
+        for suggestion in self.weights:
+            for key in self.keys_for(suggestion):
+                node = self.root
+                for char in key:
+                    node = node.children.setdefault(char, _TrieNode())
+                node.terminals.add(suggestion)
+        
+        stack = [(self.root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                node.top = self._rank(node)
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values())
     
-    return list(suggestions)[:limit]
+    def complete(self, prefix: str, limit: int) -> List[str]:
+        node = self.root
+        for char in " ".join(prefix.lower().split()):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return [suggestion for _, suggestion in node.top[:limit]]
+
+suggestion_index = SuggestionIndex()
+suggestion_index.rebuild(products_db)
+
+SUGGESTION_REFRESH_SECONDS = 300
+
+def index_product(product: Dict):
+    """Keep the derived product indexes in sync with a created or updated product"""
+    note_product_changes((product["id"],))
+    catalog_index.add(product)
+    suggestion_index.add(product)
+    price_index.update(product)
+    similarity_index.update(product)
+    personalized_scorer.update_boost(product)
+    products_by_seller.index(product)
+
+async def refresh_suggestions():
+    """Rebuild the trie with current view and purchase counts and swap it in"""
+    global suggestion_index
+    suggestion_index = await rebuild_product_index(SuggestionIndex(suggestion_index.k), SuggestionIndex.add)
+
+async def refresh_suggestion_weights():
+    """Periodically re-rank completions as view and purchase counts move"""
+    while True:
+        await asyncio.sleep(SUGGESTION_REFRESH_SECONDS)
+        try:
+            await refresh_suggestions()
+        except Exception:
+            logger.exception("Suggestion refresh failed")
+
+@app.get("/api/search/suggestions")
+async def search_suggestions(q: str, limit: int = 5):
+    """Get search suggestions as user types, ranked by popularity (at most 10 are kept per prefix)"""
+    return suggestion_index.complete(q, max(0, min(limit, suggestion_index.k)))
 
 # ============================================================================
 # 13. ANALYTICS & INSIGHTS
 # ============================================================================
 
+DASHBOARD_TOP_PRODUCTS = 10
+
+def priced_lines(order: Dict) -> List[tuple]:
+    """(item, line revenue at the price charged) for the order's items still in the catalog"""
+    return [
+        (item, charged_unit_price(item) * item["quantity"])
+        for item in order["items"] if item["product_id"] in products_db
+    ]
+
+class DashboardRollups:
+    """Marketplace-wide order totals, kept up to date as orders are written"""
+    
+    def __init__(self):
+        self.total_revenue = 0.0
+        self.category_revenue: Dict[str, float] = defaultdict(float)
+        self.best_sellers = TopN(DASHBOARD_TOP_PRODUCTS)  # By purchase_count
+    
+    def add_order(self, order: Dict, lines: List[tuple], sign: int = 1):
+        """Count an order's revenue in (sign=1) or, once it is cancelled, back out (sign=-1)"""
+        self.total_revenue += sign * order["total_amount"]
+        for item, revenue in lines:
+            self.category_revenue[products_db[item["product_id"]]["category"]] += sign * revenue
+    
+    def record_sale(self, product: Dict):
+        self.best_sellers.offer(product["id"], product.get("purchase_count", 0))
+    
+    def withdraw_sale(self, product: Dict):
+        # TopN only tracks rising scores: a best seller whose count drops may
+        # now trail a product outside the top, so rank the catalog again
+        if product["id"] in self.best_sellers.scores:
+            self.rank_best_sellers(products_db)
+    
+    def rank_best_sellers(self, products: Dict[int, Dict]):
+        self.best_sellers = TopN(DASHBOARD_TOP_PRODUCTS)
+        for product in products.values():
+            self.record_sale(product)
+    
+    def rebuild(self, orders: Dict[int, Dict], products: Dict[int, Dict]):
+        self.total_revenue = 0.0
+        self.category_revenue.clear()
+        for order in orders.values():
+            if order["status"] != OrderStatus.CANCELLED:
+                self.add_order(order, priced_lines(order))
+        self.rank_best_sellers(products)
+
+dashboard_rollups = DashboardRollups()
+dashboard_rollups.rebuild(orders_db, products_db)
+
+SERIES_METRICS = ("revenue", "units", "views", "orders")
+SERIES_GRANULARITIES = {"hour": 3600, "day": 86400}
+HOURLY_RETENTION_DAYS = 90
+MAX_SERIES_POINTS = 5000
+
+class TimeSeries:
+    """Metric sums in fixed-width time buckets, one row per metric in a growable array.
+    
+    Buckets are aligned to the Unix epoch (so days run midnight to midnight UTC).
+    With a retention limit, buckets older than that many columns are dropped
+    as the series advances.
+    """
+    
+    def __init__(self, bucket_seconds: int, retention: Optional[int] = None):
+        self.bucket_seconds = bucket_seconds
+        self.retention = retention
+        self.first: Optional[int] = None  # Bucket number of column 0
+        self.last: Optional[int] = None  # Newest bucket seen
+        self.values = np.zeros((len(SERIES_METRICS), 0))
+    
+    def _column(self, bucket: int) -> Optional[int]:
+        if self.first is None:
+            self.first = self.last = bucket
+        if self.retention is not None and bucket <= self.last - self.retention:
+            return None  # Older than the retained window
+        
+        if bucket < self.first:
+            padding = np.zeros((len(SERIES_METRICS), self.first - bucket))
+            self.values = np.concatenate([padding, self.values], axis=1)
+            self.first = bucket
+        self.last = max(self.last, bucket)
+        if self.retention is not None and self.first <= self.last - self.retention:
+            # Slide the window forward
+            drop = self.last - self.retention + 1 - self.first
+            self.values = self.values[:, drop:]
+            self.first += drop
+        
+        column = bucket - self.first
+        if column >= self.values.shape[1]:
+            size = max(2 * self.values.shape[1], 16)
+            if self.retention is not None:
+                size = min(size, self.retention)
+            grown = np.zeros((len(SERIES_METRICS), max(size, column + 1)))
+            grown[:, :self.values.shape[1]] = self.values
+            self.values = grown
+        return column
+    
+    def add(self, when: datetime, amounts: Dict[str, float]):
+        column = self._column(int(when.timestamp() // self.bucket_seconds))
+        if column is None:
+            return
+        for metric, amount in amounts.items():
+            self.values[SERIES_METRICS.index(metric), column] += amount
+    
+    def window(self, start: datetime, end: datetime) -> tuple:
+        """(first bucket, metrics x buckets array) covering [start, end)"""
+        low = int(start.timestamp() // self.bucket_seconds)
+        high = -(-int(end.timestamp()) // self.bucket_seconds)
+        result = np.zeros((len(SERIES_METRICS), max(high - low, 0)))
+        if self.first is not None:
+            begin = max(low, self.first)
+            stop = min(high, self.first + self.values.shape[1])
+            if begin < stop:
+                result[:, begin - low:stop - low] = self.values[:, begin - self.first:stop - self.first]
+        return low, result
+
+def local_naive(when: Optional[datetime]) -> Optional[datetime]:
+    """Express a timezone-aware datetime on the server clock, like datetime.now()"""
+    if when is None or when.tzinfo is None:
+        return when
+    return when.astimezone().replace(tzinfo=None)
+
+class SellerAnalytics:
+    """Per-seller revenue, units, views and order counts by hour and by day"""
+    
+    def __init__(self):
+        self.series: Dict[int, Dict[str, TimeSeries]] = {}
+        self.total_revenue: Dict[int, float] = defaultdict(float)
+    
+    def _series(self, seller_id: int) -> Dict[str, TimeSeries]:
+        series = self.series.get(seller_id)
+        if series is None:
+            hourly_retention = HOURLY_RETENTION_DAYS * 86400 // SERIES_GRANULARITIES["hour"]
+            series = self.series[seller_id] = {
+                "hour": TimeSeries(SERIES_GRANULARITIES["hour"], hourly_retention),
+                "day": TimeSeries(SERIES_GRANULARITIES["day"])
+            }
+        return series
+    
+    def _add(self, seller_id: int, when: datetime, amounts: Dict[str, float]):
+        for series in self._series(seller_id).values():
+            series.add(when, amounts)
+    
+    def add_order(self, order: Dict, lines: List[tuple], sign: int = 1):
+        """Count an order in (sign=1) or, once it is cancelled, back out (sign=-1)"""
+        per_seller: Dict[int, Dict[str, float]] = {}
+        for item, revenue in lines:
+            seller_id = products_db[item["product_id"]]["seller_id"]
+            amounts = per_seller.setdefault(seller_id, {"revenue": 0.0, "units": 0, "orders": sign})
+            amounts["revenue"] += sign * revenue
+            amounts["units"] += sign * item["quantity"]
+        for seller_id, amounts in per_seller.items():
+            self.total_revenue[seller_id] += amounts["revenue"]
+            self._add(seller_id, order["created_at"], amounts)
+    
+    def record_view(self, product: Dict, when: datetime):
+        self._add(product["seller_id"], when, {"views": 1})
+    
+    def rebuild(self, orders: Dict[int, Dict]):
+        self.series.clear()
+        self.total_revenue.clear()
+        for order in orders.values():
+            if order["status"] != OrderStatus.CANCELLED:
+                self.add_order(order, priced_lines(order))
+
+seller_analytics = SellerAnalytics()
+seller_analytics.rebuild(orders_db)
+
 @app.get("/api/analytics/dashboard")
 async def get_analytics_dashboard(current_user: dict = Depends(require_role([UserRole.ADMIN]))):
     """Get comprehensive analytics dashboard"""
-    total_orders = len(orders_db)
-    total_revenue = sum(o["total_amount"] for o in orders_db.values())
-    total_products = len(products_db)
-    total_users = len(users_db)
-    
-    # Order status breakdown
-    status_breakdown = {}
-    for status in OrderStatus:
-        status_breakdown[status] = len([o for o in orders_db.values() if o["status"] == status])
-    
-    # Top products
-    top_products = sorted(
-        products_db.values(),
-        key=lambda x: x.get("purchase_count", 0),
-        reverse=True
-    )[:10]
-    
-    # Revenue by category
-    category_revenue = defaultdict(float)
-    for order in orders_db.values():
-        for item in order["items"]:
-            if item["product_id"] in products_db:
-                product = products_db[item["product_id"]]
-                category_revenue[product["category"]] += product["base_price"] * item["quantity"]
-    
     return {
-        "total_orders": total_orders,
-        "total_revenue": total_revenue,
-        "total_products": total_products,
-        "total_users": total_users,
-        "order_status_breakdown": status_breakdown,
-        "top_products": top_products,
-        "revenue_by_category": dict(category_revenue),
-        "active_auctions": len([a for a in auctions_db.values() if a["status"] == "active"]),
-        "pending_rfqs": len([r for r in rfqs_db.values() if r["status"] == "pending"]),
-        "open_disputes": len([d for d in disputes_db.values() if d["status"] == "open"])
+        "total_orders": len(orders_db),
+        "total_revenue": dashboard_rollups.total_revenue,
+        "total_products": len(products_db),
+        "total_users": len(users_db),
+        "order_status_breakdown": {status: orders_by_status.count(status) for status in OrderStatus},
+        "top_products": [products_db[pid] for pid in dashboard_rollups.best_sellers.top(DASHBOARD_TOP_PRODUCTS)],
+        "revenue_by_category": dict(dashboard_rollups.category_revenue),
+        "active_auctions": active_auction_count(),
+        "pending_rfqs": rfqs_by_status.count("pending"),
+        "open_disputes": disputes_by_status.count(DisputeStatus.OPEN)
     }
 
 @app.get("/api/analytics/seller/{seller_id}")
@@ -1210,29 +4631,274 @@ async def get_seller_analytics(
     if current_user["id"] != seller_id and current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    seller_products = [p for p in products_db.values() if p["seller_id"] == seller_id]
+    seller_products = [products_db[pid] for pid in products_by_seller.ids(seller_id)]
     total_views = sum(p.get("view_count", 0) for p in seller_products)
     total_sales = sum(p.get("purchase_count", 0) for p in seller_products)
     
-    # Calculate revenue
-    seller_revenue = 0
-    for order in orders_db.values():
-        for item in order["items"]:
-            if item["product_id"] in products_db:
-                product = products_db[item["product_id"]]
-                if product["seller_id"] == seller_id:
-                    seller_revenue += product["base_price"] * item["quantity"]
-    
     return {
         "seller_id": seller_id,
         "total_products": len(seller_products),
         "total_views": total_views,
         "total_sales": total_sales,
-        "total_revenue": seller_revenue,
+        "total_revenue": seller_analytics.total_revenue.get(seller_id, 0),
         "average_rating": sum(p.get("rating", 0) for p in seller_products) / len(seller_products) if seller_products else 0,
         "conversion_rate": (total_sales / total_views * 100) if total_views > 0 else 0
     }
 
+@app.get("/api/analytics/seller/{seller_id}/series")
+async def get_seller_series(
+    seller_id: int,
+    granularity: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Revenue, units, views, orders and conversion per hour or day over [start, end)"""
+    if current_user["id"] != seller_id and current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if granularity not in SERIES_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="Granularity must be 'hour' or 'day'")
+    
+    bucket_seconds = SERIES_GRANULARITIES[granularity]
+    # Order and view times are naive server-clock times; compare like with like
+    start, end = local_naive(start), local_naive(end)
+    end = end or datetime.now()
+    start = start or end - timedelta(days=7 if granularity == "hour" else 90)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - start).total_seconds() / bucket_seconds > MAX_SERIES_POINTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SERIES_POINTS} buckets per request")
+    
+    series = seller_analytics.series.get(seller_id)
+    if series is None:
+        first, values = TimeSeries(bucket_seconds).window(start, end)
+    else:
+        first, values = series[granularity].window(start, end)
+    
+    revenue, units, views, orders = values
+    conversion = np.divide(units * 100, views, out=np.zeros_like(units), where=views > 0)
+    return {
+        "seller_id": seller_id,
+        "granularity": granularity,
+        "timestamps": [datetime.fromtimestamp((first + i) * bucket_seconds) for i in range(values.shape[1])],
+        "revenue": revenue.round(2).tolist(),
+        "units": units.astype(int).tolist(),
+        "views": views.astype(int).tolist(),
+        "orders": orders.astype(int).tolist(),
+        "conversion_rate": conversion.round(2).tolist()
+    }
+
+OLAP_DIR = os.environ.get("INDABACART_OLAP_DIR", os.path.join(STORAGE_DIR, "olap"))
+OLAP_EXPORT_SECONDS = 3600
+OLAP_COLUMNS = {
+    "order_id": np.int64,
+    "user_id": np.int64,
+    "product_id": np.int64,
+    "seller_id": np.int64,  # -1 once the product is gone from the catalog
+    "quantity": np.int64,
+    "unit_price": np.float64,
+    "status": np.int8,  # Position in ORDER_STATUSES
+    "created_at": "datetime64[s]",
+}
+ORDER_STATUSES = list(OrderStatus)
+OLAP_GROUPS = ("seller_id", "product_id", "user_id", "status", "day", "month")
+OLAP_METRICS = ("revenue", "units", "orders", "lines")
+
+def flatten_order_lines(orders: List[Dict]) -> Dict[str, np.ndarray]:
+    """One row per order item, column by column"""
+    lines = [(order, item) for order in orders for item in order["items"]]
+    
+    def seller_id(item: Dict) -> int:
+        product = products_db.get(item["product_id"])
+        return product["seller_id"] if product else -1
+    
+    values = {
+        "order_id": [order["id"] for order, _ in lines],
+        "user_id": [order["user_id"] for order, _ in lines],
+        "product_id": [item["product_id"] for _, item in lines],
+        "seller_id": [seller_id(item) for _, item in lines],
+        "quantity": [item["quantity"] for _, item in lines],
+        "unit_price": [charged_unit_price(item) for _, item in lines],
+        "status": [ORDER_STATUSES.index(OrderStatus(order["status"])) for order, _ in lines],
+        "created_at": [order["created_at"] for order, _ in lines],
+    }
+    return {name: np.array(values[name], dtype=dtype) for name, dtype in OLAP_COLUMNS.items()}
+
+class OrderColumnStore:
+    """Order lines exported as memory-mapped .npy columns.
+    
+    Each export goes to its own directory and is published by atomically
+    replacing manifest.json, so readers never see a half-written export.
+    The published export is also kept as one (manifest, columns) reference:
+    a reader takes it once and keeps its memory maps, which stay readable
+    after a newer export removes the files.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._export_lock = threading.Lock()
+        self.current: Optional[tuple] = None  # (manifest, columns), replaced whole by each export
+    
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+    
+    def export(self, orders: List[Dict]) -> Dict:
+        with self._export_lock:
+            columns = flatten_order_lines(orders)
+            name = f"orders-{time.time_ns()}"
+            path = os.path.join(self.directory, name)
+            os.makedirs(path)
+            for column, values in columns.items():
+                np.save(os.path.join(path, f"{column}.npy"), values)
+            
+            manifest = {
+                "export": name,
+                "orders": len(orders),
+                "rows": len(columns["order_id"]),
+                "exported_at": datetime.now().isoformat(),
+            }
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self.manifest_path)
+            self.current = (manifest, self._map(manifest))
+            
+            # Open memory maps keep superseded files readable until closed
+            for entry in os.listdir(self.directory):
+                if entry.startswith("orders-") and entry != name:
+                    try:
+                        for column_file in os.listdir(os.path.join(self.directory, entry)):
+                            os.remove(os.path.join(self.directory, entry, column_file))
+                        os.rmdir(os.path.join(self.directory, entry))
+                    except OSError:
+                        logger.warning("Could not remove superseded order export %s; retrying next export", entry)
+            return manifest
+    
+    def _map(self, manifest: Dict) -> Dict[str, np.ndarray]:
+        path = os.path.join(self.directory, manifest["export"])
+        return {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r") for column in OLAP_COLUMNS}
+    
+    def open(self) -> tuple:
+        """(manifest, read-only memory-mapped columns) of the latest export; does file I/O on first use"""
+        current = self.current
+        if current is not None:
+            return current
+        with self._export_lock:
+            # An export published on disk before this process started
+            if self.current is None:
+                if not os.path.exists(self.manifest_path):
+                    raise HTTPException(status_code=404, detail="No order export yet")
+                with open(self.manifest_path) as f:
+                    manifest = json.load(f)
+                self.current = (manifest, self._map(manifest))
+            return self.current
+
+order_columns = OrderColumnStore(OLAP_DIR)
+
+def query_order_columns(
+    columns: Dict[str, np.ndarray],
+    group_by: str,
+    metric: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    filters: Optional[Dict[str, int]] = None
+) -> List[Dict]:
+    """Filtered group-by aggregate over exported order lines"""
+    created_at = columns["created_at"]
+    mask = np.ones(len(created_at), dtype=bool)
+    if start is not None:
+        mask &= created_at >= np.datetime64(start, "s")
+    if end is not None:
+        mask &= created_at < np.datetime64(end, "s")
+    for column, value in (filters or {}).items():
+        mask &= columns[column] == value
+    
+    if group_by == "day":
+        keys = created_at[mask].astype("datetime64[D]")
+    elif group_by == "month":
+        keys = created_at[mask].astype("datetime64[M]")
+    else:
+        keys = columns[group_by][mask]
+    groups, inverse = np.unique(keys, return_inverse=True)
+    
+    if metric == "revenue":
+        weights = columns["quantity"][mask] * columns["unit_price"][mask]
+        values = np.bincount(inverse, weights=weights, minlength=len(groups)).round(2)
+    elif metric == "units":
+        values = np.bincount(inverse, weights=columns["quantity"][mask], minlength=len(groups)).astype(np.int64)
+    elif metric == "orders":
+        # Distinct (group, order) pairs
+        pairs = np.unique(np.stack([inverse, columns["order_id"][mask]]), axis=1)
+        values = np.bincount(pairs[0], minlength=len(groups))
+    else:
+        values = np.bincount(inverse, minlength=len(groups))
+    
+    if group_by == "status":
+        labels = [ORDER_STATUSES[code].value for code in groups.tolist()]
+    elif group_by in ("day", "month"):
+        labels = [str(key) for key in groups]
+    else:
+        labels = groups.tolist()
+    return [{"key": label, "value": value} for label, value in zip(labels, values.tolist())]
+
+async def export_order_columns() -> Dict:
+    orders = list(orders_db.values())  # Point-in-time list of order records
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, order_columns.export, orders)
+
+async def export_order_columns_periodically():
+    while True:
+        await asyncio.sleep(OLAP_EXPORT_SECONDS)
+        try:
+            await export_order_columns()
+        except Exception:
+            logger.exception("Order export failed")
+
+@app.post("/api/analytics/olap/export")
+async def trigger_order_export(current_user: dict = Depends(require_role([UserRole.ADMIN]))):
+    """Export order lines to columnar files now instead of waiting for the schedule"""
+    return await export_order_columns()
+
+@app.get("/api/analytics/olap/orders")
+async def query_order_export(
+    group_by: str = "seller_id",
+    metric: str = "revenue",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    status: Optional[OrderStatus] = None,
+    seller_id: Optional[int] = None,
+    product_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(require_role([UserRole.ADMIN]))
+):
+    """Group-by aggregates over the latest order export, largest first"""
+    if group_by not in OLAP_GROUPS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(OLAP_GROUPS)}")
+    if metric not in OLAP_METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(OLAP_METRICS)}")
+    
+    # created_at holds naive server-clock times
+    start, end = local_naive(start), local_naive(end)
+    filters = {"seller_id": seller_id, "product_id": product_id, "user_id": user_id}
+    filters = {column: value for column, value in filters.items() if value is not None}
+    if status is not None:
+        filters["status"] = ORDER_STATUSES.index(status)
+    
+    loop = asyncio.get_running_loop()
+    manifest, columns = await loop.run_in_executor(None, order_columns.open)
+    groups = await loop.run_in_executor(
+        None, query_order_columns, columns, group_by, metric, start, end, filters
+    )
+    groups.sort(key=lambda group: group["value"], reverse=True)
+    return {
+        "exported_at": manifest["exported_at"],
+        "group_by": group_by,
+        "metric": metric,
+        "groups": groups[:limit]
+    }
+
 # ============================================================================
 # 14. SELLER PAYOUT & ESCROW SYSTEM
 # ============================================================================
@@ -1260,6 +4926,7 @@ async def release_payout(
     
     order = orders_db[order_id]
     amount = escrow_db.pop(order_id)
+    storage.delete("escrow", order_id)
     
     # Get seller from first product in order
     first_product = products_db[order["items"][0]["product_id"]]
@@ -1298,17 +4965,51 @@ async def send_notification(user: dict, message: str):
     print(f"Sending notification to {user.get('email')}: {message}")
     await asyncio.sleep(1)
 
+# ============================================================================
+# BACKGROUND JOBS
+# ============================================================================
+
+# Strong references: the event loop only keeps weak ones to running tasks
+background_tasks: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def start_background_jobs():
+    for job in (
+        refresh_suggestion_weights(),
+        storage.run_snapshots(),
+        refresh_exchange_rates_periodically(),
+        broker.run(),
+        sweep_expired_reservations(),
+        auction_scheduler.run(),
+        export_order_columns_periodically(),
+        reprice_catalog_periodically(),
+        compact_price_histories_periodically(),
+    ):
+        background_tasks.append(asyncio.create_task(job))
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    storage.close()
+
 # ============================================================================
 # HEALTH CHECK
 # ============================================================================
 
 @app.get("/health")
-async def health_check():
+async def health_check(response: Response):
+    healthy = storage.error is None
+    if not healthy:
+        response.status_code = 503
     return {
-        "status": "healthy",
+        "status": "healthy" if healthy else "unhealthy",
         "timestamp": datetime.now(),
         "services": {
-            "database": "connected",
+            "database": "connected" if healthy else "write failure",
+            "storage": storage.status(),
             "cache": "active",
             "search": "indexed"
         },
@@ -1316,7 +5017,7 @@ async def health_check():
             "products": len(products_db),
             "users": len(users_db),
             "orders": len(orders_db),
-            "active_auctions": len([a for a in auctions_db.values() if a["status"] == "active"])
+            "active_auctions": active_auction_count()
         }
     }
 
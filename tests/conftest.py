@@ -0,0 +1,88 @@
+import copy
+import itertools
+import os
+import sys
+
+# Tests run against the in-memory backend; nothing is written to disk
+os.environ["INDABACART_STORAGE"] = "memory"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+_unique = itertools.count(1)
+
+
+@pytest.fixture
+def client():
+    # Not entered as a context manager, so the startup jobs stay off
+    return TestClient(main.app)
+
+
+def auth_headers(user_id: int) -> dict:
+    token = main.create_access_token({"sub": str(user_id)})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def admin_headers():
+    return auth_headers(1)
+
+
+@pytest.fixture
+def seller_headers():
+    return auth_headers(2)
+
+
+@pytest.fixture
+def buyer(client):
+    """A freshly registered buyer: (user id, auth headers)"""
+    email = f"buyer{next(_unique)}@example.com"
+    response = client.post("/auth/register", params={"email": email, "username": "buyer", "password": "pw"})
+    user_id = response.json()["user_id"]
+    return user_id, auth_headers(user_id)
+
+
+@pytest.fixture
+def make_product(client, seller_headers):
+    """Create a product with one variant per (sku, stock) pair"""
+    def make(title="Test product", stock=5, sku=None, **fields):
+        sku = sku or f"TEST-{next(_unique)}"
+        payload = {
+            "title": title,
+            "description": fields.pop("description", "A product for tests"),
+            "category": fields.pop("category", "Testing"),
+            "base_price": fields.pop("base_price", 100.0),
+            "currency": "ZAR",
+            "variants": [{"sku": sku, "color": "Black", "size": "M", "stock": stock}],
+            **fields,
+        }
+        response = client.post("/api/products", json=payload, headers=seller_headers)
+        assert response.status_code == 200, response.text
+        return response.json()
+    return make
+
+
+@pytest.fixture
+def restore_catalog():
+    """Undo a test's edits to existing products and price histories, then rebuild what derives from them"""
+    products = copy.deepcopy(main.products_db)
+    histories = {product_id: main.PriceHistory(history) for product_id, history in main.price_history_db.items()}
+    yield
+    for product_id, fields in products.items():
+        main.products_db[product_id].clear()
+        main.products_db[product_id].update(fields)
+    for product_id in list(main.price_history_db):
+        if product_id in histories:
+            main.price_history_db[product_id] = histories[product_id]
+    main.catalog_index.rebuild(main.products_db)
+    main.price_index = main.PriceIndex()
+    main.price_index.rebuild(main.products_db)
+    main.similarity_index = main.SimilarityIndex()
+    main.similarity_index.rebuild(main.products_db)
+    main.personalized_scorer.index = main.similarity_index
+    main.personalized_scorer.rebuild(main.products_db)
+    main.dashboard_rollups.rebuild(main.orders_db, main.products_db)
+    main.seller_analytics.rebuild(main.orders_db)
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main
+from test_orders import place_order
+
+
+def series(client, headers, **params):
+    response = client.get("/api/analytics/seller/2/series", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_series_accepts_mixed_naive_and_aware_bounds(client, seller_headers):
+    end = datetime.now().replace(minute=0, second=0, microsecond=0)
+    start = end - timedelta(hours=3)
+    naive = series(client, seller_headers, start=start.isoformat(), end=end.isoformat())
+    aware_start = start.astimezone().astimezone(timezone.utc).isoformat()
+    mixed = series(client, seller_headers, start=aware_start, end=end.isoformat())
+    assert mixed["timestamps"] == naive["timestamps"]
+    assert len(mixed["revenue"]) == 3
+
+
+def test_series_revenue_survives_repricing(client, buyer, seller_headers, make_product, monkeypatch):
+    _, headers = buyer
+    product = make_product(stock=5)
+    place_order(client, headers, product, 2)
+    before = series(client, seller_headers, granularity="day")["revenue"]
+    
+    monkeypatch.setitem(main.products_db[product["id"]], "base_price", 1.0)
+    main.seller_analytics.rebuild(main.orders_db)
+    assert series(client, seller_headers, granularity="day")["revenue"] == before
+
+
+def test_readers_keep_their_export_while_a_newer_one_replaces_it(client, admin_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "order_columns", main.OrderColumnStore(str(tmp_path)))
+    assert client.get("/api/analytics/olap/orders", headers=admin_headers).status_code == 404
+    
+    first = client.post("/api/analytics/olap/export", headers=admin_headers).json()
+    manifest, columns = main.order_columns.open()
+    assert manifest == first
+    client.post("/api/analytics/olap/export", headers=admin_headers)
+    
+    assert not (tmp_path / first["export"]).exists()
+    assert len(columns["order_id"]) == first["rows"]
+    assert float(columns["unit_price"].sum()) >= 0
+    # A fresh store picks up the published export from disk
+    reopened, _ = main.OrderColumnStore(str(tmp_path)).open()
+    assert reopened == main.order_columns.current[0]
+    assert client.get("/api/analytics/olap/orders", headers=admin_headers).status_code == 200
+
+
+def test_periodic_export_survives_a_failed_run(monkeypatch):
+    calls = []
+    
+    async def export():
+        calls.append(None)
+        raise OSError("disk full")
+    
+    async def run():
+        task = asyncio.create_task(main.export_order_columns_periodically())
+        while len(calls) < 3:
+            await asyncio.sleep(0)
+        assert not task.done()
+        task.cancel()
+    
+    monkeypatch.setattr(main, "OLAP_EXPORT_SECONDS", 0)
+    monkeypatch.setattr(main, "export_order_columns", export)
+    asyncio.run(run())
+    assert len(calls) == 3
+
+
+@pytest.fixture
+def server_timezone(monkeypatch):
+    """Run the server clock in a zone well away from UTC"""
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_export_query_reads_aware_bounds_in_server_time(client, admin_headers, buyer, make_product, tmp_path, monkeypatch, server_timezone):
+    monkeypatch.setattr(main, "order_columns", main.OrderColumnStore(str(tmp_path)))
+    user_id, headers = buyer
+    place_order(client, headers, make_product(stock=5), 1)
+    client.post("/api/analytics/olap/export", headers=admin_headers)
+    
+    now = datetime.now(timezone.utc)
+    params = {
+        "group_by": "user_id", "metric": "orders", "user_id": user_id,
+        "start": (now - timedelta(hours=1)).isoformat(), "end": (now + timedelta(hours=1)).isoformat(),
+    }
+    response = client.get("/api/analytics/olap/orders", params=params, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json()["groups"] == [{"key": user_id, "value": 1}]
@@ -0,0 +1,194 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from main import WALStorage
+from test_broker import ClientSocket
+from test_pagination import walk_pages
+
+
+def create_auction(client, seller_headers):
+    params = {"product_id": 1, "starting_bid": 10, "reserve_price": 50, "duration_hours": 1}
+    response = client.post("/api/auctions", params=params, headers=seller_headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_status_listing_pages_in_id_order_whatever_the_settlement_order(client, seller_headers):
+    first, second, third = (create_auction(client, seller_headers) for _ in range(3))
+    for auction_id in (third, first, second):
+        main.auction_scheduler.settle(main.auctions_db[auction_id])
+
+    ended = walk_pages(client, "/api/auctions", status="ended")
+    assert ended == sorted(ended)
+    assert [auction_id for auction_id in ended if auction_id in (first, second, third)] == [first, second, third]
+    assert not {first, second, third} & set(walk_pages(client, "/api/auctions", status="active"))
+
+
+
+def test_auction_feed_streams_bids_extensions_and_the_result(client, seller_headers, buyer):
+    user_id, _ = buyer
+    bidder = main.users_db[user_id]
+    auction_id = create_auction(client, seller_headers)
+    auction = main.auctions_db[auction_id]
+    
+    async def run():
+        websocket = ClientSocket()
+        serving = asyncio.ensure_future(main.auction_websocket(websocket, auction_id))
+        
+        async def next_event():
+            main.broker.flush()  # The broadcast job isn't running under the test client
+            while not websocket.sent:
+                await asyncio.sleep(0.001)
+            return json.loads(websocket.sent.pop(0))
+        
+        state = await asyncio.wait_for(next_event(), 1)
+        assert (state["type"], state["current_bid"], state["bid_count"]) == ("state", 10, 0)
+        
+        await main.place_bid(auction_id, 20, bidder)
+        with pytest.raises(HTTPException):
+            await main.place_bid(auction_id, 15, bidder)
+        bid = await asyncio.wait_for(next_event(), 1)
+        assert (bid["type"], bid["amount"], bid["user_id"], bid["bid_count"]) == ("bid", 20, user_id, 1)
+        
+        # Inside the sniper window: the bid is followed by the extension
+        auction["end_time"] = datetime.now() + timedelta(seconds=5)
+        main.auction_scheduler.schedule(auction)
+        await main.place_bid(auction_id, 60, bidder)
+        assert (await asyncio.wait_for(next_event(), 1))["amount"] == 60
+        assert (await asyncio.wait_for(next_event(), 1))["type"] == "extended"
+        
+        main.auction_scheduler.settle(auction)
+        ended = await asyncio.wait_for(next_event(), 1)
+        websocket.disconnect.set()
+        await asyncio.wait_for(serving, 1)
+        return ended
+    
+    ended = asyncio.run(run())
+    assert (ended["type"], ended["final_bid"], ended["reserve_met"], ended["winner_id"]) == ("ended", 60, True, user_id)
+
+
+def test_bids_on_one_auction_are_applied_in_arrival_order(client, seller_headers, buyer):
+    user_id, _ = buyer
+    bidder = main.users_db[user_id]
+    auction_id, other_id = create_auction(client, seller_headers), create_auction(client, seller_headers)
+    auction = main.auctions_db[auction_id]
+    
+    async def run():
+        async with main.auction_locks[auction_id]:
+            bids = [asyncio.ensure_future(main.place_bid(auction_id, amount, bidder)) for amount in (30, 20, 50, 40, 60)]
+            # Other auctions don't wait on this one's lock
+            await asyncio.wait_for(main.place_bid(other_id, 20, bidder), 1)
+            await asyncio.sleep(0.01)
+            assert auction["bid_count"] == 0
+        return await asyncio.gather(*bids, return_exceptions=True)
+    
+    results = asyncio.run(run())
+    assert [isinstance(result, HTTPException) for result in results] == [False, True, False, True, False]
+    assert list(main.bid_ledgers_db[auction_id].amounts) == [30, 50, 60]
+    assert (auction["current_bid"], auction["bid_count"]) == (60, 3)
+
+
+def test_bids_on_a_settled_auction_are_rejected_without_a_lock(client, seller_headers, buyer):
+    _, headers = buyer
+    auction_id = create_auction(client, seller_headers)
+    main.auction_scheduler.settle(main.auctions_db[auction_id])
+    
+    response = client.post(f"/api/auctions/{auction_id}/bid", params={"amount": 100}, headers=headers)
+    assert response.status_code == 400
+    assert auction_id not in main.auction_locks
+
+
+def test_bid_history_pages_newest_first(client, seller_headers, buyer):
+    _, headers = buyer
+    auction_id = create_auction(client, seller_headers)
+    for amount in (20, 30, 40, 50, 60):
+        response = client.post(f"/api/auctions/{auction_id}/bid", params={"amount": amount}, headers=headers)
+        assert response.status_code == 200
+    
+    bid_ids = list(main.bid_ledgers_db[auction_id].bid_ids)
+    assert walk_pages(client, f"/api/auctions/{auction_id}/bids") == bid_ids[::-1]
+    first = client.get(f"/api/auctions/{auction_id}/bids", params={"limit": 2})
+    rest = client.get(f"/api/auctions/{auction_id}/bids", params={"cursor": first.headers["x-next-cursor"]})
+    assert [bid["amount"] for bid in first.json() + rest.json()] == [60, 50, 40, 30, 20]
+    assert client.get("/api/auctions/999999/bids").status_code == 404
+
+
+def test_bid_ledger_survives_a_restart(tmp_path):
+    tables = {"bid_ledgers": {}}
+    wal = WALStorage(str(tmp_path), tables)
+    wal.recover()
+    ledger = tables["bid_ledgers"][1] = main.BidLedger()
+    wal.put("bid_ledgers", 1)
+    for bid_id, amount in enumerate((20.0, 30.0, 45.5), start=1):
+        entry = (bid_id, 7, amount, 1700000000.0 + bid_id)
+        ledger.append(entry)
+        wal.append("bid_ledgers", 1, entry)
+        if bid_id == 2:
+            wal.snapshot()
+    wal.close()
+    
+    recovered = {"bid_ledgers": {}}
+    wal = WALStorage(str(tmp_path), recovered)
+    wal.recover()
+    wal.close()
+    restored = main.BidLedger(recovered["bid_ledgers"][1])
+    assert list(restored) == list(ledger)
+    assert restored.bid(2, 1) == ledger.bid(2, 1)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """A scheduler of its own, so settling doesn't touch other tests' auctions"""
+    scheduler = main.AuctionScheduler()
+    monkeypatch.setattr(main, "auction_scheduler", scheduler)
+    return scheduler
+
+
+@pytest.mark.parametrize("top_bid, reserve_met", [(60, True), (40, False)])
+def test_due_auctions_settle_against_the_reserve(client, seller_headers, buyer, scheduler, top_bid, reserve_met):
+    user_id, headers = buyer
+    auction_id = create_auction(client, seller_headers)
+    client.post(f"/api/auctions/{auction_id}/bid", params={"amount": top_bid}, headers=headers)
+    auction = main.auctions_db[auction_id]
+    
+    assert scheduler.close_due(auction["end_time"] - timedelta(seconds=1)) == pytest.approx(1)
+    assert auction["status"] == "active"
+    assert scheduler.close_due(auction["end_time"]) is None
+    assert auction["status"] == "ended"
+    assert auction["reserve_met"] is reserve_met
+    assert auction["winner_id"] == (user_id if reserve_met else None)
+    assert auction_id not in main.auction_locks
+
+
+def test_unbid_auction_settles_without_a_winner(client, seller_headers, scheduler):
+    auction_id = create_auction(client, seller_headers)
+    auction = main.auctions_db[auction_id]
+    scheduler.close_due(auction["end_time"])
+    assert (auction["status"], auction["reserve_met"], auction["winner_id"]) == ("ended", False, None)
+
+
+def test_sniper_extension_rearms_the_deadline(client, seller_headers, buyer, scheduler):
+    user_id, headers = buyer
+    auction_id = create_auction(client, seller_headers)
+    auction = main.auctions_db[auction_id]
+    first_deadline = datetime.now() + timedelta(seconds=5)
+    auction["end_time"] = first_deadline
+    scheduler.schedule(auction)
+    
+    client.post(f"/api/auctions/{auction_id}/bid", params={"amount": 60}, headers=headers)
+    assert auction["end_time"] == first_deadline + timedelta(seconds=main.SNIPER_EXTENSION_SECONDS)
+    
+    # The superseded deadline passes without closing the auction
+    remaining = scheduler.close_due(first_deadline)
+    assert auction["status"] == "active"
+    assert remaining == pytest.approx(main.SNIPER_EXTENSION_SECONDS)
+    assert [key[1] for key in scheduler.walk_ending(auction["end_time"].timestamp())] == [auction_id]
+    
+    scheduler.close_due(auction["end_time"])
+    assert (auction["status"], auction["winner_id"]) == ("ended", user_id)
+    assert list(scheduler.walk_ending(auction["end_time"].timestamp())) == []
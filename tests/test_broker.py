@@ -0,0 +1,78 @@
+import asyncio
+
+import main
+
+
+class GoneWebSocket:
+    """A socket whose client has already completed the close handshake"""
+    
+    async def send_text(self, text):
+        raise RuntimeError('Cannot call "send" once a close message has been sent.')
+    
+    async def close(self, code=1000):
+        raise RuntimeError("Unexpected ASGI message 'websocket.close'")
+    
+    async def receive(self):
+        raise RuntimeError('Cannot call "receive" once a disconnect message has been received.')
+
+
+def test_pump_exits_and_unsubscribes_when_send_fails():
+    broker = main.broker
+    
+    async def run():
+        subscriber = main.Subscriber()
+        assert broker.subscribe("test:gone", subscriber)
+        pump = asyncio.ensure_future(main._pump_subscriber(GoneWebSocket(), subscriber))
+        subscriber.deliver("test:gone", "{}")
+        await asyncio.wait_for(pump, 1)
+        return subscriber
+    
+    before = broker.subscriber_count
+    subscriber = asyncio.run(run())
+    assert not subscriber.topics
+    assert "test:gone" not in broker.topics
+    assert broker.subscriber_count == before
+
+
+class ClientSocket:
+    """Accepts, records what is sent, and disconnects when told to"""
+    
+    def __init__(self):
+        self.sent = []
+        self.disconnect = asyncio.Event()
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, text):
+        self.sent.append(text)
+    
+    async def close(self, code=1000):
+        pass
+    
+    async def receive(self):
+        await self.disconnect.wait()
+        return {"type": "websocket.disconnect"}
+
+
+def test_subscription_is_released_on_disconnect_and_on_cancel():
+    broker = main.broker
+    before = broker.subscriber_count
+    
+    async def run(cancel: bool):
+        websocket = ClientSocket()
+        serving = asyncio.ensure_future(main.serve_subscription(websocket, "test:feed", {"snapshot": True}))
+        await asyncio.sleep(0)
+        assert broker.subscriber_count == before + 1
+        if cancel:
+            serving.cancel()
+        else:
+            websocket.disconnect.set()
+        await asyncio.gather(serving, return_exceptions=True)
+        return websocket
+    
+    for cancel in (False, True):
+        websocket = asyncio.run(run(cancel))
+        assert websocket.sent == ['{"snapshot": true}']
+        assert broker.subscriber_count == before
+        assert "test:feed" not in broker.topics
@@ -0,0 +1,53 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("bad_rate", [math.nan, math.inf, 0.0, -1.0])
+def test_refresh_rejects_unusable_rates(bad_rate):
+    rates = dict(main.exchange_rates.current.rates, USD=bad_rate)
+    with pytest.raises(ValueError):
+        main.exchange_rates.refresh(rates)
+
+
+def test_price_index_is_rebuilt_and_swapped_after_a_rate_change(make_product, monkeypatch):
+    product = make_product(base_price=100.0, currency="USD")
+    provider = main.StaticRateProvider(dict(main.exchange_rates.current.rates))
+    provider.rates["USD"] = provider.rates["USD"] * 2
+    # Restored afterwards, like the provider
+    monkeypatch.setattr(main.exchange_rates, "current", main.exchange_rates.current)
+    monkeypatch.setattr(main, "price_index", main.price_index)
+    monkeypatch.setattr(main.exchange_rates, "provider", provider)
+    old_index = main.price_index
+    
+    table = asyncio.run(main.refresh_exchange_rates())
+    
+    assert main.price_index is not old_index
+    assert main.price_index.rates_version == table.version
+    assert main.price_index.zar_prices[product["id"]] == pytest.approx(100.0 / provider.rates["USD"])
+    assert main.product_change_trackers == []
+
+
+def test_single_and_batch_conversion_quote_the_same_cents(client):
+    amounts = [round(0.01 * n + n * n * 0.0007, 2) for n in range(4000)]
+    rates = main.exchange_rates.current
+    for from_curr in rates.currencies:
+        for to_curr in rates.currencies:
+            batch = rates.convert_many(np.array(amounts), from_curr, to_curr).tolist()
+            assert batch == [rates.convert(amount, from_curr, to_curr) for amount in amounts]
+    
+    params = {"from_curr": "USD", "to_curr": "ZIG"}
+    batch = client.post("/api/currency/convert/batch", params=params, json=amounts[:50]).json()
+    single = [client.get("/api/currency/convert", params={**params, "amount": a}).json()["converted_amount"] for a in amounts[:50]]
+    assert batch["converted_amounts"] == single
+
+
+def test_batch_conversion_is_capped(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_BATCH_CONVERSIONS", 3)
+    params = {"from_curr": "USD", "to_curr": "ZAR"}
+    assert client.post("/api/currency/convert/batch", params=params, json=[1, 2, 3]).status_code == 200
+    assert client.post("/api/currency/convert/batch", params=params, json=[1, 2, 3, 4]).status_code == 400
@@ -0,0 +1,164 @@
+from fastapi.testclient import TestClient
+
+import main
+from conftest import auth_headers
+
+
+def place_order(client, headers, product, quantity):
+    payload = {
+        "items": [{"product_id": product["id"], "sku": product["variants"][0]["sku"], "quantity": quantity}],
+        "shipping_address": {"city": "JHB"},
+    }
+    response = client.post("/api/orders", json=payload, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def set_status(client, order_id, status):
+    return client.put(f"/api/orders/{order_id}/status", params={"status": status}, headers=auth_headers(1))
+
+
+def stock(product):
+    return main.inventory_db[product["variants"][0]["sku"]]
+
+
+def test_cancel_restocks_once_and_cannot_be_reopened(client, buyer, make_product):
+    _, headers = buyer
+    product = make_product(stock=5)
+    order = place_order(client, headers, product, 2)
+    assert stock(product) == 3
+    
+    assert set_status(client, order["id"], "cancelled").status_code == 200
+    assert stock(product) == 5
+    # Repeating the cancel is a no-op, reopening is refused
+    assert set_status(client, order["id"], "cancelled").status_code == 200
+    assert set_status(client, order["id"], "pending").status_code == 409
+    assert set_status(client, order["id"], "cancelled").status_code == 200
+    assert stock(product) == 5
+
+
+def test_cancel_after_shipping_does_not_restock(client, buyer, make_product):
+    _, headers = buyer
+    product = make_product(stock=5)
+    for status in ("shipped", "delivered"):
+        order = place_order(client, headers, product, 1)
+        set_status(client, order["id"], "paid")
+        set_status(client, order["id"], status)
+        before = stock(product)
+        assert set_status(client, order["id"], "cancelled").status_code == 200
+        assert stock(product) == before
+
+
+def test_cancel_from_paid_or_processing_restocks(client, buyer, make_product):
+    _, headers = buyer
+    product = make_product(stock=5)
+    for status in ("paid", "processing"):
+        order = place_order(client, headers, product, 2)
+        set_status(client, order["id"], status)
+        assert stock(product) == 3
+        set_status(client, order["id"], "cancelled")
+        assert stock(product) == 5
+
+
+def line(product, quantity=1, **extra):
+    return {"product_id": product["id"], "sku": product["variants"][0]["sku"], "quantity": quantity, **extra}
+
+
+def test_bulk_rejects_malformed_entries_without_leaking_stock(client, buyer, make_product):
+    _, headers = buyer
+    product = make_product(stock=2)
+    address = {"city": "JHB"}
+    batch = [
+        {"items": [line(product)], "shipping_address": address},
+        {"items": [line(product, quantity="one")], "shipping_address": address},
+        {"items": [line(product)]},  # No shipping address
+        {"items": [], "shipping_address": address},
+        "not an order",
+        {"items": [line(product, quantity=5)], "shipping_address": address},
+    ]
+    response = client.post("/api/orders/bulk", json=batch, headers=headers)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["created"] == 1
+    assert [result["status_code"] for result in body["results"][1:]] == [422, 422, 422, 422, 400]
+    assert stock(product) == 1
+    assert main.orders_db[body["results"][0]["order_id"]]["shipping_address"] == address
+
+
+def test_bulk_releases_stock_when_the_batch_cannot_be_stored(client, buyer, make_product, monkeypatch):
+    _, headers = buyer
+    product = make_product(stock=5)
+    batch = [{"items": [line(product, 2)], "shipping_address": {"city": "JHB"}}] * 2
+    order_count = len(main.orders_db)
+    
+    def failing_put_many(*args, **kwargs):
+        raise RuntimeError("WAL writer has stopped")
+    
+    monkeypatch.setattr(main.storage, "put_many", failing_put_many)
+    body = client.post("/api/orders/bulk", json=batch, headers=headers).json()
+    assert body["created"] == 0
+    assert [result["status_code"] for result in body["results"]] == [500, 500]
+    assert stock(product) == 5
+    assert len(main.orders_db) == order_count
+
+
+def test_bulk_keeps_extra_line_fields(client, buyer, make_product):
+    _, headers = buyer
+    product = make_product(stock=5, base_price=100.0)
+    batch = [{"items": [line(product, 2, gift_wrap=True)], "shipping_address": {"city": "JHB"}}]
+    body = client.post("/api/orders/bulk", json=batch, headers=headers).json()
+    order = main.orders_db[body["results"][0]["order_id"]]
+    assert order["items"][0]["gift_wrap"] is True
+    assert order["total_amount"] == 200.0
+
+
+def test_cancel_takes_the_sale_back_out_of_counters_and_rollups(client, buyer, make_product):
+    _, headers = buyer
+    product = make_product(stock=5, category="Cancellations")
+    revenue_before = main.dashboard_rollups.total_revenue
+    seller_revenue_before = main.seller_analytics.total_revenue[product["seller_id"]]
+    order = place_order(client, headers, product, 2)
+    assert main.products_db[product["id"]]["purchase_count"] == 2
+    assert main.dashboard_rollups.category_revenue["Cancellations"] == 200
+    
+    set_status(client, order["id"], "cancelled")
+    assert main.products_db[product["id"]]["purchase_count"] == 0
+    assert main.dashboard_rollups.category_revenue["Cancellations"] == 0
+    assert main.dashboard_rollups.total_revenue == revenue_before
+    assert main.seller_analytics.total_revenue[product["seller_id"]] == seller_revenue_before
+    assert main.dashboard_rollups.best_sellers.scores.get(product["id"], 0) == 0
+    row = main.similarity_index.rows[product["id"]]
+    assert main.personalized_scorer.boosts[row] == 0
+
+
+def test_rollups_keep_the_price_orders_were_charged(client, buyer, make_product, monkeypatch):
+    _, headers = buyer
+    product = make_product(stock=5, category="Repriced")
+    place_order(client, headers, product, 1)
+    seller_revenue = main.seller_analytics.total_revenue[product["seller_id"]]
+    
+    monkeypatch.setitem(main.products_db[product["id"]], "base_price", 999.0)
+    main.dashboard_rollups.rebuild(main.orders_db, main.products_db)
+    main.seller_analytics.rebuild(main.orders_db)
+    assert main.dashboard_rollups.category_revenue["Repriced"] == 100
+    assert main.seller_analytics.total_revenue[product["seller_id"]] == seller_revenue
+
+
+def test_single_order_releases_stock_when_it_cannot_be_stored(buyer, make_product, monkeypatch):
+    _, headers = buyer
+    product = make_product(stock=5)
+    order_count = len(main.orders_db)
+    put = main.storage.put
+    
+    def failing_put(table, key, field=None):
+        if table == "orders":
+            raise RuntimeError("WAL writer has stopped")
+        put(table, key, field)
+    
+    monkeypatch.setattr(main.storage, "put", failing_put)
+    client = TestClient(main.app, raise_server_exceptions=False)
+    payload = {"items": [line(product, 2)], "shipping_address": {"city": "JHB"}}
+    assert client.post("/api/orders", json=payload, headers=headers).status_code == 500
+    assert stock(product) == 5
+    assert len(main.orders_db) == order_count
+    assert main.products_db[product["id"]].get("purchase_count", 0) == 0
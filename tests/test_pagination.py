@@ -0,0 +1,79 @@
+import base64
+import json
+
+import pytest
+
+
+def cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+@pytest.mark.parametrize("bad", [
+    cursor("a", 1),
+    cursor(1),
+    cursor(1, 2, 3),
+    cursor(True, 1),
+    "not base64!",
+    base64.urlsafe_b64encode(b"{}").decode(),
+])
+def test_malformed_review_cursor_is_rejected(client, bad):
+    response = client.get("/api/products/1/reviews", params={"cursor": bad})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("path, params, bad", [
+    ("/api/products", {"sort_by": "price_low"}, cursor("cheap", 1)),
+    ("/api/products", {"sort_by": "rating"}, cursor(1)),
+    ("/api/products", {}, cursor(1.5)),
+    ("/api/auctions", {}, cursor("1")),
+    ("/api/auctions/ending-soon", {}, cursor(None, 1)),
+])
+def test_malformed_listing_cursor_is_rejected(client, path, params, bad):
+    response = client.get(path, params={**params, "cursor": bad})
+    assert response.status_code == 400
+
+
+def walk_pages(client, path, headers=None, **params):
+    ids, next_cursor = [], None
+    while True:
+        query = {**params, "limit": 1}
+        if next_cursor:
+            query["cursor"] = next_cursor
+        response = client.get(path, params=query, headers=headers)
+        assert response.status_code == 200, response.text
+        ids += [record["id"] for record in response.json()]
+        next_cursor = response.headers.get("x-next-cursor")
+        if not next_cursor:
+            return ids
+
+
+def test_order_pages_cover_interleaved_bulk_and_single_inserts(client, buyer, make_product):
+    _, headers = buyer
+    product = make_product(stock=100)
+    line = {"items": [{"product_id": product["id"], "quantity": 1}], "shipping_address": {"city": "JHB"}}
+    
+    created = [client.post("/api/orders", json=line, headers=headers).json()["id"]]
+    bulk = client.post("/api/orders/bulk", json=[line, line], headers=headers).json()
+    created += [result["order_id"] for result in bulk["results"]]
+    for _ in range(3):
+        created.append(client.post("/api/orders", json=line, headers=headers).json()["id"])
+    
+    assert created == sorted(created)
+    assert walk_pages(client, "/api/orders", headers) == created
+
+
+def test_secondary_index_buckets_stay_in_id_order():
+    from main import by_field
+    
+    index = by_field("status")
+    for record_id in (1, 2, 3, 4):
+        index.index({"id": record_id, "status": "active"})
+    # Records move between buckets in an arbitrary order
+    for record_id in (3, 1, 4, 2):
+        index.index({"id": record_id, "status": "ended"})
+    index.index({"id": 1, "status": "active"})
+    assert index.ids("ended") == [2, 3, 4]
+    assert index.ids("active") == [1]
+    index.index({"id": 5, "status": "ended"})
+    index.index({"id": 0, "status": "ended"})
+    assert index.ids("ended") == [0, 2, 3, 4, 5]
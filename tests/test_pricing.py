@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import main
+
+
+def old_history(now, changes):
+    start = (now - timedelta(days=60)).replace(minute=0, second=0, microsecond=0).timestamp()
+    return main.PriceHistory((start + 60 * i, 100.0 + i, 101.0 + i, 0) for i in range(changes))
+
+
+def test_compaction_yields_between_batches(monkeypatch):
+    now = datetime.now()
+    product_ids = range(900001, 900007)
+    for product_id in product_ids:
+        monkeypatch.setitem(main.price_history_db, product_id, old_history(now, 5))
+    monkeypatch.setattr(main, "PRICE_HISTORY_COMPACT_BATCH", 2)
+    
+    async def run():
+        ticks = []
+        
+        async def ticker():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0)
+        
+        task = asyncio.create_task(ticker())
+        compacted = await main.compact_price_histories(now)
+        task.cancel()
+        return compacted, len(ticks)
+    
+    compacted, ticks = asyncio.run(run())
+    assert compacted >= len(product_ids)
+    assert ticks >= 2
+    for product_id in product_ids:
+        history = main.price_history_db[product_id]
+        assert list(history) == [(history.timestamps[0], 100.0, 105.0, 0)]
+
+
+def test_batch_plan_matches_single_product_pricing(make_product):
+    for stock in (2, 20, 80):
+        make_product(stock=stock, category="Plan check", base_price=50.0 + stock)
+    plan = main.plan_reprice()
+    planned = dict(zip(plan["product_ids"].tolist(), plan["new_prices"].tolist()))
+    assert plan["catalog_size"] == len(main.products_db)
+    for product_id, product in main.products_db.items():
+        expected = main.calculate_dynamic_price(product_id)
+        assert planned.get(product_id, product["base_price"]) == pytest.approx(expected), product_id
+
+
+def test_dry_run_reports_the_diff_without_writing(client, admin_headers, make_product):
+    for base_price in (10.0, 500.0):
+        make_product(category="Dry run", base_price=base_price)
+    prices = {product_id: product["base_price"] for product_id, product in main.products_db.items()}
+    plan = main.plan_reprice()
+    
+    response = client.post("/api/pricing/reprice", params={"dry_run": True, "limit": 1000}, headers=admin_headers)
+    assert response.status_code == 200
+    summary = response.json()
+    assert {product_id: product["base_price"] for product_id, product in main.products_db.items()} == prices
+    assert summary["changed"] == len(plan["product_ids"])
+    assert summary["increased"] + summary["decreased"] == summary["changed"]
+    for change in summary["changes"]:
+        assert change["old_price"] == prices[change["product_id"]]
+        assert change["new_price"] != change["old_price"]
+    
+    response = client.post("/api/pricing/reprice", params={"category": "Dry run", "limit": 1000}, headers=admin_headers)
+    in_category = {p for p in plan["product_ids"].tolist() if main.products_db[p]["category"] == "Dry run"}
+    assert {change["product_id"] for change in response.json()["changes"]} == in_category
+
+
+def test_large_reprice_returns_before_the_similarity_rebuild(restore_catalog):
+    old_index = main.similarity_index
+    main.personalized_scorer.profile(1)
+    # Every product "moves" to its current price, which forces full rebuilds
+    prices = np.array([product["base_price"] for product in main.products_db.values()])
+    plan = {"product_ids": np.array(list(main.products_db)), "old_prices": prices, "new_prices": prices}
+    
+    async def run():
+        old_price_index = main.price_index
+        await main.apply_reprice(plan)
+        assert main.price_index is not old_price_index
+        assert main.similarity_index is old_index
+        await main.similarity_refresh
+    
+    asyncio.run(run())
+    assert main.similarity_index is not old_index
+    assert main.personalized_scorer.index is main.similarity_index
+    assert not main.personalized_scorer.profiles
+    assert len(main.personalized_scorer.boosts) == len(main.similarity_index.prices)
+    fresh = main.SimilarityIndex()
+    fresh.rebuild(main.products_db)
+    product_id = next(iter(main.products_db))
+    assert main.similarity_index.similar(product_id, 5) == fresh.similar(product_id, 5)
+
+
+def price_walk(start, changes, step_minutes, seed=25):
+    """A continuous price path: each change starts from the previous new price"""
+    rng = np.random.default_rng(seed)
+    price, entries = 100.0, []
+    for i in range(changes):
+        new_price = round(price * (1 + rng.uniform(-0.05, 0.05)), 2)
+        entries.append((start + 60 * step_minutes * i, price, new_price, i % 2))
+        price = new_price
+    return entries
+
+
+def test_history_range_returns_changes_in_the_half_open_window(client, make_product, monkeypatch):
+    product = make_product()
+    start = datetime(2026, 3, 1, 10, 0)
+    entries = price_walk(start.timestamp(), 200, 7)
+    monkeypatch.setitem(main.price_history_db, product["id"], main.PriceHistory(entries))
+    
+    window_start, window_end = start + timedelta(minutes=70), start + timedelta(hours=9)
+    response = client.get(f"/api/pricing/history/{product['id']}", params={
+        "start": window_start.isoformat(), "end": window_end.isoformat()
+    })
+    changes = response.json()["changes"]
+    expected = [entry for entry in entries if window_start.timestamp() <= entry[0] < window_end.timestamp()]
+    assert [change["new_price"] for change in changes] == [entry[2] for entry in expected]
+    # Both bounds fall on a change: the first is included, the last is not
+    assert datetime.fromisoformat(changes[0]["timestamp"]) == window_start
+    assert datetime.fromisoformat(changes[-1]["timestamp"]) < window_end
+    assert client.get(f"/api/pricing/history/{product['id']}", params={"bucket": "week"}).status_code == 400
+
+
+@pytest.mark.parametrize("bucket", ["minute", "hour", "day"])
+def test_history_buckets_hold_min_max_and_last_price(client, make_product, monkeypatch, bucket):
+    product = make_product()
+    entries = price_walk(datetime(2026, 3, 1, 22, 0).timestamp(), 300, 0.4)
+    entries += price_walk(entries[-1][0] + 86400, 100, 45, seed=26)
+    monkeypatch.setitem(main.price_history_db, product["id"], main.PriceHistory(entries))
+    
+    seconds = main.PRICE_HISTORY_BUCKETS[bucket]
+    groups = {}
+    for timestamp, _, new_price, _ in entries:
+        groups.setdefault(int(timestamp // seconds), []).append(new_price)
+    
+    response = client.get(f"/api/pricing/history/{product['id']}", params={"bucket": bucket})
+    points = response.json()["points"]
+    assert [datetime.fromisoformat(point["timestamp"]).timestamp() for point in points] == [
+        number * seconds for number in groups
+    ]
+    assert [(point["min"], point["max"], point["last"], point["changes"]) for point in points] == [
+        (min(prices), max(prices), prices[-1], len(prices)) for prices in groups.values()
+    ]
+
+
+def test_compaction_keeps_the_price_path_continuous():
+    now = datetime(2026, 6, 1, 12, 0).timestamp()
+    entries = price_walk(now - 60 * 86400, 4000, 20)
+    history = main.PriceHistory(entries)
+    retain_after, compact_before = now - 50 * 86400, now - 10 * 86400
+    assert history.compact(retain_after, compact_before)
+    
+    compacted = list(history)
+    kept = [entry for entry in entries if entry[0] >= retain_after]
+    # Retention drops the oldest changes; the first kept one still starts from its old price
+    assert compacted[0][1] == kept[0][1]
+    assert compacted[-1] == entries[-1]
+    for previous, entry in zip(compacted, compacted[1:]):
+        assert entry[1] == previous[2]
+    
+    old = [entry for entry in compacted if entry[0] < compact_before]
+    hours = [int(entry[0] // 3600) for entry in old]
+    assert hours == sorted(set(hours))
+    assert compacted[len(old):] == [entry for entry in entries if entry[0] >= compact_before]
+    assert not history.compact(retain_after, compact_before)
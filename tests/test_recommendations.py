@@ -0,0 +1,98 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+
+def test_profile_cache_evicts_least_recently_used(monkeypatch):
+    scorer = main.PersonalizedScorer(main.similarity_index)
+    monkeypatch.setattr(main, "MAX_CACHED_PROFILES", 2)
+    first = scorer.profile(101)
+    scorer.profile(102)
+    assert scorer.profile(101) is first  # Refreshes 101
+    scorer.profile(103)
+    assert list(scorer.profiles) == [101, 103]
+    # An evicted profile is rebuilt from history when next needed
+    assert scorer.profile(102) is not None
+    assert list(scorer.profiles) == [103, 102]
+
+
+def random_product(rng, product_id):
+    return {
+        "id": product_id,
+        "category": rng.choice(["Audio", "Laptops", "Phones", "Cameras"]),
+        "base_price": round(rng.uniform(50, 5000), 2),
+        "tags": rng.sample(["wireless", "pro", "budget", "refurbished", "gaming", "compact"], rng.randint(0, 3)),
+    }
+
+
+def test_incremental_top_k_matches_a_full_rebuild():
+    rng = random.Random(8)
+    products = {product_id: random_product(rng, product_id) for product_id in range(1, 61)}
+    index = main.SimilarityIndex(k=5)
+    index.rebuild(products)
+    
+    for step in range(80):
+        if step % 4 == 0:
+            product = random_product(rng, len(products) + 1)
+            products[product["id"]] = product
+        else:
+            product = products[rng.randint(1, len(products))]
+            changed = random_product(rng, product["id"])
+            field = rng.choice(["category", "base_price", "tags"])
+            product[field] = changed[field]
+        index.update(product)
+    
+    rebuilt = main.SimilarityIndex(k=5)
+    rebuilt.rebuild(products)
+    for product_id in products:
+        incremental = index.neighbours[product_id]
+        assert [pid for _, pid in incremental] == [pid for _, pid in rebuilt.neighbours[product_id]]
+        assert [score for score, _ in incremental] == pytest.approx([score for score, _ in rebuilt.neighbours[product_id]])
+
+
+def order(order_id, when, *product_ids):
+    return {"id": order_id, "created_at": when, "items": [{"product_id": pid} for pid in product_ids]}
+
+
+def test_co_purchases_rank_recent_orders_above_old_ones():
+    now = datetime.now()
+    index = main.CoPurchaseIndex(half_life_days=90)
+    index.rebuild({
+        1: order(1, now - timedelta(days=200), 1, 2),
+        2: order(2, now - timedelta(days=190), 1, 2),
+        3: order(3, now - timedelta(days=1), 1, 3),
+        4: order(4, now, 1, 4),
+        5: order(5, now, 4, 1),
+    })
+    # Two orders 200 days back weigh less than one from yesterday
+    assert index.bought_with(1, 3) == [4, 3, 2]
+    assert index.bought_with(2, 3) == [1]
+
+
+def test_incremental_co_purchase_counts_match_a_rebuild():
+    rng = random.Random(9)
+    start = datetime.now() - timedelta(days=30)
+    orders = {}
+    for order_id in range(1, 301):
+        when = start + timedelta(days=30 * order_id / 300)
+        orders[order_id] = order(order_id, when, *rng.sample(range(1, 21), rng.randint(1, 4)))
+    
+    # A short half-life over 30 days forces the incremental index to rescale
+    index = main.CoPurchaseIndex(half_life_days=0.05)
+    index._epoch = start.timestamp()
+    for placed in orders.values():
+        index.add_order(placed)
+    rebuilt = main.CoPurchaseIndex(half_life_days=0.05)
+    rebuilt.rebuild(orders)
+    
+    # Both count in the same decayed units, up to their different epochs
+    factor = 2.0 ** ((index._epoch - rebuilt._epoch) / index.half_life)
+    assert index.counts.keys() == rebuilt.counts.keys()
+    for product_id, counts in rebuilt.counts.items():
+        assert counts.keys() == index.counts[product_id].keys()
+        for other_id, count in counts.items():
+            assert index.counts[product_id][other_id] * factor == pytest.approx(count, rel=1e-9)
+        assert index.bought_with(product_id, 5) == rebuilt.bought_with(product_id, 5)
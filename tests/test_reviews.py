@@ -0,0 +1,60 @@
+import itertools
+
+import pytest
+
+from conftest import auth_headers
+from test_orders import place_order, set_status
+
+_emails = itertools.count(1)
+
+
+def register(client):
+    email = f"reviewer{next(_emails)}@example.com"
+    response = client.post("/auth/register", params={"email": email, "username": "reviewer", "password": "pw"})
+    return auth_headers(response.json()["user_id"])
+
+
+def review(client, headers, product_id, rating):
+    return client.post("/api/reviews", params={"product_id": product_id, "rating": rating, "comment": "ok"}, headers=headers)
+
+
+def test_rating_summary_counts_all_and_verified_reviews(client, make_product):
+    product = make_product(stock=10)
+    verified = []
+    for _ in range(2):
+        headers = register(client)
+        order = place_order(client, headers, product, 1)
+        for status in ("paid", "shipped", "delivered"):
+            set_status(client, order["id"], status)
+        verified.append(headers)
+    
+    ratings = [(verified[0], 5), (verified[1], 4), (register(client), 1), (register(client), 4), (register(client), 2)]
+    for headers, rating in ratings:
+        assert review(client, headers, product["id"], rating).status_code == 200
+    
+    summary = client.get(f"/api/products/{product['id']}/rating-summary").json()
+    assert summary["reviews_count"] == 5
+    assert summary["average_rating"] == pytest.approx(3.2)
+    assert summary["histogram"] == {"1": 1, "2": 1, "3": 0, "4": 2, "5": 1}
+    assert summary["verified_reviews_count"] == 2
+    assert summary["verified_average_rating"] == pytest.approx(4.5)
+    
+    listed = client.get(f"/api/products/{product['id']}")
+    assert (listed.json()["rating"], listed.json()["reviews_count"]) == (3.2, 5)
+
+
+def test_rating_summary_of_an_unreviewed_product_is_empty(client, make_product):
+    product = make_product()
+    summary = client.get(f"/api/products/{product['id']}/rating-summary").json()
+    assert summary["reviews_count"] == summary["verified_reviews_count"] == 0
+    assert summary["histogram"] == {str(star): 0 for star in range(1, 6)}
+
+
+def test_reviews_reject_unknown_products_and_out_of_range_ratings(client, make_product):
+    product = make_product()
+    headers = register(client)
+    assert client.get("/api/products/999999/rating-summary").status_code == 404
+    assert review(client, headers, 999999, 5).status_code == 404
+    for rating in (0, 6):
+        assert review(client, headers, product["id"], rating).status_code == 422
+    assert client.get(f"/api/products/{product['id']}/rating-summary").json()["reviews_count"] == 0
@@ -0,0 +1,156 @@
+import asyncio
+import copy
+
+import pytest
+
+import main
+
+
+def test_search_matches_inside_words(client, make_product):
+    product = make_product(title="Zyxbook Air Ultralight")
+    response = client.get("/api/products", params={"q": "book", "limit": 100})
+    assert product["id"] in [p["id"] for p in response.json()]
+
+
+def test_search_is_a_substring_filter(client, make_product):
+    kept = make_product(title="Quorvex Pro Camera")
+    dropped = make_product(title="Quorvex Camera Pro")
+    response = client.get("/api/products", params={"q": "quorvex pro", "limit": 100})
+    ids = [p["id"] for p in response.json()]
+    assert kept["id"] in ids
+    assert dropped["id"] not in ids
+
+
+def test_search_keeps_non_ascii_letters(client, make_product):
+    cafe = make_product(title="Café Ñandú Mug")
+    make_product(title="Cafe Nandu Mug")
+    for q in ("café", "CAFÉ", "ñandú", "andú"):
+        response = client.get("/api/products", params={"q": q, "limit": 100})
+        assert [p["id"] for p in response.json() if "Mug" in p["title"]] == [cafe["id"]], q
+
+
+def test_substring_expansion_matches_a_vocabulary_scan():
+    index = main.CatalogIndex()
+    titles = ["macbook air", "notebook stand", "bookend", "ebook reader", "boo", "o", "straße"]
+    index.rebuild({i: {"id": i, "title": title} for i, title in enumerate(titles, 1)})
+    index.add({"id": 2, "title": "laptop stand"})  # "notebook" leaves the vocabulary
+    for fragment in ("o", "oo", "boo", "book", "ebook", "ook", "stand", "aße", "ß", "zzz"):
+        expected = sorted(term for term in index.postings if fragment in term)
+        assert sorted(index.expand_substring(fragment)) == expected, fragment
+    assert "notebook" not in index.expand_substring("book")
+
+
+def test_query_without_terms_matches_nothing(client, make_product):
+    make_product(title="Anything")
+    assert client.get("/api/products", params={"q": "!!!"}).json() == []
+    assert client.get("/api/search/advanced", params={"q": "--"}).json() == []
+
+
+def test_fuzzy_search_tolerates_typos(client, make_product):
+    product = make_product(title="Plimberton Kettle")
+    response = client.get("/api/search/advanced", params={"q": "plimbertn"})
+    assert product["id"] in [p["id"] for p in response.json()]
+
+
+def test_fuzzy_search_tolerates_insertions_and_deletions(client, make_product):
+    product = make_product(title="Thermoflask Bottle")
+    for typo in ("thermofflask", "thermoflaskk", "termoflask", "thermoflsk"):
+        response = client.get("/api/search/advanced", params={"q": typo})
+        assert product["id"] in [p["id"] for p in response.json()], typo
+    # Beyond the tolerance for the term's length
+    response = client.get("/api/search/advanced", params={"q": "thrmflsk"})
+    assert product["id"] not in [p["id"] for p in response.json()]
+
+
+def test_fuzzy_lookup_follows_product_updates(client, seller_headers, make_product):
+    product = make_product(title="Quintaphone Handset")
+    response = client.put(f"/api/products/{product['id']}", json={"title": "Brandolier Handset"}, headers=seller_headers)
+    assert response.status_code == 200
+    
+    def fuzzy_ids(q):
+        return [p["id"] for p in client.get("/api/search/advanced", params={"q": q}).json()]
+    
+    assert product["id"] in fuzzy_ids("brandoleir")
+    assert product["id"] not in fuzzy_ids("quintafone")
+    assert "quintaphone" not in main.catalog_index.expand_fuzzy("quintafone")
+
+
+def test_removed_terms_leave_fuzzy_lookups_and_the_tree_is_compacted():
+    index = main.CatalogIndex()
+    index.rebuild({1: {"id": 1, "title": "anchor"}})
+    for n in range(200):
+        index.add({"id": 2, "title": f"widget{n:03d}x"})
+    index.remove(2)
+    assert index.expand_fuzzy("widget199x") == []
+    assert index.search("widget", fuzzy=True) == []
+    assert index.search("anchr", fuzzy=True) == [1]
+    # Dead terms are dropped from the BK-tree once they dominate it
+    assert index.fuzzy_tree.size <= 2 * len(index.postings) + 64
+    assert not index.grams.get("wid")
+
+
+def test_suggestion_limit_is_clamped(client, make_product):
+    for n in range(12):
+        make_product(title=f"Vorbledash model {n}")
+    response = client.get("/api/search/suggestions", params={"q": "vorbledash", "limit": 20})
+    assert response.status_code == 200
+    assert len(response.json()) == 10
+
+
+def test_suggestion_refresh_replays_products_indexed_during_rebuild(make_product, monkeypatch):
+    product = make_product(title="Plain Title")
+    rebuild = main.SuggestionIndex.rebuild
+
+    def rebuild_then_edit(index, products):
+        rebuild(index, products)
+        # An update landing on the event loop while the worker thread builds
+        main.products_db[product["id"]]["title"] = "Grindlewax Special"
+        main.index_product(main.products_db[product["id"]])
+
+    monkeypatch.setattr(main.SuggestionIndex, "rebuild", rebuild_then_edit)
+    asyncio.run(main.refresh_suggestions())
+    assert main.product_change_trackers == []
+    assert main.suggestion_index.complete("grindle", 5) == ["Grindlewax Special"]
+
+
+def listing(client, **params):
+    products, next_cursor = [], None
+    while True:
+        query = {**params, "limit": 1}  # A cursor between every pair, equal prices included
+        if next_cursor:
+            query["cursor"] = next_cursor
+        response = client.get("/api/products", params=query)
+        assert response.status_code == 200, response.text
+        products += response.json()
+        next_cursor = response.headers.get("x-next-cursor")
+        if not next_cursor:
+            return products
+
+
+@pytest.mark.parametrize("currency", ["ZAR", "USD"])
+@pytest.mark.parametrize("sort_by", ["price_low", "price_high", "relevance"])
+def test_price_filter_and_sort_match_a_brute_force_scan(client, make_product, currency, sort_by):
+    for base_price, product_currency in [(120.0, "ZAR"), (9.99, "USD"), (450.0, "ZAR"), (30.0, "ZIG"), (120.0, "ZAR")]:
+        make_product(base_price=base_price, currency=product_currency)
+    rates = main.exchange_rates.current
+    min_price = rates.convert(100.0, "ZAR", currency)
+    max_price = rates.convert(600.0, "ZAR", currency)
+    before = copy.deepcopy(main.products_db)
+    
+    listed = listing(client, min_price=min_price, max_price=max_price, sort_by=sort_by, currency=currency)
+    
+    expected = [
+        product for product in before.values()
+        if min_price <= rates.convert(product["base_price"], product["currency"], currency) <= max_price
+    ]
+    zar = lambda product: product["base_price"] / rates.rates[product["currency"]]
+    if sort_by == "price_low":
+        expected.sort(key=lambda product: (zar(product), product["id"]))
+    elif sort_by == "price_high":
+        expected.sort(key=lambda product: (-zar(product), product["id"]))
+    else:
+        expected.sort(key=lambda product: product["id"])
+    assert [product["id"] for product in listed] == [product["id"] for product in expected]
+    assert all(product["display_currency"] == currency for product in listed)
+    # Display prices go on copies; the stored records are untouched
+    assert main.products_db == before
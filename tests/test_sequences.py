@@ -0,0 +1,59 @@
+from main import SequenceService, SQLiteStorage
+
+
+def local_lease(leases=None):
+    high_water = {}
+    
+    def lease(entity, size, floor):
+        if leases is not None:
+            leases.append((entity, size, floor))
+        start = max(high_water.get(entity, 0), floor) + 1
+        high_water[entity] = start + size - 1
+        return range(start, start + size)
+    return lease
+
+
+def test_single_and_batch_ids_interleave_monotonically():
+    sequences = SequenceService(local_lease(), block_size=4)
+    sequences.seed("orders", 7)
+    issued = [sequences.next_id("orders")]
+    issued += list(sequences.next_ids("orders", 3))
+    issued += [sequences.next_id("orders"), sequences.next_id("orders")]
+    issued += list(sequences.next_ids("orders", 6))
+    issued += [sequences.next_id("orders")]
+    assert issued == sorted(issued)
+    assert len(set(issued)) == len(issued)
+    assert issued[0] == 8
+
+
+def test_seed_never_moves_backwards():
+    leases = []
+    sequences = SequenceService(local_lease(leases))
+    sequences.seed("users", 10)
+    sequences.seed("users", 3)
+    assert sequences.next_id("users") == 11
+    assert sequences.next_id("users") == 12
+    assert sequences.next_id("products") == 1
+    # One lease per block, not per id
+    assert leases == [("users", 100, 10), ("products", 100, 0)]
+
+
+def test_workers_on_one_database_lease_disjoint_blocks(tmp_path):
+    path = str(tmp_path / "shared.db")
+    backends = [SQLiteStorage(path, {}) for _ in range(3)]
+    workers = [SequenceService(backend.lease_ids, block_size=5) for backend in backends[:2]]
+    for worker in workers:
+        worker.seed("users", 3)  # Both loaded the same three users
+    
+    issued = [[worker.next_id("users") for _ in range(7)] for worker in workers]
+    issued.append(list(workers[0].next_ids("users", 12)))
+    assert all(ids == sorted(ids) for ids in issued)
+    every_id = [user_id for ids in issued for user_id in ids]
+    assert len(set(every_id)) == len(every_id)
+    assert min(every_id) == 4
+    
+    # A restarted worker continues above every lease
+    restarted = SequenceService(backends[2].lease_ids)
+    assert restarted.next_id("users") > max(every_id)
+    for backend in backends:
+        backend.close()
@@ -0,0 +1,112 @@
+from collections import defaultdict
+from datetime import datetime
+
+import pytest
+
+import main
+from main import SQLiteStorage
+
+
+def make_tables():
+    return {
+        "users": {}, "products": {}, "orders": {}, "bids": {},
+        "escrow": {}, "user_activity": defaultdict(list),
+    }
+
+
+def make_user(user_id, email, password="secret"):
+    return {
+        "id": user_id, "email": email, "username": email.split("@")[0],
+        "password_hash": main.hash_password(password), "role": "buyer",
+        "is_verified": False, "created_at": datetime(2026, 1, 1),
+    }
+
+
+def open_worker(path, tables=None):
+    tables = tables if tables is not None else make_tables()
+    storage = SQLiteStorage(path, tables)
+    storage.recover()
+    return storage, tables
+
+
+def test_seed_and_load_round_trip_after_restart(tmp_path):
+    path = str(tmp_path / "shop.db")
+    seeded = make_tables()
+    seeded["users"][1] = make_user(1, "first@example.com")
+    seeded["orders"][1] = {"id": 1, "user_id": 1, "status": main.OrderStatus.PENDING, "items": []}
+    seeded["escrow"][1] = 250.0
+    seeded["user_activity"][1].append({"type": "view", "product_id": 3})
+    storage, tables = open_worker(path, seeded)
+    
+    # Changes after seeding: an insert, an update and a delete
+    tables["users"][2] = make_user(2, "Second@Example.com")
+    storage.put("users", 2)
+    tables["orders"][1]["status"] = main.OrderStatus.SHIPPED
+    storage.put("orders", 1, "status")
+    del tables["escrow"][1]
+    storage.delete("escrow", 1)
+    tables["user_activity"][1].append({"type": "view", "product_id": 4})
+    storage.append("user_activity", 1, tables["user_activity"][1][-1])
+    storage.close()
+    
+    storage, loaded = open_worker(path)
+    storage.close()
+    assert loaded["users"] == tables["users"]
+    assert loaded["orders"][1]["status"] == "shipped"
+    assert loaded["escrow"] == {}
+    assert loaded["user_activity"] == {1: [{"type": "view", "product_id": 3}, {"type": "view", "product_id": 4}]}
+
+
+def test_insert_never_overwrites_a_row_from_another_worker(tmp_path):
+    path = str(tmp_path / "shop.db")
+    first, first_tables = open_worker(path)
+    second, second_tables = open_worker(path)
+    first_tables["users"][5] = make_user(5, "a@example.com")
+    first.put("users", 5)
+    first.close()
+    second_tables["users"][5] = make_user(5, "b@example.com")
+    second.put("users", 5)
+    second.close()
+    
+    storage, loaded = open_worker(path)
+    storage.close()
+    assert loaded["users"][5]["email"] == "a@example.com"
+
+
+def test_login_checks_the_password(client):
+    email = "login-check@example.com"
+    response = client.post("/auth/register", params={"email": email, "username": "login", "password": "right"})
+    user_id = response.json()["user_id"]
+    
+    response = client.post("/auth/login", data={"username": email, "password": "right"})
+    assert response.status_code == 200
+    assert main.verify_token(response.json()["access_token"])["sub"] == str(user_id)
+    response = client.post("/auth/login", data={"username": email, "password": "wrong"})
+    assert response.status_code == 401
+
+
+@pytest.fixture
+def remote_user():
+    """A user id no other test uses; dropped from the shared stores afterwards"""
+    user_id = 10 ** 6
+    yield user_id
+    main.users_db.pop(user_id, None)
+    main.users_by_email.remove(user_id)
+
+
+def test_login_finds_users_registered_through_another_worker(client, tmp_path, monkeypatch, remote_user):
+    path = str(tmp_path / "shop.db")
+    other, other_tables = open_worker(path)
+    other_tables["users"][remote_user] = make_user(remote_user, "Elsewhere@example.com", "pw")
+    other.put("users", remote_user)
+    other.close()
+    
+    # This worker never saw the registration; its lookup falls back to disk
+    monkeypatch.setattr(main, "storage", SQLiteStorage(path, main.TABLES))
+    assert remote_user not in main.users_db
+    response = client.post("/auth/login", data={"username": "elsewhere@example.com", "password": "pw"})
+    assert response.status_code == 200
+    assert main.verify_token(response.json()["access_token"])["sub"] == str(remote_user)
+    assert client.post("/auth/login", data={"username": "elsewhere@example.com", "password": "no"}).status_code == 401
+    assert client.post("/auth/login", data={"username": "nobody@example.com", "password": "pw"}).status_code == 401
+    main.storage.close()
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import threading
+from collections import defaultdict
+
+import pytest
+
+from main import WALStorage
+
+
+def make_tables():
+    return {"orders": {}, "user_activity": defaultdict(list)}
+
+
+def open_wal(directory):
+    tables = make_tables()
+    wal = WALStorage(str(directory), tables)
+    wal.recover()
+    return wal, tables
+
+
+def put_order(wal, tables, order_id, status="pending"):
+    tables["orders"][order_id] = {"id": order_id, "status": status}
+    wal.put("orders", order_id)
+
+
+def test_recovery_replays_log(tmp_path):
+    wal, tables = open_wal(tmp_path)
+    for order_id in range(1, 4):
+        put_order(wal, tables, order_id)
+    tables["orders"][2]["status"] = "shipped"
+    wal.put("orders", 2, "status")
+    wal.delete("orders", 3)
+    wal.close()
+    
+    wal, recovered = open_wal(tmp_path)
+    wal.close()
+    assert recovered["orders"] == {1: {"id": 1, "status": "pending"}, 2: {"id": 2, "status": "shipped"}}
+
+
+def test_recovery_drops_torn_tail(tmp_path):
+    wal, tables = open_wal(tmp_path)
+    put_order(wal, tables, 1)
+    put_order(wal, tables, 2)
+    wal.close()
+    
+    segment = wal._segments()[-1]
+    intact_size = os.path.getsize(segment)
+    with open(segment, "ab") as f:
+        f.write(b"\x40\x00\x00\x00\x01\x02")  # Header promising 64 bytes, then a crash
+    
+    wal, recovered = open_wal(tmp_path)
+    assert sorted(recovered["orders"]) == [1, 2]
+    assert os.path.getsize(segment) == intact_size
+    # The log continues cleanly after the truncated record
+    put_order(wal, recovered, 3)
+    wal.close()
+    wal, recovered = open_wal(tmp_path)
+    wal.close()
+    assert sorted(recovered["orders"]) == [1, 2, 3]
+
+
+def test_recovery_stops_at_first_torn_segment(tmp_path):
+    wal, tables = open_wal(tmp_path)
+    put_order(wal, tables, 1)
+    put_order(wal, tables, 2)
+    wal.close()
+    first_segment = wal._segments()[0]
+    
+    # Records 3 and 4 land in a later segment
+    wal, tables = open_wal(tmp_path)
+    put_order(wal, tables, 3)
+    wal._queue.put(("rotate", wal.lsn + 1, threading.Event()))
+    put_order(wal, tables, 4)
+    wal.close()
+    assert len(wal._segments()) == 3
+    
+    # Damage record 2 in the first segment: 3 and 4 must not be replayed
+    with open(first_segment, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+    
+    wal, recovered = open_wal(tmp_path)
+    assert sorted(recovered["orders"]) == [1]
+    assert wal.lsn == 1
+    assert len([n for n in os.listdir(tmp_path) if n.endswith(".torn")]) == 2
+    put_order(wal, recovered, 5)
+    wal.close()
+    wal, recovered = open_wal(tmp_path)
+    wal.close()
+    assert sorted(recovered["orders"]) == [1, 5]
+
+
+def test_snapshot_is_a_consistent_cut(tmp_path):
+    wal, tables = open_wal(tmp_path)
+    put_order(wal, tables, 1)
+    tables["user_activity"][7].append("viewed")
+    wal.append("user_activity", 7, "viewed")
+    
+    frozen = wal._begin_snapshot()
+    # Writes after the cut go to the next segment and are replayed from it
+    tables["user_activity"][7].append("bought")
+    wal.append("user_activity", 7, "bought")
+    tables["orders"][1]["status"] = "shipped"
+    wal.put("orders", 1, "status")
+    wal._write_snapshot(*frozen)
+    wal.close()
+    
+    wal, recovered = open_wal(tmp_path)
+    wal.close()
+    assert recovered["user_activity"][7] == ["viewed", "bought"]
+    assert recovered["orders"][1]["status"] == "shipped"
+
+
+class UnreadableTable(dict):
+    def items(self):
+        raise AssertionError("snapshot read a live table")
+
+
+def test_snapshot_does_not_read_live_tables(tmp_path):
+    tables = {"orders": UnreadableTable(), "user_activity": defaultdict(list)}
+    wal = WALStorage(str(tmp_path), tables)
+    wal.recover()
+    put_order(wal, tables, 1)
+    wal.snapshot()
+    put_order(wal, tables, 2)
+    wal.close()
+    
+    wal, recovered = open_wal(tmp_path)
+    wal.close()
+    assert sorted(recovered["orders"]) == [1, 2]
+
+
+def test_snapshots_build_on_each_other(tmp_path, monkeypatch):
+    monkeypatch.setattr("main.SNAPSHOT_CHUNK_ROWS", 2)
+    wal, tables = open_wal(tmp_path)
+    for order_id in range(1, 6):
+        put_order(wal, tables, order_id)
+    tables["user_activity"][7].append("viewed")
+    wal.append("user_activity", 7, "viewed")
+    wal.snapshot()
+    
+    tables["orders"][3]["status"] = "shipped"
+    wal.put("orders", 3, "status")
+    wal.delete("orders", 5)
+    tables["user_activity"][7].append("bought")
+    wal.append("user_activity", 7, "bought")
+    wal.snapshot()
+    assert len(wal._segments()) == 1
+    wal.close()
+    
+    wal, recovered = open_wal(tmp_path)
+    wal.close()
+    assert list(recovered["orders"]) == [1, 2, 3, 4]
+    assert recovered["orders"][3]["status"] == "shipped"
+    assert recovered["user_activity"][7] == ["viewed", "bought"]
+
+
+def test_sync_waits_for_fsync(tmp_path):
+    wal, tables = open_wal(tmp_path)
+    put_order(wal, tables, 1)
+    asyncio.run(wal.sync())
+    assert wal.durable_lsn == wal.lsn == 1
+    wal.close()
+
+
+def test_writer_failure_is_surfaced(tmp_path):
+    wal, tables = open_wal(tmp_path)
+    wal._file.close()  # The next write fails in the writer thread
+    put_order(wal, tables, 1)
+    with pytest.raises(RuntimeError):
+        asyncio.run(wal.sync())
+    assert wal.error is not None
+    with pytest.raises(RuntimeError):
+        put_order(wal, tables, 2)
+    wal.close()
+
+
+def test_health_fails_after_a_writer_error(client, monkeypatch):
+    import main
+    assert client.get("/health").status_code == 200
+    monkeypatch.setattr(main.storage, "error", OSError("disk full"))
+    response = client.get("/health")
+    assert response.status_code == 503
+    assert response.json()["status"] == "unhealthy"
+
+
+def test_id_leases_survive_restart(tmp_path):
+    wal = WALStorage(str(tmp_path), {"sequences": {}})
+    wal.recover()
+    assert wal.lease_ids("orders", 100, 3) == range(4, 104)
+    wal.close()
+    
+    wal = WALStorage(str(tmp_path), {"sequences": {}})
+    wal.recover()
+    # Ids of the first lease are never handed out again, used or not
+    assert wal.lease_ids("orders", 100, 3) == range(104, 204)
+    wal.close()